@@ -0,0 +1,334 @@
+#!/usr/bin/env python3
+"""
+Backfill histórico retomável
+Divide um intervalo de datas em tarefas por dia e módulo, executa busca e
+escrita com concorrência limitada e registra cada tarefa concluída em um
+SQLite local, para que uma queda ou redeploy continue de onde parou
+"""
+import os
+import json
+import time
+import uuid
+import queue
+import sqlite3
+import logging
+import threading
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+
+logger = logging.getLogger(__name__)
+
+TASK_PENDING = 'pending'
+TASK_RUNNING = 'running'
+TASK_DONE = 'done'
+TASK_FAILED = 'failed'
+
+BACKFILL_PENDING = 'pending'
+BACKFILL_RUNNING = 'running'
+BACKFILL_COMPLETED = 'completed'
+BACKFILL_FAILED = 'failed'
+
+
+def plan_days(start_date, end_date):
+    """Dias do intervalo (inclusive) como 'YYYY-MM-DD'"""
+    start = date.fromisoformat(start_date)
+    end = date.fromisoformat(end_date)
+    if start > end:
+        raise ValueError(f"Data inicial {start_date} depois da final {end_date}")
+    return [(start + timedelta(days=offset)).isoformat() for offset in range((end - start).days + 1)]
+
+
+class BackfillStore:
+    """Checkpoint dos backfills e de suas tarefas (módulo, dia) em SQLite"""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS backfills (
+                    id TEXT PRIMARY KEY,
+                    modules TEXT NOT NULL,
+                    start_date TEXT NOT NULL,
+                    end_date TEXT NOT NULL,
+                    write_mode TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    created_at TEXT NOT NULL,
+                    run_started_at REAL,
+                    finished_at TEXT,
+                    error TEXT
+                );
+                CREATE TABLE IF NOT EXISTS backfill_tasks (
+                    backfill_id TEXT NOT NULL,
+                    module TEXT NOT NULL,
+                    day TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    fetched INTEGER NOT NULL DEFAULT 0,
+                    written INTEGER NOT NULL DEFAULT 0,
+                    seconds REAL,
+                    finished_at REAL,
+                    error TEXT,
+                    PRIMARY KEY (backfill_id, module, day)
+                ) WITHOUT ROWID;
+            """)
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def create(self, modules, start_date, end_date, write_mode):
+        """Cria o backfill com uma tarefa por módulo e dia; reaproveita um igual ainda não concluído"""
+        days = plan_days(start_date, end_date)
+        modules_json = json.dumps(sorted(modules))
+        with self._lock, self._connect() as conn:
+            row = conn.execute("""
+                SELECT id FROM backfills
+                WHERE modules = ? AND start_date = ? AND end_date = ? AND write_mode = ? AND status != ?
+                ORDER BY created_at DESC LIMIT 1
+            """, (modules_json, start_date, end_date, write_mode, BACKFILL_COMPLETED)).fetchone()
+            if row:
+                return row[0], False
+
+            backfill_id = uuid.uuid4().hex[:12]
+            conn.execute(
+                "INSERT INTO backfills (id, modules, start_date, end_date, write_mode, status, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (backfill_id, modules_json, start_date, end_date, write_mode, BACKFILL_PENDING,
+                 datetime.now().isoformat())
+            )
+            conn.executemany(
+                "INSERT INTO backfill_tasks (backfill_id, module, day, status) VALUES (?, ?, ?, ?)",
+                ((backfill_id, module_name, day, TASK_PENDING) for day in days for module_name in sorted(modules))
+            )
+        return backfill_id, True
+
+    def get(self, backfill_id):
+        with self._lock, self._connect() as conn:
+            row = conn.execute(
+                "SELECT id, modules, start_date, end_date, write_mode, status, created_at, run_started_at, "
+                "finished_at, error FROM backfills WHERE id = ?", (backfill_id,)
+            ).fetchone()
+        if not row:
+            return None
+        keys = ('id', 'modules', 'start_date', 'end_date', 'write_mode', 'status', 'created_at',
+                'run_started_at', 'finished_at', 'error')
+        backfill = dict(zip(keys, row))
+        backfill['modules'] = json.loads(backfill['modules'])
+        return backfill
+
+    def list(self, limit=50):
+        with self._lock, self._connect() as conn:
+            ids = [row[0] for row in conn.execute(
+                "SELECT id FROM backfills ORDER BY created_at DESC LIMIT ?", (limit,)
+            )]
+        return [self.get(backfill_id) for backfill_id in ids]
+
+    def unfinished(self):
+        """Backfills que ainda têm tarefas a executar (inclusive interrompidos por queda)"""
+        with self._lock, self._connect() as conn:
+            return [row[0] for row in conn.execute(
+                "SELECT id FROM backfills WHERE status IN (?, ?) ORDER BY created_at",
+                (BACKFILL_PENDING, BACKFILL_RUNNING)
+            )]
+
+    def start_run(self, backfill_id):
+        """Marca o início de uma rodada e devolve as tarefas não concluídas, em ordem de dia"""
+        with self._lock, self._connect() as conn:
+            conn.execute(
+                "UPDATE backfills SET status = ?, run_started_at = ?, finished_at = NULL, error = NULL WHERE id = ?",
+                (BACKFILL_RUNNING, time.time(), backfill_id)
+            )
+            # Tarefas 'running' de uma rodada interrompida voltam para a fila
+            return conn.execute(
+                "SELECT module, day FROM backfill_tasks WHERE backfill_id = ? AND status != ? ORDER BY day, module",
+                (backfill_id, TASK_DONE)
+            ).fetchall()
+
+    def update_task(self, backfill_id, module_name, day, status, fetched=0, written=0, seconds=None, error=None):
+        with self._lock, self._connect() as conn:
+            conn.execute("""
+                UPDATE backfill_tasks SET status = ?, attempts = attempts + ?, fetched = ?, written = ?,
+                    seconds = ?, finished_at = ?, error = ?
+                WHERE backfill_id = ? AND module = ? AND day = ?
+            """, (status, 1 if status == TASK_RUNNING else 0, fetched, written, seconds,
+                  time.time() if status in (TASK_DONE, TASK_FAILED) else None, error,
+                  backfill_id, module_name, day))
+
+    def finish_run(self, backfill_id, status, error=None):
+        with self._lock, self._connect() as conn:
+            conn.execute(
+                "UPDATE backfills SET status = ?, finished_at = ?, error = ? WHERE id = ?",
+                (status, datetime.now().isoformat(), error, backfill_id)
+            )
+
+    def progress(self, backfill_id):
+        """Contagem de tarefas por status, linhas gravadas e ETA da rodada atual"""
+        backfill = self.get(backfill_id)
+        if not backfill:
+            return None
+        with self._lock, self._connect() as conn:
+            counts = dict(conn.execute(
+                "SELECT status, COUNT(*) FROM backfill_tasks WHERE backfill_id = ? GROUP BY status", (backfill_id,)
+            ).fetchall())
+            fetched, written = conn.execute(
+                "SELECT COALESCE(SUM(fetched), 0), COALESCE(SUM(written), 0) FROM backfill_tasks "
+                "WHERE backfill_id = ? AND status = ?", (backfill_id, TASK_DONE)
+            ).fetchone()
+            done_this_run = conn.execute(
+                "SELECT COUNT(*) FROM backfill_tasks WHERE backfill_id = ? AND status = ? AND finished_at >= ?",
+                (backfill_id, TASK_DONE, backfill['run_started_at'] or 0)
+            ).fetchone()[0]
+            failures = [
+                {'module': module_name, 'day': day, 'attempts': attempts, 'error': error}
+                for module_name, day, attempts, error in conn.execute(
+                    "SELECT module, day, attempts, error FROM backfill_tasks "
+                    "WHERE backfill_id = ? AND status = ? ORDER BY day LIMIT 20", (backfill_id, TASK_FAILED)
+                )
+            ]
+
+        total = sum(counts.values())
+        done = counts.get(TASK_DONE, 0)
+        remaining = total - done
+        eta_seconds = None
+        tasks_per_minute = None
+        if backfill['status'] == BACKFILL_RUNNING and backfill['run_started_at'] and done_this_run:
+            elapsed = time.time() - backfill['run_started_at']
+            rate = done_this_run / elapsed if elapsed > 0 else None
+            if rate:
+                tasks_per_minute = round(rate * 60, 1)
+                eta_seconds = round(remaining / rate, 1)
+
+        backfill.pop('run_started_at', None)
+        backfill.update({
+            'tasks': {
+                'total': total,
+                'done': done,
+                'pending': counts.get(TASK_PENDING, 0),
+                'running': counts.get(TASK_RUNNING, 0),
+                'failed': counts.get(TASK_FAILED, 0)
+            },
+            'percent': round(100.0 * done / total, 1) if total else 100.0,
+            'records_fetched': fetched,
+            'records_written': written,
+            'tasks_per_minute': tasks_per_minute,
+            'eta_seconds': eta_seconds,
+            'failures': failures
+        })
+        return backfill
+
+
+class BackfillRunner:
+    """Executa as tarefas de um backfill em dois estágios com concorrência limitada
+
+    fetch_workers threads buscam e transformam (fetch(módulo, dia) -> registros,
+    transform(módulo, registros) -> linhas); write_workers threads gravam
+    (write(módulo, linhas) -> quantidade ou None). A fila entre os estágios tem
+    no máximo queue_size dias, limitando a memória quando a escrita é o gargalo.
+    Os dias podem ser gravados fora de ordem entre si.
+    """
+
+    def __init__(self, store, fetch, transform, write, fetch_workers=4, write_workers=1, queue_size=8, retries=1):
+        self.store = store
+        self.fetch = fetch
+        self.transform = transform
+        self.write = write
+        self.fetch_workers = max(1, fetch_workers)
+        self.write_workers = max(1, write_workers)
+        self.queue_size = max(1, queue_size)
+        self.retries = retries
+
+    def run(self, backfill_id, progress=None):
+        """Roda as tarefas pendentes; retorna o progresso final (status completed ou failed)"""
+        tasks = self.store.start_run(backfill_id)
+        logger.info(f"🗓️ Backfill {backfill_id}: {len(tasks)} tarefa(s) pendente(s)")
+
+        task_queue = queue.Queue()
+        for task in tasks:
+            task_queue.put(task)
+        write_queue = queue.Queue(maxsize=self.queue_size)
+
+        def fetch_loop():
+            while True:
+                try:
+                    module_name, day = task_queue.get_nowait()
+                except queue.Empty:
+                    return
+                write_queue.put(self._fetch_task(backfill_id, module_name, day))
+
+        def write_loop():
+            while True:
+                item = write_queue.get()
+                if item is None:
+                    return
+                self._write_task(backfill_id, *item)
+                if progress:
+                    snapshot = self.store.progress(backfill_id)
+                    progress('backfill', tasks_done=snapshot['tasks']['done'],
+                             tasks_total=snapshot['tasks']['total'], eta_seconds=snapshot['eta_seconds'])
+
+        fetchers = [threading.Thread(target=fetch_loop, name=f'backfill-fetch-{i}', daemon=True)
+                    for i in range(min(self.fetch_workers, max(1, len(tasks))))]
+        writers = [threading.Thread(target=write_loop, name=f'backfill-write-{i}', daemon=True)
+                   for i in range(self.write_workers)]
+        for thread in fetchers + writers:
+            thread.start()
+        for thread in fetchers:
+            thread.join()
+        for _ in writers:
+            write_queue.put(None)
+        for thread in writers:
+            thread.join()
+
+        snapshot = self.store.progress(backfill_id)
+        failed = snapshot['tasks']['total'] - snapshot['tasks']['done']
+        if failed:
+            self.store.finish_run(backfill_id, BACKFILL_FAILED, f"{failed} tarefa(s) falharam; retome o backfill")
+        else:
+            self.store.finish_run(backfill_id, BACKFILL_COMPLETED)
+        logger.info(f"🗓️ Backfill {backfill_id} finalizado: {snapshot['tasks']['done']}/{snapshot['tasks']['total']} tarefas")
+        return self.store.progress(backfill_id)
+
+    def _fetch_task(self, backfill_id, module_name, day):
+        """Busca e transforma um dia com novas tentativas; retorna o item para o estágio de escrita"""
+        started = time.time()
+        error = None
+        for attempt in range(self.retries + 1):
+            self.store.update_task(backfill_id, module_name, day, TASK_RUNNING)
+            try:
+                records = self.fetch(module_name, day)
+                if records is not None:
+                    rows = self.transform(module_name, records) if records else []
+                    return module_name, day, len(records), rows, started, None
+                error = 'Erro ao buscar dados'
+            except Exception as e:
+                error = str(e)
+            if attempt < self.retries:
+                time.sleep(2 ** attempt)
+        return module_name, day, 0, None, started, error
+
+    def _write_task(self, backfill_id, module_name, day, fetched, rows, started, error):
+        if error is None and rows:
+            try:
+                written = self.write(module_name, rows)
+            except Exception as e:
+                written, error = None, str(e)
+            if written is None and error is None:
+                error = 'Erro ao enviar dados para Google Sheets'
+        else:
+            written = 0
+
+        seconds = round(time.time() - started, 3)
+        if error:
+            logger.warning(f"Backfill {backfill_id}: {module_name} {day} falhou: {error}")
+            self.store.update_task(backfill_id, module_name, day, TASK_FAILED, fetched, 0, seconds, error)
+        else:
+            self.store.update_task(backfill_id, module_name, day, TASK_DONE, fetched, written, seconds)
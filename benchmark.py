@@ -0,0 +1,568 @@
+#!/usr/bin/env python3
+"""
+Benchmark offline do pipeline ContaHub -> Google Sheets
+Sobe um ContaHub falso em HTTP local, num subprocesso (login e /query com dados
+sintéticos), usa um backend falso do Google Sheets e mede o pipeline completo e
+cada etapa (vazão e pico de memória), gravando os resultados em JSON para
+comparar commits. O servidor roda fora do processo medido para que suas
+alocações não entrem no pico de memória do tracemalloc.
+
+Uso:
+    python benchmark.py --rows 10000 100000 --modules analitico periodo --output bench.json
+"""
+import os
+import re
+import gc
+import sys
+import json
+import time
+import logging
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+import tracemalloc
+import urllib.request
+from datetime import date, datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+QUERY_TABLE_PATTERN = re.compile(r'FROM\s+(\w+)', re.IGNORECASE)
+QUERY_PERIOD_PATTERN = re.compile(r"BETWEEN\s+'(\d{4}-\d{2}-\d{2})'\s+AND\s+'(\d{4}-\d{2}-\d{2})'", re.IGNORECASE)
+SUM_PATTERN = re.compile(r'SUM\(\{alias\}\.(\w+)\)')
+
+
+# ContaHub falso
+
+class SyntheticData:
+    """Gera registros sintéticos determinísticos por tabela e dia, no formato do esquema"""
+
+    def __init__(self, rows_per_day):
+        from schemas import MODULE_SCHEMAS
+        self.rows_per_day = rows_per_day
+        self.schemas = {schema.table: schema for schema in MODULE_SCHEMAS.values() if not schema.group_by}
+        self.aggregate_schemas = {schema.table: schema for schema in MODULE_SCHEMAS.values() if schema.group_by}
+        self._fragments = {}
+        self._lock = threading.Lock()
+
+    def record(self, schema, day, index):
+        record = {}
+        for column in schema.columns:
+            if column.name == schema.date_column:
+                record[column.name] = day
+            elif column.name == 'vd':
+                record[column.name] = f"{day.replace('-', '')}{index // 3:06d}"
+            elif column.name == 'itm':
+                record[column.name] = str(index % 3)
+            elif column.type == 'float':
+                record[column.name] = round((index % 97) * 1.75, 2)
+            else:
+                record[column.name] = f"{column.name}_{index % 50}"
+        return record
+
+    def aggregate(self, schema, day):
+        """Resumo do dia calculado como o GROUP BY do ContaHub faria"""
+        detail = self.schemas[schema.table]
+        groups = {}
+        for index in range(self.rows_per_day):
+            record = self.record(detail, day, index)
+            key = tuple(record[name] for name in schema.group_by)
+            group = groups.get(key)
+            if group is None:
+                group = groups[key] = dict(zip(schema.group_by, key), **{name: 0 for name in schema.aggregates})
+            for name, expression in schema.aggregates.items():
+                source = SUM_PATTERN.fullmatch(expression)
+                group[name] += record[source.group(1)] if source else 1
+        return [groups[key] for key in sorted(groups)]
+
+    def fragment(self, table, day, aggregated=False):
+        """Registros do dia já serializados (sem colchetes), gerados uma vez"""
+        key = (table, day, aggregated)
+        with self._lock:
+            cached = self._fragments.get(key)
+        if cached is not None:
+            return cached
+        if aggregated:
+            records = self.aggregate(self.aggregate_schemas[table], day)
+        else:
+            schema = self.schemas[table]
+            records = [self.record(schema, day, index) for index in range(self.rows_per_day)]
+        fragment = json.dumps(records, separators=(',', ':'), ensure_ascii=False)[1:-1].encode('utf-8')
+        with self._lock:
+            self._fragments[key] = fragment
+        return fragment
+
+    def body(self, table, start_date, end_date, aggregated=False):
+        days = []
+        day = date.fromisoformat(start_date)
+        end = date.fromisoformat(end_date)
+        while day <= end:
+            days.append(day.isoformat())
+            day += timedelta(days=1)
+        fragments = [fragment for fragment in (self.fragment(table, day, aggregated) for day in days) if fragment]
+        return b'{"success":true,"data":[' + b','.join(fragments) + b']}'
+
+
+class FakeContaHubServer:
+    """Servidor HTTP local que responde ao login e ao /query do ContaHub"""
+
+    def __init__(self, data, latency=0.0):
+        self.data = data
+        self.latency = latency
+        self.requests = 0
+        self.bytes_sent = 0
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                if self.path == '/_stats':
+                    # Contadores para o processo do benchmark (não entram nos próprios contadores)
+                    body = json.dumps({'requests': server.requests, 'bytes_sent': server.bytes_sent}).encode()
+                    self._send(200, body, count=False)
+                    return
+                self._send(200, b'{"success":true}')
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                payload = json.loads(self.rfile.read(length) or b'{}')
+                if server.latency:
+                    time.sleep(server.latency)
+                if '/login' in self.path:
+                    self._send(200, b'{"success":true}', cookie='sessao=benchmark; Path=/')
+                elif self.path.startswith('/query'):
+                    self._send(*server.query(payload.get('query', '')))
+                else:
+                    self._send(404, b'{"success":false,"message":"not found"}')
+
+            def _send(self, status, body, cookie=None, count=True):
+                if count:
+                    server.requests += 1
+                    server.bytes_sent += len(body)
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                if cookie:
+                    self.send_header('Set-Cookie', cookie)
+                self.end_headers()
+                self.wfile.write(body)
+
+        self._httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._httpd.daemon_threads = True
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name='fake-contahub', daemon=True)
+
+    @property
+    def url(self):
+        host, port = self._httpd.server_address
+        return f"http://{host}:{port}"
+
+    def query(self, sql):
+        table = QUERY_TABLE_PATTERN.search(sql)
+        period = QUERY_PERIOD_PATTERN.search(sql)
+        aggregated = 'GROUP BY' in sql.upper()
+        known = self.data.aggregate_schemas if aggregated else self.data.schemas
+        if not table or not period or table.group(1) not in known:
+            return 400, b'{"success":false,"message":"query nao suportada"}'
+        return 200, self.data.body(table.group(1), period.group(1), period.group(2), aggregated)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+
+def serve_contahub(rows_per_day, start_date, end_date, latency=0.0, aggregate=False):
+    """Processo filho: gera os dados, sobe o servidor, imprime a URL e atende até o stdin fechar"""
+    data = SyntheticData(rows_per_day)
+    # Pré-gerar os dados do servidor para não medir a geração sintética
+    for schema in data.schemas.values():
+        data.body(schema.table, start_date, end_date)
+    if aggregate:
+        for schema in data.aggregate_schemas.values():
+            data.body(schema.table, start_date, end_date, aggregated=True)
+
+    server = FakeContaHubServer(data, latency=latency).start()
+    print(server.url, flush=True)
+    try:
+        sys.stdin.read()
+    finally:
+        server.stop()
+    return 0
+
+
+class FakeContaHubProcess:
+    """FakeContaHubServer em um subprocesso, com a mesma interface usada pelo benchmark"""
+
+    def __init__(self, rows_per_day, start_date, end_date, latency=0.0, aggregate=False):
+        self.command = [
+            sys.executable, os.path.abspath(__file__),
+            '--serve-contahub', str(rows_per_day), start_date, end_date,
+            '--contahub-latency', str(latency)
+        ] + (['--aggregate'] if aggregate else [])
+        self.url = None
+        self._process = None
+
+    def start(self):
+        self._process = subprocess.Popen(self.command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+        line = self._process.stdout.readline().strip()
+        if not line.startswith('http'):
+            self.stop()
+            raise RuntimeError(f"ContaHub falso não iniciou (saída: {line!r})")
+        self.url = line
+        return self
+
+    def _stats(self):
+        with urllib.request.urlopen(f"{self.url}/_stats", timeout=10) as response:
+            return json.loads(response.read())
+
+    @property
+    def requests(self):
+        return self._stats()['requests']
+
+    @property
+    def bytes_sent(self):
+        return self._stats()['bytes_sent']
+
+    def stop(self):
+        if self._process is None:
+            return
+        try:
+            self._process.stdin.close()
+            self._process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            self._process.kill()
+            self._process.wait()
+        self._process.stdout.close()
+
+
+# Google Sheets falso
+
+class FakeWorksheet:
+    """Aba em memória com a interface do gspread usada pelo pipeline"""
+
+    def __init__(self, title, latency=0.0, keep_rows=False):
+        self.title = title
+        self.latency = latency
+        self.keep_rows = keep_rows
+        self.rows = []
+        self.row_count = 0
+        self.append_calls = 0
+        self.bytes_received = 0
+        self._lock = threading.Lock()
+
+    def append_rows(self, values, value_input_option='RAW', **kwargs):
+        # O gspread serializa o corpo em JSON antes de enviar: esse custo fica no cliente
+        payload = json.dumps({'values': values})
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            start_row = self.row_count + 1
+            self.row_count += len(values)
+            self.append_calls += 1
+            self.bytes_received += len(payload)
+            if self.keep_rows:
+                self.rows.extend(values)
+            end_row = self.row_count
+        return {'updates': {'updatedRange': f"{self.title}!A{start_row}:Z{end_row}", 'updatedRows': len(values)}}
+
+    def col_values(self, col):
+        return [row[col - 1] for row in self.rows] if self.keep_rows else [''] * self.row_count
+
+    def get(self, range_name=None, **kwargs):
+        """Linhas de um intervalo 'N:M' (só com keep_rows; sem as linhas guardadas, nada)"""
+        if not self.keep_rows or not range_name:
+            return []
+        first, _, last = range_name.partition(':')
+        with self._lock:
+            return [list(row) for row in self.rows[int(first) - 1:int(last or first)]]
+
+    def batch_get(self, ranges, **kwargs):
+        """Colunas inteiras 'X:X', no formato do gspread (uma lista por linha)"""
+        if not self.keep_rows:
+            return [[] for _ in ranges]
+        with self._lock:
+            rows = list(self.rows)
+        results = []
+        for range_name in ranges:
+            index = 0
+            for letter in range_name.partition(':')[0]:
+                index = index * 26 + ord(letter.upper()) - ord('A') + 1
+            results.append([[row[index - 1]] if len(row) >= index else [] for row in rows])
+        return results
+
+
+class FakeSheetsBackend:
+    """Substitui o SheetsClientCache: entrega abas em memória, sem credenciais nem rede"""
+
+    # Chave da planilha usada no índice de chaves do upsert
+    sheet_key = 'benchmark'
+
+    def __init__(self, latency=0.0, keep_rows=False):
+        self.latency = latency
+        self.keep_rows = keep_rows
+        self.worksheets = {}
+        self._lock = threading.Lock()
+
+    def get_worksheet(self, worksheet_name, headers=None):
+        with self._lock:
+            worksheet = self.worksheets.get(worksheet_name)
+            if worksheet is None:
+                worksheet = FakeWorksheet(worksheet_name, self.latency, self.keep_rows)
+                self.worksheets[worksheet_name] = worksheet
+            return worksheet
+
+    def get_client(self):
+        return self
+
+    def get_spreadsheet(self):
+        return self
+
+    def invalidate(self, worksheet_name=None):
+        pass
+
+    def reset(self):
+        with self._lock:
+            self.worksheets = {}
+
+    def stats(self):
+        with self._lock:
+            return {name: {'rows': ws.row_count, 'append_calls': ws.append_calls, 'bytes': ws.bytes_received}
+                    for name, ws in self.worksheets.items()}
+
+
+# Medição
+
+def measure(name, fn, rows=None, trace_memory=True, **info):
+    """Executa fn() medindo tempo e pico de memória (tracemalloc); retorna (resultado, medida)"""
+    gc.collect()
+    if trace_memory:
+        tracemalloc.start()
+    started = time.perf_counter()
+    try:
+        result = fn()
+        error = None
+    except Exception as e:
+        result = None
+        error = f"{type(e).__name__}: {str(e)}"
+    seconds = time.perf_counter() - started
+    peak = None
+    if trace_memory:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    measurement = {
+        'benchmark': name,
+        **info,
+        'rows': rows,
+        'seconds': round(seconds, 4),
+        'rows_per_second': round(rows / seconds, 1) if rows and seconds > 0 else None,
+        'peak_memory_mb': round(peak / (1024 * 1024), 2) if peak is not None else None,
+        'error': error
+    }
+    print(
+        f"{name} {info}: {seconds:.3f}s"
+        + (f", {measurement['rows_per_second']} linhas/s" if measurement['rows_per_second'] else '')
+        + (f", pico {measurement['peak_memory_mb']} MB" if peak is not None else '')
+        + (f" - ERRO {error}" if error else ''),
+        flush=True
+    )
+    return result, measurement
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, timeout=5,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip() or None
+    except Exception:
+        return None
+
+
+def configure_pipeline(api, pipeline, server, sheets):
+    """Aponta a API e o pipeline compartilhado para os serviços falsos"""
+    api.LOGIN_URL = f"{server.url}/login"
+    api.API_URL = pipeline.API_URL = server.url
+    api.contahub_sessions.login_methods = [api.login_contahub_alternative]
+    api.contahub_sessions.invalidate()
+    api.sheets_clients = sheets
+    pipeline.configure(sheets_clients=sheets)
+    pipeline.sheet_last_rows.clear()
+
+
+def run_volume(api, pipeline, args, total_rows):
+    """Roda todas as medições para um volume de linhas por módulo"""
+    days = (date.fromisoformat(pipeline.DEFAULT_FIXED_END_DATE) - date.fromisoformat(pipeline.DEFAULT_FIXED_START_DATE)).days + 1
+    rows_per_day = max(1, -(-total_rows // days))
+    rows = rows_per_day * days
+    start_date, end_date = pipeline.DEFAULT_FIXED_START_DATE, pipeline.DEFAULT_FIXED_END_DATE
+
+    server = FakeContaHubProcess(rows_per_day, start_date, end_date, latency=args.contahub_latency,
+                                 aggregate=args.aggregate).start()
+    # O upsert relê as colunas-chave da aba: as linhas escritas precisam ficar guardadas
+    sheets = FakeSheetsBackend(latency=args.sheets_latency, keep_rows='upsert' in args.write_modes)
+    configure_pipeline(api, pipeline, server, sheets)
+    trace = not args.no_tracemalloc
+    results = []
+
+    try:
+        for repeat in range(args.repeat):
+            common = {'repeat': repeat}
+
+            # Etapas isoladas
+            api.contahub_sessions.invalidate()
+            session, measurement = measure('stage.login', api.contahub_sessions.get_session,
+                                           trace_memory=trace, **common)
+            results.append(measurement)
+            if not session:
+                break
+
+            for module_name in args.modules:
+                info = dict(common, module=module_name, total_rows=rows)
+                sent_before = server.bytes_sent
+                records, measurement = measure(
+                    'stage.fetch_data_contahub',
+                    lambda: pipeline.fetch_data_contahub(session, module_name, start_date, end_date),
+                    rows=rows, trace_memory=trace, **info
+                )
+                measurement['bytes'] = server.bytes_sent - sent_before
+                results.append(measurement)
+
+                records, measurement = measure(
+                    'stage.fetch_data_contahub_partitioned',
+                    lambda: pipeline.fetch_data_contahub_partitioned(session, module_name, start_date, end_date),
+                    rows=rows, trace_memory=trace, **info
+                )
+                results.append(measurement)
+                if not records:
+                    continue
+
+                process = api.process_data_analitico if module_name == 'analitico' else api.process_data_periodo
+                processed, measurement = measure(
+                    f'stage.{process.__name__}', lambda: process(records),
+                    rows=len(records), trace_memory=trace, **info
+                )
+                results.append(measurement)
+                del records
+
+                sheets.reset()
+                pipeline.sheet_last_rows.clear()
+                _, measurement = measure(
+                    'stage.append_to_google_sheets', lambda: pipeline.append_to_google_sheets(module_name, processed),
+                    rows=len(processed), trace_memory=trace, **info
+                )
+                measurement['bytes'] = sheets.stats().get(module_name, {}).get('bytes')
+                results.append(measurement)
+                del processed
+
+            # Pipeline completo (upsert em aba vazia: inclui a reconstrução do índice de chaves)
+            for write_mode in args.write_modes:
+                for stream in args.stream_modes:
+                    sheets.reset()
+                    pipeline.sheet_last_rows.clear()
+                    result, measurement = measure(
+                        'end_to_end.execute_testefinal_real',
+                        lambda: api.execute_testefinal_real(
+                            modules=args.modules, stream=stream, mode='fixed', use_cache=False,
+                            write_mode=write_mode, aggregate=args.aggregate, force=True
+                        ),
+                        rows=rows * len(args.modules), trace_memory=trace,
+                        **dict(common, modules=args.modules, stream=stream, write_mode=write_mode,
+                               aggregate=args.aggregate, total_rows=rows)
+                    )
+                    if result and not result.get('success'):
+                        measurement['error'] = result.get('error')
+                    elif result:
+                        measurement['timings'] = {name: module['timings'] for name, module in result['data']['modules'].items()}
+                        measurement['rows_written'] = result['data']['processed_items']
+                    results.append(measurement)
+    finally:
+        server.stop()
+
+    return results
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark offline do pipeline ContaHub -> Google Sheets')
+    parser.add_argument('--rows', type=int, nargs='+', default=[10000],
+                        help='linhas por módulo no período (um conjunto de medições por valor)')
+    parser.add_argument('--modules', nargs='+', default=['analitico'], help='módulos medidos')
+    parser.add_argument('--contahub-latency', type=float, default=0.0, help='latência do ContaHub falso por requisição (s)')
+    parser.add_argument('--sheets-latency', type=float, default=0.0, help='latência do Sheets falso por append (s)')
+    parser.add_argument('--stream', dest='stream_modes', type=lambda v: v.lower() in ('1', 'true', 'yes'),
+                        nargs='+', default=[False, True], help='modos do pipeline completo (false=lotes, true=streaming)')
+    parser.add_argument('--write-mode', dest='write_modes', nargs='+', choices=('append', 'upsert'),
+                        default=['append', 'upsert'], help='modos de escrita do pipeline completo')
+    parser.add_argument('--aggregate', action='store_true',
+                        help='pipeline completo no modo agregado (resumos diários calculados no ContaHub)')
+    parser.add_argument('--repeat', type=int, default=1, help='repetições de cada medição')
+    parser.add_argument('--no-tracemalloc', action='store_true',
+                        help='não medir pico de memória (tracemalloc deixa o código mais lento)')
+    parser.add_argument('--output', default='benchmark_results.json', help='arquivo JSON de resultados')
+    parser.add_argument('--verbose', action='store_true', help='mostra os logs do pipeline')
+    # Uso interno: processo filho do ContaHub falso (linhas por dia, início, fim)
+    parser.add_argument('--serve-contahub', nargs=3, metavar=('ROWS_PER_DAY', 'START', 'END'), help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.serve_contahub:
+        rows_per_day, start_date, end_date = args.serve_contahub
+        return serve_contahub(int(rows_per_day), start_date, end_date, args.contahub_latency, args.aggregate)
+
+    # Estado local isolado e sem limitação de cota do Sheets
+    os.environ.setdefault('STATE_DIR', tempfile.mkdtemp(prefix='testefinal-bench-'))
+    os.environ.setdefault('RECORD_CACHE_ENABLED', 'false')
+    os.environ.setdefault('SHEETS_WRITE_REQUESTS_PER_MINUTE', '1000000')
+
+    import pipeline
+    import cloud_api_real as api
+
+    logging.getLogger().setLevel(logging.INFO if args.verbose else logging.WARNING)
+
+    invalid = [module_name for module_name in args.modules if not api.get_schema(module_name)]
+    if invalid:
+        print(f"Módulos inválidos: {invalid}", file=sys.stderr)
+        return 2
+
+    results = []
+    for total_rows in args.rows:
+        results.extend(run_volume(api, pipeline, args, total_rows))
+
+    report = {
+        'timestamp': datetime.now().isoformat(),
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'config': {
+            'rows': args.rows,
+            'modules': args.modules,
+            'contahub_latency': args.contahub_latency,
+            'sheets_latency': args.sheets_latency,
+            'stream_modes': args.stream_modes,
+            'write_modes': args.write_modes,
+            'aggregate': args.aggregate,
+            'repeat': args.repeat,
+            'tracemalloc': not args.no_tracemalloc,
+            'fetch_partition_days': pipeline.FETCH_PARTITION_DAYS,
+            'fetch_max_workers': pipeline.FETCH_MAX_WORKERS,
+            'sheets_chunk_rows': pipeline.SHEETS_CHUNK_ROWS
+        },
+        'results': results
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"Resultados gravados em {args.output} ({len(results)} medições)")
+    return 1 if any(result['error'] for result in results) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -8,13 +8,20 @@ import sys
 import json
 import time
 import logging
+import tempfile
 import datetime
 import requests
-import gspread
 from datetime import datetime, date, timedelta
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response
 from functools import wraps
-from google.oauth2.service_account import Credentials
+from proxy_pool import ProxyPool
+from transports import Transport, HedgedSession
+from schemas import get_schema
+from metrics import REGISTRY, CONTAHUB_RESPONSES, status_class
+from sheets_client import SheetsClientCache
+from sheet_index import SheetKeyIndex
+import pipeline
+from pipeline import fetch_data_contahub_partitioned, iter_process_records, write_to_google_sheets, resolve_period
 
 # Configuração
 app = Flask(__name__)
@@ -34,6 +41,10 @@ QUERY_ENDPOINT = "/query"
 # Configurações Google Sheets
 SHEET_NAME = os.getenv('SHEET_NAME', 'Base_de_dados_CA_ordinario')
 GOOGLE_CREDENTIALS_JSON = os.getenv('GOOGLE_CREDENTIALS', '{}')
+SHEET_KEY = os.getenv('SHEET_KEY', '')
+
+# Índice local de chaves do upsert (STATE_DIR/sheet_index.db)
+STATE_DIR = os.getenv('STATE_DIR', os.path.join(tempfile.gettempdir(), 'testefinal'))
 
 # Datas fixas
 DEFAULT_FIXED_START_DATE = '2025-05-22'
@@ -48,6 +59,26 @@ BRAZILIAN_PROXIES = [
     "177.38.76.153:8080"
 ]
 
+# Pool de proxies: testes em paralelo e em background, fora do caminho do login
+PROXY_TEST_URL = os.getenv('PROXY_TEST_URL', 'http://httpbin.org/ip')
+PROXY_TEST_TIMEOUT = int(os.getenv('PROXY_TEST_TIMEOUT', 5))
+PROXY_HEALTH_TTL = int(os.getenv('PROXY_HEALTH_TTL', 300))
+PROXY_REFRESH_INTERVAL = int(os.getenv('PROXY_REFRESH_INTERVAL', 60))
+
+proxy_pool = ProxyPool(
+    BRAZILIAN_PROXIES,
+    test_url=PROXY_TEST_URL,
+    timeout=PROXY_TEST_TIMEOUT,
+    ttl=PROXY_HEALTH_TTL,
+    refresh_interval=PROXY_REFRESH_INTERVAL
+)
+proxy_pool.start()
+
+# Hedging: o próximo transporte é disparado se o anterior passar deste percentil de latência
+HEDGE_PERCENTILE = float(os.getenv('HEDGE_PERCENTILE', 0.9))
+HEDGE_MIN_DELAY = float(os.getenv('HEDGE_MIN_DELAY', 0.5))
+HEDGE_MAX_DELAY = float(os.getenv('HEDGE_MAX_DELAY', 30))
+
 def require_api_key(f):
     """Decorator para exigir API key"""
     @wraps(f)
@@ -84,38 +115,39 @@ def test_endpoint():
         'environment': 'cloud-proxy',
         'contahub_email': CONTAHUB_EMAIL,
         'sheet_name': SHEET_NAME,
-        'proxies_available': len(BRAZILIAN_PROXIES)
+        'proxies_available': len(BRAZILIAN_PROXIES),
+        'proxies_healthy': proxy_pool.healthy_count()
+    })
+
+@app.route('/proxy-status', methods=['GET'])
+@require_api_key
+def proxy_status():
+    """Endpoint com saúde e latência em cache de cada proxy"""
+    return jsonify({
+        'status': 'success',
+        'proxy_pool': proxy_pool.stats(),
+        'timestamp': datetime.now().isoformat()
     })
 
+@app.route('/metrics', methods=['GET'])
+@require_api_key
+def metrics():
+    """Métricas do processo no formato de exposição do Prometheus"""
+    return Response(REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
 def get_session_with_proxy():
-    """Cria sessão com proxy brasileiro"""
-    session = requests.Session()
-    
-    # Tentar proxies brasileiros
-    for proxy in BRAZILIAN_PROXIES:
-        try:
-            proxies = {
-                'http': f'http://{proxy}',
-                'https': f'http://{proxy}'
-            }
-            
-            # Testar proxy com timeout curto
-            test_response = requests.get('http://httpbin.org/ip', 
-                                       proxies=proxies, 
-                                       timeout=5)
-            
-            if test_response.status_code == 200:
-                logger.info(f"Proxy brasileiro funcionando: {proxy}")
-                session.proxies.update(proxies)
-                return session, proxy
-                
-        except Exception as e:
-            logger.warning(f"Proxy {proxy} falhou: {str(e)}")
-            continue
+    """Retorna a sessão do proxy brasileiro mais rápido e saudável (estado em cache, sem testes aqui)
+
+    Retorna (None, None) se nenhum proxy estiver saudável: a conexão direta é
+    o outro transporte, e cair nela aqui dobraria os logins diretos.
+    """
+    proxy = proxy_pool.best()
+    if proxy:
+        logger.info(f"Proxy brasileiro selecionado: {proxy}")
+        return proxy_pool.session_for(proxy), proxy
     
-    # Se nenhum proxy funcionar, usar conexão direta
-    logger.warning("Nenhum proxy brasileiro funcionou, usando conexão direta")
-    return session, None
+    logger.warning("Nenhum proxy brasileiro saudável no momento")
+    return None, None
 
 def login_contahub_with_proxy():
     """Login no ContaHub usando proxy brasileiro"""
@@ -123,6 +155,8 @@ def login_contahub_with_proxy():
         logger.info(f"Tentando login no ContaHub com proxy brasileiro...")
         
         session, proxy_used = get_session_with_proxy()
+        if session is None:
+            return None, None
         
         # Headers de browser brasileiro
         session.headers.update({
@@ -148,10 +182,18 @@ def login_contahub_with_proxy():
             'Referer': 'https://sp.contahub.com/'
         }
         
-        response = session.post(LOGIN_URL, json=payload, headers=headers_login, timeout=30)
+        try:
+            started = time.time()
+            response = session.post(LOGIN_URL, json=payload, headers=headers_login, timeout=30)
+            if proxy_used:
+                proxy_pool.report(proxy_used, True, time.time() - started)
+        except requests.exceptions.RequestException:
+            if proxy_used:
+                proxy_pool.report(proxy_used, False)
+            raise
         
+        CONTAHUB_RESPONSES.inc(endpoint='login', status_class=status_class(response.status_code))
         logger.info(f"Status code: {response.status_code}")
-        logger.info(f"Response: {response.text[:500]}")
         
         if response.status_code == 200:
             try:
@@ -192,6 +234,7 @@ def login_contahub_direct():
         }
         
         response = session.post(LOGIN_URL, json=payload, timeout=30)
+        CONTAHUB_RESPONSES.inc(endpoint='login', status_class=status_class(response.status_code))
         
         if response.status_code == 200:
             data = response.json()
@@ -206,6 +249,59 @@ def login_contahub_direct():
         logger.error(f"Erro no login direto: {str(e)}")
         return None
 
+def login_contahub_proxy_session():
+    """Login via proxy retornando só a sessão (método de login do transporte)"""
+    return login_contahub_with_proxy()[0]
+
+# Pipeline compartilhado: cliente Sheets e índice de chaves próprios deste serviço; as sessões
+# ficam nos transportes, que refazem o login sozinhos quando a query é rejeitada
+pipeline.configure(
+    sheets_clients=SheetsClientCache(GOOGLE_CREDENTIALS_JSON, SHEET_NAME, sheet_key=SHEET_KEY),
+    sheet_index=SheetKeyIndex(os.path.join(STATE_DIR, 'sheet_index.db'))
+)
+
+# Transportes até o ContaHub: proxy brasileiro primeiro, conexão direta como hedge
+contahub_transport = HedgedSession(
+    [
+        Transport('proxy', login_contahub_proxy_session),
+        Transport('direct', login_contahub_direct)
+    ],
+    percentile=HEDGE_PERCENTILE,
+    min_delay=HEDGE_MIN_DELAY,
+    max_delay=HEDGE_MAX_DELAY
+)
+
+def run_proxy_pipeline(modules, write_mode):
+    """Busca, processa e grava cada módulo usando a sessão hedged (proxy/direto)"""
+    results = {}
+    for module_name in modules:
+        started = time.time()
+        stats = {}
+        write_stats = {}
+        start_date, end_date = resolve_period(module_name, 'fixed')
+        
+        records = fetch_data_contahub_partitioned(contahub_transport, module_name, start_date, end_date)
+        if records is None:
+            results[module_name] = {'success': False, 'error': f'Erro ao buscar dados de {module_name}'}
+            continue
+        
+        rows = list(iter_process_records(module_name, records, stats))
+        written = write_to_google_sheets(module_name, rows, write_mode, write_stats) if rows else 0
+        if written is None:
+            results[module_name] = {'success': False, 'error': 'Erro ao enviar dados para Google Sheets'}
+            continue
+        
+        results[module_name] = {
+            'success': True,
+            'period': f"{start_date} até {end_date}",
+            'fetched': len(records),
+            'written': written,
+            'failed_records': stats.get('failed', 0),
+            'sheets_write': write_stats,
+            'duration_seconds': round(time.time() - started, 3)
+        }
+    return results
+
 @app.route('/debug-login-proxy', methods=['GET'])
 def debug_login_proxy():
     """Debug do login com proxy"""
@@ -258,19 +354,27 @@ def debug_login_proxy():
 @app.route('/execute-testefinal-proxy', methods=['POST'])
 @require_api_key
 def execute_testefinal_proxy():
-    """Executa testefinal usando proxy"""
+    """Executa testefinal com login e queries hedged entre proxy e conexão direta"""
     try:
         logger.info("🚀 Executando TesteFinal com PROXY brasileiro")
         
-        # Tentar login com proxy primeiro
-        session, proxy_used = login_contahub_with_proxy()
+        payload = request.get_json(silent=True) or {}
+        modules = payload.get('modules', ['analitico'])
+        modules = [modules] if isinstance(modules, str) else list(modules)
+        write_mode = str(payload.get('write_mode', 'append'))
         
-        if not session:
-            # Fallback para login direto
-            session = login_contahub_direct()
-            proxy_used = "direct"
+        invalid_modules = [module_name for module_name in modules if not get_schema(module_name)]
+        if invalid_modules:
+            return jsonify({
+                'status': 'error',
+                'error': f'Módulos inválidos: {invalid_modules}',
+                'timestamp': datetime.now().isoformat()
+            }), 400
+        
+        # Login hedged: vale o primeiro transporte que autenticar
+        proxy_used = contahub_transport.login()
         
-        if not session:
+        if not proxy_used:
             return jsonify({
                 'status': 'error',
                 'error': 'Falha em todos os métodos de login',
@@ -279,13 +383,23 @@ def execute_testefinal_proxy():
         
         logger.info(f"✅ Login realizado com sucesso usando: {proxy_used}")
         
-        return jsonify({
-            'status': 'success',
-            'message': f'Login realizado com sucesso usando {proxy_used}',
+        results = run_proxy_pipeline(modules, write_mode)
+        errors = [f"{name}: {result['error']}" for name, result in results.items() if not result['success']]
+        
+        response = {
+            'status': 'error' if errors else 'success',
+            'message': f'TesteFinal executado com login via {proxy_used}',
             'proxy_used': proxy_used,
-            'timestamp': datetime.now().isoformat(),
-            'note': 'Implementação completa em desenvolvimento'
-        })
+            'modules': results,
+            'transports': contahub_transport.stats(),
+            'timestamp': datetime.now().isoformat()
+        }
+        if errors:
+            response['error'] = '; '.join(errors)
+            return jsonify(response), 500
+        
+        response['processed_items'] = sum(result['written'] for result in results.values())
+        return jsonify(response)
         
     except Exception as e:
         return jsonify({
@@ -303,6 +417,8 @@ if __name__ == '__main__':
     print(f"   GET  /health")
     print(f"   GET  /test")
     print(f"   GET  /debug-login-proxy")
+    print(f"   GET  /proxy-status")
+    print(f"   GET  /metrics")
     print(f"   POST /execute-testefinal-proxy")
     print(f"🔐 API Key: {API_KEY}")
     print(f"📧 ContaHub Email: {CONTAHUB_EMAIL}")
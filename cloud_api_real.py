@@ -9,13 +9,41 @@ import json
 import time
 import logging
 import tempfile
+import threading
 import datetime
 import requests
-import gspread
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, date, timedelta
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response
 from functools import wraps
-from google.oauth2.service_account import Credentials
+import pipeline
+from pipeline import (
+    API_URL, QUERY_ENDPOINT, FETCH_PARTITION_DAYS, FETCH_PARTITION_RETRIES, RECORD_CACHE_OPEN_DAYS, SHEET_NAME,
+    contahub_limiter, sheets_writer, is_session_rejected, is_session_rejected_payload, build_contahub_query,
+    split_period, fetch_partition_with_retry, fetch_data_contahub_partitioned, iter_process_records,
+    write_to_google_sheets, resolve_period
+)
+from contahub_session import ContaHubSessionManager
+from contahub_limiter import ContaHubUnavailable
+from jobs import JobManager, JobQueueFull
+from json_stream import JSONArrayStream, iter_batches
+from schemas import get_schema, get_aggregate_module
+from sheets_client import SheetsClientCache, google_libraries_loaded
+from shared_state import SharedState
+from single_flight import SingleFlight, SOURCE_EXECUTED
+from data_store import (
+    DataStore, FILTER_COLUMNS, EXPORT_FORMATS, parquet_available, iter_csv, iter_ndjson, iter_parquet
+)
+from watermarks import WatermarkStore
+from record_cache import RecordCache
+from sheet_index import SheetKeyIndex
+from run_log import LogRingBuffer, RunHistory, new_run_id, run_context, submit_with_context, parse_level
+from backfill import BackfillStore, BackfillRunner, BACKFILL_COMPLETED
+from metrics import (
+    REGISTRY, FETCH_PARTITION_SECONDS, STAGE_SECONDS, RECORDS_FETCHED, BYTES_FETCHED,
+    CONTAHUB_RESPONSES, RUNS_IN_FLIGHT, JOBS_IN_FLIGHT, status_class
+)
 
 # Configuração
 app = Flask(__name__)
@@ -29,16 +57,97 @@ API_KEY = os.getenv('API_KEY', 'minha_chave_secreta_testefinal_2025')
 CONTAHUB_EMAIL = os.getenv('CONTAHUB_EMAIL', 'digao@3768')
 CONTAHUB_SENHA = os.getenv('CONTAHUB_SENHA', 'Geladeira@001')
 LOGIN_URL = "https://sp.contahub.com/rest/contahub.cmds.UsuarioCmd/login/17421701611337?emp=0"
-API_URL = "https://apiv2.contahub.com"
-QUERY_ENDPOINT = "/query"
+CONTAHUB_SESSION_MAX_AGE = int(os.getenv('CONTAHUB_SESSION_MAX_AGE', 3600))
+CONTAHUB_SESSION_MAX_IDLE = int(os.getenv('CONTAHUB_SESSION_MAX_IDLE', 900))
+
+# Modo streaming (decodificação incremental + envio em lotes de tamanho fixo)
+STREAM_FETCH = os.getenv('STREAM_FETCH', 'false').lower() in ('1', 'true', 'yes')
+STREAM_BATCH_SIZE = int(os.getenv('STREAM_BATCH_SIZE', 5000))
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# Busca paginada (keyset na ordenação do esquema, com cursor salvo para retomar)
+PAGINATED_FETCH = os.getenv('PAGINATED_FETCH', 'false').lower() in ('1', 'true', 'yes')
+PAGE_SIZE = int(os.getenv('PAGE_SIZE', 50000))
 
 # Configurações Google Sheets
-SHEET_NAME = os.getenv('SHEET_NAME', 'Base_de_dados_CA_ordinario')
 GOOGLE_CREDENTIALS_JSON = os.getenv('GOOGLE_CREDENTIALS', '{}')
+SHEET_KEY = os.getenv('SHEET_KEY', '')
+GOOGLE_TOKEN_REFRESH_MARGIN = int(os.getenv('GOOGLE_TOKEN_REFRESH_MARGIN', 300))
+
+# Jobs assíncronos
+JOB_MAX_WORKERS = int(os.getenv('JOB_MAX_WORKERS', 2))
+JOB_MAX_PENDING = int(os.getenv('JOB_MAX_PENDING', 10))
+
+# Disparos iguais (módulos, período e modo de escrita) durante uma execução recebem o resultado dela;
+# logo após o fim, o resultado de sucesso fica em cache por RUN_RESULT_CACHE_SECONDS (0 desliga o cache)
+RUN_RESULT_CACHE_SECONDS = int(os.getenv('RUN_RESULT_CACHE_SECONDS', 120))
+
+# Sincronização incremental (marca d'água por módulo em SQLite local)
+STATE_DIR = os.getenv('STATE_DIR', os.path.join(tempfile.gettempdir(), 'testefinal'))
+# Sessão ContaHub, token Google e estado dos jobs compartilhados entre os workers via STATE_DIR/shared_state.db
+SHARED_STATE_ENABLED = os.getenv('SHARED_STATE_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+SYNC_MODES = ('fixed', 'incremental')
+SYNC_MODE = os.getenv('SYNC_MODE', 'fixed')
+
+# Cache local de registros por módulo/dia (dias fechados não são buscados de novo)
+RECORD_CACHE_ENABLED = os.getenv('RECORD_CACHE_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+RECORD_CACHE_TTL_DAYS = int(os.getenv('RECORD_CACHE_TTL_DAYS', 30))
+RECORD_CACHE_MAX_MB = int(os.getenv('RECORD_CACHE_MAX_MB', 512))
+
+# Cópia local indexada de analitico/periodo servida por /data (STATE_DIR/data.db)
+LOCAL_STORE_ENABLED = os.getenv('LOCAL_STORE_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+DATA_BATCH_SIZE = int(os.getenv('DATA_BATCH_SIZE', 5000))
+
+# Escrita no Sheets: 'append' (acrescenta tudo) ou 'upsert' (só chaves novas)
+# O modo incremental sempre usa upsert (relê a janela de lookback a cada execução)
+WRITE_MODES = ('append', 'upsert')
+WRITE_MODE = os.getenv('WRITE_MODE', 'append')
+
+# Módulos processados por execução (cada um grava na aba de mesmo nome)
+DEFAULT_MODULES = [m.strip() for m in os.getenv('DEFAULT_MODULES', 'analitico').split(',') if m.strip()]
+
+# Modo agregado: troca cada módulo pelo seu resumo diário calculado no ContaHub (ex.: analitico -> analitico_diario)
+AGGREGATE_MODE = os.getenv('AGGREGATE_MODE', 'false').lower() in ('1', 'true', 'yes')
 
-# Datas fixas
-DEFAULT_FIXED_START_DATE = '2025-05-22'
-DEFAULT_FIXED_END_DATE = '2025-05-27'
+# Histórico em memória servido por /logs e /runs
+LOG_BUFFER_SIZE = int(os.getenv('LOG_BUFFER_SIZE', 2000))
+RUN_HISTORY_SIZE = int(os.getenv('RUN_HISTORY_SIZE', 100))
+
+# Backfill histórico: tarefas por dia e módulo, com checkpoint em STATE_DIR/backfill.db
+BACKFILL_FETCH_WORKERS = int(os.getenv('BACKFILL_FETCH_WORKERS', 4))
+BACKFILL_WRITE_WORKERS = int(os.getenv('BACKFILL_WRITE_WORKERS', 1))
+BACKFILL_QUEUE_DAYS = int(os.getenv('BACKFILL_QUEUE_DAYS', 8))
+BACKFILL_TASK_RETRIES = int(os.getenv('BACKFILL_TASK_RETRIES', 1))
+# Ao iniciar o worker, reagendar backfills interrompidos por queda ou redeploy
+BACKFILL_AUTO_RESUME = os.getenv('BACKFILL_AUTO_RESUME', 'true').lower() in ('1', 'true', 'yes')
+
+log_buffer = LogRingBuffer(LOG_BUFFER_SIZE)
+logging.getLogger().addHandler(log_buffer)
+run_history = RunHistory(RUN_HISTORY_SIZE)
+
+shared_state = SharedState(os.path.join(STATE_DIR, 'shared_state.db')) if SHARED_STATE_ENABLED else None
+job_manager = JobManager(max_workers=JOB_MAX_WORKERS, max_pending=JOB_MAX_PENDING, shared_state=shared_state)
+run_coalescer = SingleFlight(
+    ttl=RUN_RESULT_CACHE_SECONDS,
+    shared_state=shared_state,
+    cache_if=lambda result: bool(result.get('success'))
+)
+JOBS_IN_FLIGHT.set_function(lambda: {
+    (status,): count for status, count in job_manager.stats().items() if status in ('queued', 'running')
+})
+watermarks = WatermarkStore(os.path.join(STATE_DIR, 'watermarks.db'))
+record_cache = RecordCache(
+    os.path.join(STATE_DIR, 'record_cache'),
+    ttl_seconds=RECORD_CACHE_TTL_DAYS * 24 * 3600,
+    max_bytes=RECORD_CACHE_MAX_MB * 1024 * 1024,
+    open_days=RECORD_CACHE_OPEN_DAYS
+)
+sheet_index = SheetKeyIndex(os.path.join(STATE_DIR, 'sheet_index.db'))
+data_store = DataStore(os.path.join(STATE_DIR, 'data.db')) if LOCAL_STORE_ENABLED else None
+backfills = BackfillStore(os.path.join(STATE_DIR, 'backfill.db'))
+# Backfills rodando neste processo (evita duas rodadas simultâneas do mesmo backfill)
+active_backfills = set()
+active_backfills_lock = threading.Lock()
 
 def require_api_key(f):
     """Decorator para exigir API key"""
@@ -57,7 +166,7 @@ def require_api_key(f):
 
 @app.route('/health', methods=['GET'])
 def health_check():
-    """Endpoint de health check"""
+    """Endpoint de liveness: não toca em sessão, Sheets nem disco"""
     return jsonify({
         'status': 'healthy',
         'timestamp': datetime.now().isoformat(),
@@ -65,6 +174,38 @@ def health_check():
         'version': '2.0.0'
     })
 
+@app.route('/ready', methods=['GET'])
+def readiness_check():
+    """Endpoint de readiness com o estado em cache das dependências (sem I/O de rede)
+
+    Pronto quando o diretório de estado está gravável. Com ?strict=true também
+    exige sessão ContaHub ativa, circuito do ContaHub não aberto e cliente
+    Google Sheets autorizado.
+    """
+    session = contahub_sessions.stats()
+    sheets = sheets_clients.stats()
+    checks = {
+        'state_dir_writable': os.access(STATE_DIR, os.W_OK),
+        'contahub_session_active': session['session_active'],
+        'contahub_session_age_seconds': session['session_age_seconds'],
+        'contahub_circuit': contahub_limiter.stats()['circuit'],
+        'google_libraries_loaded': google_libraries_loaded(),
+        'google_sheets_authorized': sheets['authorized'],
+        'google_token_expiry': sheets['token_expiry'],
+        'jobs': job_manager.stats()
+    }
+    
+    ready = checks['state_dir_writable']
+    if is_truthy(request.args.get('strict')):
+        ready = (ready and checks['contahub_session_active'] and checks['google_sheets_authorized']
+                 and checks['contahub_circuit'] != 'open')
+    
+    return jsonify({
+        'status': 'ready' if ready else 'not_ready',
+        'checks': checks,
+        'timestamp': datetime.now().isoformat()
+    }), 200 if ready else 503
+
 @app.route('/test', methods=['GET'])
 def test_endpoint():
     """Endpoint de teste público"""
@@ -105,20 +246,16 @@ def login_contahub():
             "emp": 0
         }
         
-        logger.info(f"Fazendo POST para: {LOGIN_URL}")
-        logger.info(f"Payload email: {payload['usr_email']}")
-        logger.info(f"Payload senha: {'*' * len(payload['usr_senha'])}")
-        
         # Primeiro, visitar a página principal para estabelecer sessão
         try:
-            logger.info("Fazendo GET inicial para estabelecer sessão...")
-            main_page = session.get('https://sp.contahub.com/', timeout=30)
-            logger.info(f"GET principal - Status: {main_page.status_code}")
-            logger.info(f"Cookies após GET principal: {dict(session.cookies)}")
+            main_page = contahub_limiter.call('login', session.get, 'https://sp.contahub.com/', timeout=30)
+            logger.debug(f"GET principal - Status: {main_page.status_code}")
             
             # Aguardar um pouco para simular comportamento humano
             time.sleep(2)
             
+        except ContaHubUnavailable:
+            raise
         except Exception as e:
             logger.warning(f"Erro no GET inicial (continuando): {str(e)}")
         
@@ -130,25 +267,24 @@ def login_contahub():
             'X-Requested-With': 'XMLHttpRequest'
         }
         
-        response = session.post(LOGIN_URL, json=payload, headers=headers_login, timeout=60)
+        response = contahub_limiter.call('login', session.post, LOGIN_URL, json=payload, headers=headers_login,
+                                         timeout=60)
+        CONTAHUB_RESPONSES.inc(endpoint='login', status_class=status_class(response.status_code))
         
-        logger.info(f"Status code: {response.status_code}")
-        logger.info(f"Response headers: {dict(response.headers)}")
-        logger.info(f"Response cookies: {dict(session.cookies)}")
-        logger.info(f"Response text (primeiros 1000 chars): {response.text[:1000]}")
+        logger.info(f"Login ContaHub - Status: {response.status_code}")
         
         if response.status_code == 200:
             try:
                 data = response.json()
-                logger.info(f"Response JSON completo: {data}")
                 
                 if data.get('success'):
                     logger.info(f"Login realizado com sucesso para {CONTAHUB_EMAIL}")
+                    contahub_limiter.login_succeeded()
                     # Testar se a sessão realmente funciona fazendo uma requisição de teste
                     test_url = f"{API_URL}/test"
                     try:
-                        test_response = session.get(test_url, timeout=30)
-                        logger.info(f"Teste de sessão - Status: {test_response.status_code}")
+                        test_response = contahub_limiter.call('login', session.get, test_url, timeout=30)
+                        logger.debug(f"Teste de sessão - Status: {test_response.status_code}")
                     except Exception as e:
                         logger.warning(f"Erro no teste de sessão: {str(e)}")
                     
@@ -156,12 +292,10 @@ def login_contahub():
                 else:
                     error_msg = data.get('message', 'Erro desconhecido')
                     logger.error(f"Falha no login - Resposta: {error_msg}")
-                    logger.error(f"Data completo: {data}")
                     return None
                     
             except json.JSONDecodeError as e:
-                logger.error(f"Erro ao decodificar JSON: {str(e)}")
-                logger.error(f"Response raw: {response.text}")
+                logger.error(f"Erro ao decodificar JSON do login ({len(response.content)} bytes): {str(e)}")
                 return None
                 
         elif response.status_code == 429:
@@ -172,10 +306,11 @@ def login_contahub():
             return None
         else:
             logger.error(f"Erro HTTP no login: {response.status_code}")
-            logger.error(f"Response headers: {dict(response.headers)}")
-            logger.error(f"Response text: {response.text}")
             return None
             
+    except ContaHubUnavailable as e:
+        logger.error(f"Login ContaHub não tentado: {str(e)}")
+        return None
     except requests.exceptions.Timeout as e:
         logger.error(f"Timeout durante login: {str(e)}")
         return None
@@ -204,21 +339,19 @@ def login_contahub_alternative():
             "emp": 0
         }
         
-        logger.info(f"Login alternativo - POST para: {LOGIN_URL}")
-        
         # Login direto sem GET inicial
-        response = session.post(LOGIN_URL, json=payload, timeout=30)
+        response = contahub_limiter.call('login', session.post, LOGIN_URL, json=payload, timeout=30)
+        CONTAHUB_RESPONSES.inc(endpoint='login', status_class=status_class(response.status_code))
         
         logger.info(f"Login alternativo - Status: {response.status_code}")
-        logger.info(f"Login alternativo - Response: {response.text[:500]}")
         
         if response.status_code == 200:
             try:
                 data = response.json()
-                logger.info(f"Login alternativo - JSON: {data}")
                 
                 if data.get('success'):
                     logger.info(f"Login alternativo realizado com sucesso para {CONTAHUB_EMAIL}")
+                    contahub_limiter.login_succeeded()
                     return session
                 else:
                     logger.error(f"Login alternativo falhou: {data.get('message', 'Erro desconhecido')}")
@@ -231,162 +364,276 @@ def login_contahub_alternative():
             logger.error(f"Login alternativo - Erro HTTP: {response.status_code}")
             return None
             
+    except ContaHubUnavailable as e:
+        logger.error(f"Login alternativo não tentado: {str(e)}")
+        return None
     except Exception as e:
         logger.error(f"Erro no login alternativo: {str(e)}", exc_info=True)
         return None
 
-def fetch_data_contahub(session, module_name, start_date, end_date):
-    """Busca dados de um módulo específico no ContaHub"""
+# Sessão ContaHub compartilhada pelo processo (evita login a cada execução)
+contahub_sessions = ContaHubSessionManager(
+    [login_contahub, login_contahub_alternative],
+    max_age=CONTAHUB_SESSION_MAX_AGE,
+    max_idle=CONTAHUB_SESSION_MAX_IDLE,
+    shared_state=shared_state
+)
+
+class ContaHubStreamError(Exception):
+    """Falha durante a busca em modo streaming"""
+
+def fetch_with_session(module_name, start_date, end_date):
+    """Busca dados com a sessão do gerenciador, refazendo login uma vez se a query for rejeitada"""
+    session = contahub_sessions.get_session()
+    if not session:
+        return None
+    
+    records = fetch_data_contahub_partitioned(session, module_name, start_date, end_date)
+    
+    if records is None and contahub_sessions.was_invalidated(session):
+        logger.info(f"🔄 Repetindo busca de {module_name} com nova sessão...")
+        session = contahub_sessions.get_session()
+        if not session:
+            return None
+        records = fetch_data_contahub_partitioned(session, module_name, start_date, end_date)
+    
+    return records
+
+def fetch_with_cache(module_name, start_date, end_date):
+    """Busca o período servindo dias fechados do cache local e buscando só os demais
+
+    Os dias buscados que já estão fechados são gravados no cache. O resultado
+    mantém a ordem por data; dentro de cada dia vale a ordenação da query.
+    """
+    date_column = get_schema(module_name).date_column
+    days = [day for day, _ in split_period(start_date, end_date, 1)]
+    
+    records_by_day = {}
+    missing_days = []
+    for day in days:
+        cached = record_cache.get(module_name, day) if record_cache.is_closed(day) else None
+        if cached is None:
+            missing_days.append(day)
+        else:
+            records_by_day[day] = cached
+    
+    logger.info(f"Módulo {module_name}: {len(records_by_day)} dia(s) do cache, {len(missing_days)} a buscar")
+    
+    # Agrupar dias faltantes em intervalos contíguos
+    spans = []
+    for day in missing_days:
+        if spans and date.fromisoformat(day) - date.fromisoformat(spans[-1][1]) == timedelta(days=1):
+            spans[-1][1] = day
+        else:
+            spans.append([day, day])
+    
+    for span_start, span_end in spans:
+        records = fetch_with_session(module_name, span_start, span_end)
+        if records is None:
+            return None
+        
+        fetched_by_day = {day: [] for day, _ in split_period(span_start, span_end, 1)}
+        for record in records:
+            day = str(record.get(date_column, ''))[:10]
+            fetched_by_day.setdefault(day, []).append(record)
+        
+        for day, day_records in fetched_by_day.items():
+            records_by_day[day] = day_records
+            if day in missing_days and record_cache.is_closed(day):
+                try:
+                    record_cache.put(module_name, day, day_records)
+                except OSError as e:
+                    logger.warning(f"Erro ao gravar cache de {module_name} {day}: {str(e)}")
+    
+    if spans:
+        record_cache.evict()
+    
+    records = []
+    for day in sorted(records_by_day):
+        records.extend(records_by_day[day])
+    return records
+
+def store_records(module_name, records, start_date=None, end_date=None):
+    """Grava os registros na cópia local servida por /data (substitui o período se informado)
+    
+    Falhas só geram aviso: a cópia local nunca interrompe a sincronização.
+    """
+    if data_store is None or not data_store.supports(module_name) or records is None:
+        return
     try:
-        query_base_url = f"{API_URL}{QUERY_ENDPOINT}"
-        
-        # Queries para cada módulo
-        queries = {
-            'analitico': f"""
-                SELECT v.dia_semana, v.semana, v.vd, v.vd_mesadesc, v.vd_localizacao, 
-                       v.itm, v.trn, v.trn_desc, v.prefixo, v.tipo, v.tipovenda, v.ano, v.mes,
-                       v.vd_dtgerencial, v.usr_lancou, v.prd, v.prd_desc, v.grp_desc, v.loc_desc,
-                       v.qtd, v.desconto, v.valorfinal, v.custo, v.itm_obs, v.comandaorigem, v.itemorigem
-                FROM contahub_analitico v 
-                WHERE v.vd_dtgerencial BETWEEN '{start_date}' AND '{end_date}'
-                ORDER BY v.vd_dtgerencial, v.vd, v.itm
-            """,
-            'periodo': f"""
-                SELECT v.vd, v.dia_semana, v.semana, v.trn, v.dt_gerencial, v.tipovenda,
-                       v.vd_mesadesc, v.vd_localizacao, v.usr_abriu, v.pessoas, v.qtd_itens,
-                       v.vr_pagamentos, v.vr_produtos, v.vr_repique, v.vr_couvert, v.vr_desconto,
-                       v.motivo, v.dt_contabil, v.ultimo_pedido, v.vd_cpf, v.nf_autorizada,
-                       v.nf_chaveacesso, v.nf_dtcontabil, v.vd_dtcontabil
-                FROM contahub_periodo v 
-                WHERE v.dt_gerencial BETWEEN '{start_date}' AND '{end_date}'
-                ORDER BY v.dt_gerencial, v.vd
-            """
-        }
+        if start_date and end_date:
+            data_store.replace_period(module_name, start_date, end_date, records)
+        else:
+            data_store.upsert(module_name, records)
+    except Exception as e:
+        logger.warning(f"Erro ao gravar {module_name} na cópia local: {str(e)}")
+
+def iter_store_records(module_name, records):
+    """Repassa os registros gravando-os na cópia local em lotes de STREAM_BATCH_SIZE"""
+    if data_store is None or not data_store.supports(module_name):
+        yield from records
+        return
         
-        if module_name not in queries:
+    batch = []
+    for record in records:
+        batch.append(record)
+        if len(batch) >= STREAM_BATCH_SIZE:
+            store_records(module_name, batch)
+            batch = []
+        yield record
+    store_records(module_name, batch)
+
+def stream_data_contahub(session, module_name, start_date, end_date):
+    """Busca um módulo em modo streaming, retornando um gerador de registros
+
+    Os registros são decodificados do array 'data' conforme chegam pela rede.
+    Retorna None se a query falhar antes do corpo começar a ser lido; falhas
+    durante a leitura levantam ContaHubStreamError.
+    """
+    try:
+        query = build_contahub_query(module_name, start_date, end_date)
+        if not query:
             logger.error(f"Módulo {module_name} não suportado")
             return None
-            
-        query = queries[module_name]
         
-        response = session.post(query_base_url, json={"query": query}, timeout=60)
+        started = time.time()
+        response = contahub_limiter.call('query', session.post, f"{API_URL}{QUERY_ENDPOINT}", json={"query": query},
+                                         timeout=60, stream=True)
+        CONTAHUB_RESPONSES.inc(endpoint='query', status_class=status_class(response.status_code))
         
-        if response.status_code == 200:
-            data = response.json()
-            if data.get('success') and data.get('data'):
-                records = data['data']
-                logger.info(f"Módulo {module_name}: {len(records)} registros obtidos")
-                return records
-            else:
-                logger.warning(f"Módulo {module_name}: Nenhum dado encontrado")
-                return []
-        else:
+        if is_session_rejected(response):
+            logger.warning(f"Módulo {module_name}: query rejeitada (status {response.status_code}), sessão será renovada")
+            contahub_sessions.invalidate(session)
+            response.close()
+            return None
+        
+        if response.status_code != 200:
             logger.error(f"Erro HTTP ao buscar {module_name}: {response.status_code}")
+            response.close()
             return None
-            
+        
+        return iter_response_records(session, response, module_name, start_date, end_date, started)
+        
     except Exception as e:
         logger.error(f"Erro ao buscar dados do módulo {module_name}: {str(e)}")
         return None
 
-def process_data_analitico(records):
-    """Processa dados analíticos"""
+def count_bytes(chunks, module_name):
+    """Repassa os blocos da resposta contabilizando os bytes recebidos"""
+    for chunk in chunks:
+        BYTES_FETCHED.inc(len(chunk), module=module_name)
+        yield chunk
+
+def iter_response_records(session, response, module_name, start_date, end_date, started=None):
+    """Gera os registros do corpo da resposta, decodificando de forma incremental
+
+    started: instante do envio da query, para medir a duração da partição até o fim da leitura
+    """
+    stream = JSONArrayStream(count_bytes(response.iter_content(chunk_size=STREAM_CHUNK_SIZE), module_name))
+    try:
+        yield from stream
+    except ValueError as e:
+        raise ContaHubStreamError(f"Resposta inválida do módulo {module_name}: {str(e)}")
+    except requests.exceptions.RequestException as e:
+        raise ContaHubStreamError(f"Conexão interrompida no módulo {module_name}: {str(e)}")
+    finally:
+        response.close()
+    
+    if is_session_rejected_payload(stream.meta):
+        contahub_sessions.invalidate(session)
+        raise ContaHubStreamError(f"Query do módulo {module_name} rejeitada: {stream.meta.get('message')}")
+    
+    RECORDS_FETCHED.inc(stream.count, module=module_name)
+    if started is not None:
+        FETCH_PARTITION_SECONDS.observe(time.time() - started, module=module_name)
+    logger.info(f"Módulo {module_name} {start_date}..{end_date}: {stream.count} registros lidos em streaming")
+
+def iter_stream_contahub(session, module_name, start_date, end_date, partition_days=None):
+    """Encadeia as partições do período em um único gerador, uma partição por vez
+
+    Mantém a memória limitada ao lote em processamento, independente do tamanho do período.
+    """
+    partition_days = FETCH_PARTITION_DAYS if partition_days is None else partition_days
+    
+    for part_start, part_end in split_period(start_date, end_date, partition_days):
+        records = stream_data_contahub(session, module_name, part_start, part_end)
+        if records is None:
+            raise ContaHubStreamError(f"Erro ao buscar {module_name} de {part_start} até {part_end}")
+        yield from records
+
+def process_data_analitico(records, stats=None):
+    """Processa dados analíticos
+
+    stats: dict opcional onde são acumulados os contadores de registros processados/descartados
+    """
     if not records:
         return []
-        
-    processed_data = []
     
-    for record in records:
-        try:
-            # Extrair dados do registro
-            processed_record = [
-                record.get('dia_semana', ''),
-                record.get('semana', ''),
-                record.get('vd', ''),
-                record.get('vd_mesadesc', ''),
-                record.get('vd_localizacao', ''),
-                record.get('itm', ''),
-                record.get('trn', ''),
-                record.get('trn_desc', ''),
-                record.get('prefixo', ''),
-                record.get('tipo', ''),
-                record.get('tipovenda', ''),
-                record.get('ano', ''),
-                record.get('mes', ''),
-                record.get('vd_dtgerencial', ''),
-                record.get('usr_lancou', ''),
-                record.get('prd', ''),
-                record.get('prd_desc', ''),
-                record.get('grp_desc', ''),
-                record.get('loc_desc', ''),
-                float(record.get('qtd', 0) or 0),
-                float(record.get('desconto', 0) or 0),
-                float(record.get('valorfinal', 0) or 0),
-                float(record.get('custo', 0) or 0),
-                record.get('itm_obs', ''),
-                record.get('comandaorigem', ''),
-                record.get('itemorigem', '')
-            ]
-            processed_data.append(processed_record)
-            
-        except Exception as e:
-            logger.error(f"Erro ao processar registro analítico: {str(e)}")
-            continue
-            
-    return processed_data
+    return list(iter_process_data_analitico(records, stats))
+
+def iter_process_data_analitico(records, stats=None):
+    """Processa dados analíticos como gerador, convertendo em lotes com o conversor compilado"""
+    return iter_process_records('analitico', records, stats)
+
+def process_data_periodo(records, stats=None):
+    """Processa dados do período (uma linha por venda)"""
+    if not records:
+        return []
+    
+    return list(iter_process_records('periodo', records, stats))
+
+# Cliente Google Sheets compartilhado pelo processo (token, planilha e abas em cache)
+sheets_clients = SheetsClientCache(
+    GOOGLE_CREDENTIALS_JSON,
+    SHEET_NAME,
+    sheet_key=SHEET_KEY,
+    refresh_margin=GOOGLE_TOKEN_REFRESH_MARGIN,
+    shared_state=shared_state
+)
+
+# O pipeline compartilhado usa a sessão, o cliente Sheets e o estado local desta aplicação
+pipeline.configure(
+    contahub_sessions=contahub_sessions,
+    sheets_clients=sheets_clients,
+    sheet_index=sheet_index,
+    shared_state=shared_state,
+    watermarks=watermarks
+)
 
 def get_google_sheets_client():
     """Configura e retorna cliente Google Sheets"""
     try:
-        scope = [
-            "https://www.googleapis.com/auth/spreadsheets",
-            "https://www.googleapis.com/auth/drive"
-        ]
-        
-        # Parse credentials from environment variable
-        credentials_dict = json.loads(GOOGLE_CREDENTIALS_JSON)
-        creds = Credentials.from_service_account_info(credentials_dict, scopes=scope)
-        client = gspread.authorize(creds)
-        
-        return client
+        return sheets_clients.get_client()
         
     except Exception as e:
         logger.error(f"Erro ao configurar cliente Google Sheets: {str(e)}")
         return None
 
-def append_to_google_sheets(worksheet_name, data):
-    """Adiciona dados ao Google Sheets"""
-    try:
-        client = get_google_sheets_client()
-        if not client:
-            return None
-            
-        sheet = client.open(SHEET_NAME)
-        worksheet = sheet.worksheet(worksheet_name)
-        
-        # Adicionar dados
-        if data:
-            worksheet.append_rows(data)
-            start_row = len(worksheet.get_all_values()) - len(data) + 1
-            end_row = len(worksheet.get_all_values())
-            
-            logger.info(f"Dados adicionados ao Google Sheets: linhas {start_row} a {end_row}")
-            return (start_row, end_row)
-        
-        return None
-        
-    except Exception as e:
-        logger.error(f"Erro ao adicionar dados ao Google Sheets: {str(e)}")
-        return None
-
 @app.route('/execute-testefinal', methods=['POST'])
 @require_api_key
 def execute_testefinal():
-    """Endpoint para executar testefinal.py REAL"""
+    """Endpoint para executar testefinal.py REAL
+
+    Com {"async": true} no corpo (ou ?async=true) retorna 202 com um job_id
+    e executa em background; o andamento é consultado em GET /jobs/<id>.
+    """
     try:
+        payload = request.get_json(silent=True) or {}
+        try:
+            options = get_execution_options(payload)
+        except ValueError as e:
+            return jsonify({
+                'status': 'error',
+                'error': str(e),
+                'timestamp': datetime.now().isoformat()
+            }), 400
+        if is_truthy(payload.get('async', request.args.get('async'))):
+            return submit_testefinal_job(options)
+        
         logger.info(f"🚀 Executando TesteFinal REAL às {datetime.now()}")
         
         # Resultado da execução
-        result = execute_testefinal_real()
+        result = execute_testefinal_real(**options)
         
         if result['success']:
             logger.info("✅ TesteFinal REAL executado com sucesso")
@@ -403,6 +650,7 @@ def execute_testefinal():
             return jsonify({
                 'status': 'error',
                 'error': error_msg,
+                'run_id': result.get('run_id'),
                 'timestamp': datetime.now().isoformat()
             }), 500
             
@@ -415,20 +663,437 @@ def execute_testefinal():
             'timestamp': datetime.now().isoformat()
         }), 500
 
-def execute_testefinal_real():
+def is_truthy(value):
+    """Interpreta flags vindas de JSON ou query string"""
+    return str(value).lower() in ('1', 'true', 'yes')
+
+def get_execution_options(payload):
+    """Extrai do corpo da requisição os parâmetros repassados a execute_testefinal_real()
+
+    Levanta ValueError para valores inválidos de mode, write_mode e
+    lookback_days e para combinações inválidas (ex.: incremental com append),
+    antes de qualquer busca ou job.
+    """
+    options = {}
+    if 'stream' in payload:
+        options['stream'] = is_truthy(payload['stream'])
+    if 'mode' in payload:
+        options['mode'] = str(payload['mode'])
+        if options['mode'] not in SYNC_MODES:
+            raise ValueError(f"Modo de sincronização inválido: {options['mode']} (use {', '.join(SYNC_MODES)})")
+    if 'lookback_days' in payload:
+        try:
+            # str() recusa null, booleanos e frações em vez de convertê-los
+            options['lookback_days'] = int(str(payload['lookback_days']))
+        except ValueError:
+            options['lookback_days'] = -1
+        if options['lookback_days'] < 0:
+            raise ValueError(f"lookback_days inválido: {payload['lookback_days']!r} (use um inteiro >= 0)")
+    if 'use_cache' in payload:
+        options['use_cache'] = is_truthy(payload['use_cache'])
+    if 'write_mode' in payload:
+        options['write_mode'] = str(payload['write_mode'])
+        if options['write_mode'] not in WRITE_MODES:
+            raise ValueError(f"Modo de escrita inválido: {options['write_mode']} (use {', '.join(WRITE_MODES)})")
+    if 'modules' in payload:
+        modules = payload['modules']
+        options['modules'] = [modules] if isinstance(modules, str) else list(modules)
+    if 'aggregate' in payload:
+        options['aggregate'] = is_truthy(payload['aggregate'])
+    if 'paginate' in payload:
+        options['paginate'] = is_truthy(payload['paginate'])
+    if 'force' in payload:
+        options['force'] = is_truthy(payload['force'])
+    resolve_write_mode(options.get('mode', SYNC_MODE), options.get('write_mode'))
+    return options
+
+def submit_testefinal_job(options):
+    """Agenda execute_testefinal_real() no executor de jobs e responde 202"""
+    try:
+        job = job_manager.submit('testefinal', execute_testefinal_real, params=options, **options)
+    except JobQueueFull as e:
+        logger.warning(f"⚠️ Job recusado: {str(e)}")
+        return jsonify({
+            'status': 'error',
+            'error': f'Fila de jobs cheia: {str(e)}',
+            'timestamp': datetime.now().isoformat()
+        }), 429
+    
+    return jsonify({
+        'status': 'accepted',
+        'job_id': job.id,
+        'status_url': f'/jobs/{job.id}',
+        'timestamp': datetime.now().isoformat()
+    }), 202
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+@require_api_key
+def get_job(job_id):
+    """Endpoint para consultar etapa, progresso e resultado de um job (de qualquer worker)"""
+    job = job_manager.get_status(job_id)
+    if not job:
+        return jsonify({
+            'status': 'error',
+            'error': f'Job {job_id} não encontrado',
+            'timestamp': datetime.now().isoformat()
+        }), 404
+    
+    return jsonify(job)
+
+def report_progress(progress, stage, **counters):
+    """Repassa etapa/contadores ao callback de progresso (jobs assíncronos), se houver"""
+    if progress:
+        try:
+            progress(stage, **counters)
+        except Exception as e:
+            logger.warning(f"Erro ao reportar progresso: {str(e)}")
+
+def resolve_write_mode(mode, write_mode=None):
+    """Modo de escrita efetivo da execução
+
+    O incremental relê os dias do lookback a cada execução: sem write_mode
+    explícito usa upsert (WRITE_MODE vale só para o modo fixo) e um append
+    explícito é recusado com ValueError, porque gravaria esses dias de novo.
+    """
+    if mode != 'incremental':
+        return WRITE_MODE if write_mode is None else write_mode
+    if write_mode is None:
+        return 'upsert'
+    if write_mode == 'append':
+        raise ValueError("Modo incremental exige write_mode 'upsert': com 'append' os dias do lookback "
+                         "seriam gravados de novo a cada execução")
+    return write_mode
+
+class PipelineProgress:
+    """Soma o progresso dos módulos executados em paralelo antes de repassar ao callback"""
+    
+    def __init__(self, progress, modules):
+        self.progress = progress
+        self.counters = {module_name: {} for module_name in modules}
+        self._lock = threading.Lock()
+    
+    def for_module(self, module_name):
+        def report(stage, **counters):
+            with self._lock:
+                self.counters[module_name].update(counters)
+                totals = {}
+                for module_counters in self.counters.values():
+                    for key, value in module_counters.items():
+                        totals[key] = totals.get(key, 0) + value
+            report_progress(self.progress, f"{module_name}:{stage}", **totals)
+        return report
+
+def execute_module_streaming(session, module_name, start_date, end_date, write_mode, progress=None,
+                             stats=None, write_stats=None):
+    """Busca, processa e envia um módulo em lotes de STREAM_BATCH_SIZE linhas
+
+    A memória fica limitada a um lote, independente de quantas linhas o período retorna.
+    Retorna (lidos, enviados, erro).
+    """
+    counts = {'fetched': 0, 'written': 0}
+    
+    def counted(records):
+        for record in records:
+            counts['fetched'] += 1
+            yield record
+    
+    for attempt in range(2):
+        try:
+            records = iter_store_records(
+                module_name, counted(iter_stream_contahub(session, module_name, start_date, end_date))
+            )
+            rows = iter_process_records(module_name, records, stats)
+            
+            for batch in iter_batches(rows, STREAM_BATCH_SIZE):
+                report_progress(progress, 'write', records_fetched=counts['fetched'],
+                                records_processed=(stats or {}).get('processed', 0))
+                written = write_to_google_sheets(module_name, batch, write_mode, write_stats)
+                if written is None:
+                    return counts['fetched'], counts['written'], 'Erro ao enviar dados para Google Sheets'
+                counts['written'] += written
+                report_progress(progress, 'fetch', records_written=counts['written'])
+            
+            return counts['fetched'], counts['written'], None
+            
+        except ContaHubStreamError as e:
+            # Sessão rejeitada antes de qualquer escrita: refazer login e tentar de novo
+            if attempt == 0 and counts['written'] == 0 and contahub_sessions.was_invalidated(session):
+                logger.info(f"🔄 Repetindo busca em streaming de {module_name} com nova sessão...")
+                session = contahub_sessions.get_session()
+                if session:
+                    counts['fetched'] = 0
+                    continue
+            logger.error(f"❌ {str(e)}")
+            return counts['fetched'], counts['written'], f'Erro ao buscar dados de {module_name}: {str(e)}'
+    
+    return counts['fetched'], counts['written'], f'Erro ao buscar dados de {module_name}'
+
+def execute_module_paginated(session, module_name, start_date, end_date, write_mode, progress=None,
+                             stats=None, write_stats=None, page_size=None):
+    """Busca, processa e envia um módulo em páginas keyset de page_size registros
+
+    Cada página é gravada assim que chega e o cursor (chave do último registro
+    gravado) fica salvo; uma nova execução do mesmo módulo/período continua dali.
+    Retorna (lidos, enviados, erro).
+    """
+    page_size = PAGE_SIZE if page_size is None else page_size
+    order_by = get_schema(module_name).order_by
+    counts = {'fetched': 0, 'written': 0}
+    
+    cursor, done = None, 0
+    saved = watermarks.get_cursor(module_name, start_date, end_date)
+    if saved:
+        cursor, done = saved
+        logger.info(f"⏩ {module_name}: retomando a busca paginada após {done} registros já gravados")
+    
+    relogged = False
+    while True:
+        report_progress(progress, 'fetch', records_fetched=counts['fetched'])
+        records = fetch_partition_with_retry(
+            session, module_name, start_date, end_date, FETCH_PARTITION_RETRIES, after=cursor, limit=page_size
+        )
+        if records is None:
+            if not relogged and contahub_sessions.was_invalidated(session):
+                relogged = True
+                logger.info(f"🔄 Repetindo página de {module_name} com nova sessão...")
+                session = contahub_sessions.get_session()
+                if session:
+                    continue
+            return counts['fetched'], counts['written'], f'Erro ao buscar página de {module_name} (cursor salvo para retomar)'
+        
+        if records:
+            counts['fetched'] += len(records)
+            store_records(module_name, records)
+            rows = list(iter_process_records(module_name, records, stats))
+            report_progress(progress, 'write', records_processed=(stats or {}).get('processed', 0))
+            written = write_to_google_sheets(module_name, rows, write_mode, write_stats) if rows else 0
+            if written is None:
+                return counts['fetched'], counts['written'], 'Erro ao enviar dados para Google Sheets'
+            counts['written'] += written
+            report_progress(progress, 'write', records_written=counts['written'])
+            
+            next_cursor = [records[-1].get(column) for column in order_by]
+            if next_cursor == cursor:
+                return counts['fetched'], counts['written'], f'Cursor de {module_name} não avançou na página'
+            cursor = next_cursor
+            done += len(records)
+            watermarks.set_cursor(module_name, start_date, end_date, cursor, done)
+        
+        if len(records) < page_size:
+            watermarks.clear_cursor(module_name, start_date, end_date)
+            logger.info(f"Módulo {module_name}: busca paginada concluída ({done} registros no período)")
+            return counts['fetched'], counts['written'], None
+
+def run_module_pipeline(session, module_name, mode, lookback_days, stream, use_cache, write_mode, progress=None,
+                        paginate=False):
+    """Executa busca, processamento e envio de um módulo, medindo cada etapa
+
+    Retorna um dict com sucesso/erro, período, contagens e tempos por etapa.
+    """
+    started = time.time()
+    timings = {}
+    transform_stats = {}
+    write_stats = {}
+    result = {
+        'success': False,
+        'fetched': 0,
+        'written': 0
+    }
+    
+    # Período (janela fixa ou incremental a partir da marca d'água do módulo)
+    start_date, end_date = resolve_period(module_name, mode, lookback_days)
+    result['period'] = f"{start_date} até {end_date}"
+    logger.info(f"📅 {module_name} ({mode}): {start_date} até {end_date}")
+    
+    if paginate:
+        logger.info(f"📄 {module_name} em modo paginado: páginas de {PAGE_SIZE} registros")
+        fetched, written, error_msg = execute_module_paginated(
+            session, module_name, start_date, end_date, write_mode, progress, transform_stats, write_stats
+        )
+        timings['paginated'] = round(time.time() - started, 3)
+        result['fetched'] = fetched
+        result['written'] = written
+    elif stream:
+        logger.info(f"🌊 {module_name} em modo streaming: lotes de {STREAM_BATCH_SIZE} linhas")
+        fetched, written, error_msg = execute_module_streaming(
+            session, module_name, start_date, end_date, write_mode, progress, transform_stats, write_stats
+        )
+        timings['stream'] = round(time.time() - started, 3)
+        result['fetched'] = fetched
+        result['written'] = written
+    else:
+        error_msg = None
+        
+        # Busca
+        report_progress(progress, 'fetch')
+        stage_started = time.time()
+        if use_cache:
+            records = fetch_with_cache(module_name, start_date, end_date)
+        else:
+            records = fetch_with_session(module_name, start_date, end_date)
+        timings['fetch'] = round(time.time() - stage_started, 3)
+        
+        if records is not None:
+            store_records(module_name, records, start_date, end_date)
+            
+        if records is None:
+            error_msg = f'Erro ao buscar dados de {module_name}'
+        elif not records:
+            logger.warning(f"⚠️ Nenhum dado encontrado em {module_name}")
+        else:
+            result['fetched'] = len(records)
+            
+            # Processamento
+            report_progress(progress, 'transform', records_fetched=len(records))
+            logger.info(f"⚙️ Processando {len(records)} registros de {module_name}...")
+            stage_started = time.time()
+            processed_data = list(iter_process_records(module_name, records, transform_stats))
+            timings['transform'] = round(time.time() - stage_started, 3)
+            del records
+            
+            # Envio para Google Sheets
+            if processed_data:
+                report_progress(progress, 'write', records_processed=len(processed_data))
+                logger.info(f"📝 Enviando {module_name} para Google Sheets...")
+                stage_started = time.time()
+                written = write_to_google_sheets(module_name, processed_data, write_mode, write_stats)
+                timings['write'] = round(time.time() - stage_started, 3)
+                
+                if written is None:
+                    error_msg = 'Erro ao enviar dados para Google Sheets'
+                else:
+                    result['written'] = written
+                    report_progress(progress, 'write', records_written=written)
+    
+    timings['total'] = round(time.time() - started, 3)
+    for stage, seconds in timings.items():
+        STAGE_SECONDS.observe(seconds, module=module_name, stage=stage)
+    result.update({
+        'timings': timings,
+        'failed_records': transform_stats.get('failed', 0),
+        'transform_errors': transform_stats.get('errors', []),
+        'sheets_write': write_stats
+    })
+    
+    if error_msg:
+        logger.error(f"❌ {module_name}: {error_msg}")
+        result['error'] = error_msg
+        return result
+    
+    # Avançar a marca d'água do módulo (só no modo incremental)
+    if mode == 'incremental':
+        watermarks.set(module_name, end_date)
+    
+    logger.info(f"✅ {module_name}: {result['written']} linhas gravadas em {timings['total']}s")
+    result['success'] = True
+    return result
+
+def execute_testefinal_real(progress=None, stream=None, mode=None, lookback_days=None, use_cache=None,
+                            write_mode=None, modules=None, aggregate=None, paginate=None, force=False):
     """
     Executa o código REAL do testefinal.py
+
+    progress: callback opcional progress(stage, **contadores) usado pelo modo assíncrono
+    stream: usa a busca em streaming com envio em lotes (padrão: STREAM_FETCH)
+    mode: 'fixed' (janela fixa) ou 'incremental' (a partir da marca d'água; padrão: SYNC_MODE)
+    lookback_days: dias reprocessados antes da marca d'água no modo incremental
+    use_cache: serve dias fechados do cache local (padrão: RECORD_CACHE_ENABLED; ignorado no streaming)
+    write_mode: 'append' ou 'upsert' (só chaves ainda não gravadas; padrão: WRITE_MODE no modo
+    fixo, upsert no incremental, que recusa append)
+    modules: módulos processados em paralelo, cada um na aba de mesmo nome (padrão: DEFAULT_MODULES)
+    aggregate: troca cada módulo pelo resumo diário agregado no ContaHub, gravado na aba
+    do resumo (ex.: analitico -> analitico_diario); módulos sem resumo seguem detalhados
+    (padrão: AGGREGATE_MODE)
+    paginate: busca em páginas keyset de PAGE_SIZE registros, gravando cada página ao chegar
+    e retomando do último cursor gravado após falhas (padrão: PAGINATED_FETCH)
+    force: executa mesmo se houver execução igual em andamento ou resultado recente em cache
+    
+    Disparos com os mesmos módulos, período e modo de escrita são coalescidos:
+    quem chega durante a execução recebe o resultado dela e, logo após o fim,
+    o resultado de sucesso é reaproveitado por RUN_RESULT_CACHE_SECONDS
+    (marcado com 'coalesced': 'joined' ou 'cached').
     """
+    stream = STREAM_FETCH if stream is None else stream
+    use_cache = RECORD_CACHE_ENABLED if use_cache is None else use_cache
+    mode = SYNC_MODE if mode is None else mode
+    try:
+        write_mode = resolve_write_mode(mode, write_mode)
+    except ValueError as e:
+        return {'success': False, 'error': str(e)}
+    modules = list(DEFAULT_MODULES if modules is None else modules)
+    aggregate = AGGREGATE_MODE if aggregate is None else aggregate
+    paginate = PAGINATED_FETCH if paginate is None else paginate
+    if aggregate:
+        modules = [get_aggregate_module(module_name) or module_name for module_name in modules]
+        
+    def execute():
+        return run_testefinal(progress, stream, mode, lookback_days, use_cache, write_mode, modules, aggregate,
+                              paginate)
+                              
     try:
-        logger.info("🔐 Fazendo login no ContaHub...")
+        periods = {module_name: resolve_period(module_name, mode, lookback_days) for module_name in modules}
+    except ValueError:
+        # Modo inválido: a execução normal devolve o erro
+        force = True
+    if force:
+        return execute()
         
-        # 1. Tentar login principal
-        session = login_contahub()
+    key = SingleFlight.make_key(sorted(modules), periods, write_mode)
+    result, source = run_coalescer.do(key, execute)
+    if source == SOURCE_EXECUTED:
+        return result
         
-        # 2. Se falhar, tentar método alternativo
-        if not session:
-            logger.info("🔄 Tentando método de login alternativo...")
-            session = login_contahub_alternative()
+    logger.info(f"🔗 Disparo coalescido ({source}) com a execução {result.get('run_id')}")
+    result = dict(result, coalesced=source)
+    if 'data' in result:
+        result['data'] = dict(result['data'], coalesced=source)
+    return result
+
+def run_testefinal(progress, stream, mode, lookback_days, use_cache, write_mode, modules, aggregate, paginate):
+    """Uma execução registrada no histórico (opções já resolvidas por execute_testefinal_real)"""
+    run_id = new_run_id()
+    run_history.start(run_id, {
+        'stream': stream,
+        'mode': mode,
+        'lookback_days': lookback_days,
+        'use_cache': use_cache,
+        'write_mode': write_mode,
+        'modules': modules,
+        'aggregate': aggregate,
+        'paginate': paginate
+    })
+    
+    RUNS_IN_FLIGHT.inc()
+    try:
+        with run_context(run_id):
+            result = run_testefinal_modules(
+                run_id, progress, stream, mode, lookback_days, use_cache, write_mode, modules, paginate
+            )
+    finally:
+        RUNS_IN_FLIGHT.dec()
+    
+    run_history.finish(run_id, result['success'], result.get('error'))
+    result['run_id'] = run_id
+    if result['success']:
+        result['data']['run_id'] = run_id
+    return result
+
+def run_testefinal_modules(run_id, progress, stream, mode, lookback_days, use_cache, write_mode, modules, paginate):
+    """Login e execução dos módulos em paralelo (opções já resolvidas por execute_testefinal_real)"""
+    try:
+        invalid_modules = [module_name for module_name in modules if not get_schema(module_name)]
+        if invalid_modules or not modules:
+            return {
+                'success': False,
+                'error': f"Módulos inválidos: {invalid_modules or modules}"
+            }
+        
+        started = time.time()
+        report_progress(progress, 'login')
+        logger.info("🔐 Obtendo sessão do ContaHub...")
+        
+        # 1. Reaproveitar sessão ativa ou fazer login (principal e depois alternativo)
+        session = contahub_sessions.get_session()
         
         if not session:
             error_msg = 'Falha ao fazer login no ContaHub - tentados ambos os métodos'
@@ -438,58 +1103,53 @@ def execute_testefinal_real():
                 'error': error_msg
             }
         
-        logger.info("✅ Login no ContaHub realizado com sucesso")
+        logger.info("✅ Sessão ContaHub pronta")
         
-        # 2. Definir período (usando datas fixas por enquanto)
-        start_date = DEFAULT_FIXED_START_DATE
-        end_date = DEFAULT_FIXED_END_DATE
+        # 2. Cada módulo busca, processa e grava em paralelo (sessão e cliente Sheets compartilhados)
+        logger.info(f"📊 Processando módulos: {', '.join(modules)}")
+        pipeline_progress = PipelineProgress(progress, modules)
         
-        logger.info(f"📅 Período: {start_date} até {end_date}")
-        
-        # 3. Processar módulo analítico
-        logger.info("📊 Buscando dados analíticos...")
-        records_analitico = fetch_data_contahub(session, 'analitico', start_date, end_date)
+        with ThreadPoolExecutor(max_workers=len(modules), thread_name_prefix='module') as executor:
+            futures = {
+                module_name: submit_with_context(
+                    executor, run_module_pipeline, session, module_name, mode, lookback_days, stream, use_cache,
+                    write_mode, pipeline_progress.for_module(module_name), paginate
+                )
+                for module_name in modules
+            }
+            module_results = {}
+            for module_name, future in futures.items():
+                try:
+                    module_results[module_name] = future.result()
+                except Exception as e:
+                    logger.error(f"❌ Erro no módulo {module_name}: {str(e)}", exc_info=True)
+                    module_results[module_name] = {'success': False, 'error': f"Erro na execução: {str(e)}"}
+                run_history.record_module(run_id, module_name, module_results[module_name])
         
-        if records_analitico is None:
+        errors = [f"{name}: {result['error']}" for name, result in module_results.items() if not result['success']]
+        if errors:
             return {
                 'success': False,
-                'error': 'Erro ao buscar dados analíticos'
+                'error': '; '.join(errors),
+                'modules': module_results
             }
         
-        if not records_analitico:
-            logger.warning("⚠️ Nenhum dado analítico encontrado")
-            total_records = 0
-        else:
-            # 4. Processar dados
-            logger.info(f"⚙️ Processando {len(records_analitico)} registros analíticos...")
-            processed_data = process_data_analitico(records_analitico)
-            
-            if processed_data:
-                # 5. Enviar para Google Sheets
-                logger.info("📝 Enviando dados para Google Sheets...")
-                result_sheets = append_to_google_sheets('analitico', processed_data)
-                
-                if result_sheets:
-                    logger.info("✅ Dados enviados com sucesso para Google Sheets")
-                    total_records = len(processed_data)
-                else:
-                    logger.error("❌ Erro ao enviar dados para Google Sheets")
-                    return {
-                        'success': False,
-                        'error': 'Erro ao enviar dados para Google Sheets'
-                    }
-            else:
-                total_records = 0
-        
-        # 6. Retornar sucesso
+        # 3. Retornar sucesso
+        total_records = sum(result['written'] for result in module_results.values())
         return {
             'success': True,
             'data': {
                 'processed_items': total_records,
                 'sheets_updated': total_records > 0,
                 'execution_date': datetime.now().isoformat(),
-                'period': f"{start_date} até {end_date}",
-                'modules_processed': ['analitico']
+                'period': module_results[modules[0]]['period'],
+                'sync_mode': mode,
+                'write_mode': write_mode,
+                'modules_processed': modules,
+                'failed_records': sum(result['failed_records'] for result in module_results.values()),
+                'modules': module_results,
+                'duration_seconds': round(time.time() - started, 3),
+                'contahub_session': contahub_sessions.stats()
             }
         }
         
@@ -500,14 +1160,326 @@ def execute_testefinal_real():
             'error': f"Erro na execução: {str(e)}"
         }
 
+@contextmanager
+def backfill_guard(backfill_id):
+    """Uma rodada por backfill: entre threads deste processo e, com shared_state, entre workers
+
+    Produz False se outra rodada do mesmo backfill já estiver em andamento.
+    """
+    with active_backfills_lock:
+        if backfill_id in active_backfills:
+            yield False
+            return
+        active_backfills.add(backfill_id)
+    try:
+        if shared_state is None:
+            yield True
+        else:
+            with shared_state.lock(f"backfill_{backfill_id}", timeout=1) as acquired:
+                yield acquired
+    finally:
+        with active_backfills_lock:
+            active_backfills.discard(backfill_id)
+
+def run_backfill(backfill_id, progress=None):
+    """Executa (ou retoma) as tarefas pendentes de um backfill
+    
+    Cada tarefa busca um dia de um módulo (servindo do cache local quando
+    habilitado), converte e grava na aba do módulo; as concluídas ficam
+    registradas e não são refeitas numa nova rodada.
+    """
+    backfill = backfills.get(backfill_id)
+    if not backfill:
+        return {'success': False, 'error': f'Backfill {backfill_id} não encontrado'}
+        
+    def fetch(module_name, day):
+        if RECORD_CACHE_ENABLED:
+            records = fetch_with_cache(module_name, day, day)
+        else:
+            records = fetch_with_session(module_name, day, day)
+        store_records(module_name, records, day, day)
+        return records
+        
+    def transform(module_name, records):
+        return list(iter_process_records(module_name, records))
+        
+    def write(module_name, rows):
+        return write_to_google_sheets(module_name, rows, backfill['write_mode'])
+        
+    runner = BackfillRunner(
+        backfills, fetch, transform, write,
+        fetch_workers=BACKFILL_FETCH_WORKERS,
+        write_workers=BACKFILL_WRITE_WORKERS,
+        queue_size=BACKFILL_QUEUE_DAYS,
+        retries=BACKFILL_TASK_RETRIES
+    )
+    
+    with backfill_guard(backfill_id) as acquired:
+        if not acquired:
+            return {'success': False, 'error': f'Backfill {backfill_id} já está em execução'}
+        
+        RUNS_IN_FLIGHT.inc()
+        try:
+            # Os logs do backfill ficam em /logs?run_id=<backfill_id>
+            with run_context(backfill_id):
+                summary = runner.run(backfill_id, progress)
+        except Exception as e:
+            logger.error(f"❌ Erro no backfill {backfill_id}: {str(e)}", exc_info=True)
+            return {'success': False, 'error': f"Erro no backfill: {str(e)}"}
+        finally:
+            RUNS_IN_FLIGHT.dec()
+    
+    if summary['status'] != BACKFILL_COMPLETED:
+        return {'success': False, 'error': summary['error']}
+    return {'success': True, 'data': summary}
+
+def submit_backfill_job(backfill_id):
+    """Agenda run_backfill() no executor de jobs e responde 202 com o progresso atual"""
+    try:
+        job = job_manager.submit('backfill', run_backfill, params={'backfill_id': backfill_id},
+                                 backfill_id=backfill_id)
+    except JobQueueFull as e:
+        logger.warning(f"⚠️ Backfill recusado: {str(e)}")
+        return jsonify({
+            'status': 'error',
+            'error': f'Fila de jobs cheia: {str(e)}',
+            'backfill_id': backfill_id,
+            'timestamp': datetime.now().isoformat()
+        }), 429
+        
+    return jsonify({
+        'status': 'accepted',
+        'backfill_id': backfill_id,
+        'job_id': job.id,
+        'status_url': f'/backfill/{backfill_id}',
+        'backfill': backfills.progress(backfill_id),
+        'timestamp': datetime.now().isoformat()
+    }), 202
+
+def resume_unfinished_backfills(workers=1):
+    """Reagenda os backfills não concluídos (interrompidos por queda ou redeploy)
+    
+    Chamado ao iniciar cada worker (workers: quantos processos fazem o mesmo).
+    Com vários workers só retoma se houver shared_state: o lock entre processos
+    de run_backfill deixa um só deles executar cada backfill; sem ele todos
+    executariam o mesmo backfill ao mesmo tempo. Retorna os ids reagendados.
+    """
+    if not BACKFILL_AUTO_RESUME:
+        return []
+    if workers > 1 and shared_state is None:
+        logger.warning("⚠️ Backfills não retomados automaticamente: vários workers sem estado compartilhado "
+                       "(SHARED_STATE_ENABLED=false); use POST /backfill/<id>/resume")
+        return []
+    
+    resumed = []
+    for backfill_id in backfills.unfinished():
+        try:
+            job_manager.submit('backfill', run_backfill, params={'backfill_id': backfill_id},
+                               backfill_id=backfill_id)
+        except JobQueueFull as e:
+            logger.warning(f"⚠️ Backfills restantes não reagendados: {str(e)}")
+            break
+        resumed.append(backfill_id)
+    if resumed:
+        logger.info(f"🗓️ Retomando {len(resumed)} backfill(s) interrompido(s): {', '.join(resumed)}")
+    return resumed
+
+@app.route('/backfill', methods=['POST'])
+@require_api_key
+def create_backfill():
+    """Endpoint para ressincronizar um intervalo histórico em background
+    
+    Corpo: {"start_date": "YYYY-MM-DD", "end_date": "YYYY-MM-DD", "modules": [...],
+    "write_mode": "upsert"|"append"} (padrão upsert: reprocessar um dia não
+    duplica linhas). Um backfill igual ainda não concluído é
+    retomado em vez de recriado; o andamento e o ETA ficam em GET /backfill/<id>.
+    """
+    try:
+        payload = request.get_json(silent=True) or {}
+        modules = payload.get('modules', DEFAULT_MODULES)
+        modules = [modules] if isinstance(modules, str) else list(modules)
+        write_mode = str(payload.get('write_mode', 'upsert'))
+        invalid_modules = [module_name for module_name in modules if not get_schema(module_name)]
+        if not payload.get('start_date') or not payload.get('end_date') or invalid_modules or not modules:
+            raise ValueError(f"Informe start_date, end_date e módulos válidos (inválidos: {invalid_modules})")
+        if write_mode not in WRITE_MODES:
+            raise ValueError(f"Modo de escrita inválido: {write_mode}")
+            
+        backfill_id, created = backfills.create(
+            modules, str(payload['start_date']), str(payload['end_date']), write_mode
+        )
+    except ValueError as e:
+        return jsonify({
+            'status': 'error',
+            'error': str(e),
+            'timestamp': datetime.now().isoformat()
+        }), 400
+        
+    logger.info(f"🗓️ Backfill {backfill_id} {'criado' if created else 'retomado'}: "
+                f"{payload['start_date']} até {payload['end_date']} ({', '.join(modules)})")
+    return submit_backfill_job(backfill_id)
+
+@app.route('/backfill', methods=['GET'])
+@require_api_key
+def list_backfills():
+    """Endpoint com os backfills mais recentes e seu progresso"""
+    limit = request.args.get('limit', 20, type=int)
+    items = [backfills.progress(backfill['id']) for backfill in backfills.list(limit)]
+    return jsonify({
+        'status': 'success',
+        'count': len(items),
+        'backfills': items,
+        'timestamp': datetime.now().isoformat()
+    })
+
+@app.route('/backfill/<backfill_id>', methods=['GET'])
+@require_api_key
+def get_backfill(backfill_id):
+    """Endpoint com progresso, taxa (tarefas/min) e ETA de um backfill"""
+    progress = backfills.progress(backfill_id)
+    if not progress:
+        return jsonify({
+            'status': 'error',
+            'error': f'Backfill {backfill_id} não encontrado',
+            'timestamp': datetime.now().isoformat()
+        }), 404
+        
+    with active_backfills_lock:
+        progress['active_in_process'] = backfill_id in active_backfills
+    return jsonify(progress)
+
+@app.route('/backfill/<backfill_id>/resume', methods=['POST'])
+@require_api_key
+def resume_backfill(backfill_id):
+    """Endpoint para retomar um backfill interrompido (queda, redeploy ou tarefas com falha)"""
+    if not backfills.get(backfill_id):
+        return jsonify({
+            'status': 'error',
+            'error': f'Backfill {backfill_id} não encontrado',
+            'timestamp': datetime.now().isoformat()
+        }), 404
+        
+    logger.info(f"🗓️ Retomando backfill {backfill_id}")
+    return submit_backfill_job(backfill_id)
+
+@app.route('/data', methods=['GET'])
+@require_api_key
+def data_summary():
+    """Endpoint com os módulos da cópia local, linhas e intervalo de datas guardados"""
+    if data_store is None:
+        return jsonify({
+            'status': 'error',
+            'error': 'Cópia local desabilitada (LOCAL_STORE_ENABLED=false)',
+            'timestamp': datetime.now().isoformat()
+        }), 404
+        
+    return jsonify({
+        'status': 'success',
+        'data_store': data_store.stats(),
+        'formats': [fmt for fmt in EXPORT_FORMATS if fmt != 'parquet' or parquet_available()],
+        'filters': list(FILTER_COLUMNS),
+        'timestamp': datetime.now().isoformat()
+    })
+
+@app.route('/data/<module_name>', methods=['GET'])
+@require_api_key
+def get_data(module_name):
+    """Endpoint de leitura da cópia local, enviada em blocos sem montar a resposta em memória
+    
+    Query string: start_date e end_date (YYYY-MM-DD), columns (lista separada por
+    vírgula), filtros de igualdade vd, prd e grp_desc, limit e format (csv,
+    ndjson ou parquet; parquet exige pyarrow instalado). Colunas ou filtros
+    que o módulo não tem e limit não inteiro respondem 400.
+    """
+    def error(message, status_code):
+        return jsonify({
+            'status': 'error',
+            'error': message,
+            'timestamp': datetime.now().isoformat()
+        }), status_code
+        
+    if data_store is None or not data_store.supports(module_name):
+        return error(f'Módulo {module_name} não disponível na cópia local', 404)
+        
+    fmt = request.args.get('format', 'csv').lower()
+    if fmt not in EXPORT_FORMATS:
+        return error(f'Formato inválido: {fmt} (use {", ".join(EXPORT_FORMATS)})', 400)
+    if fmt == 'parquet' and not parquet_available():
+        return error('Exportação Parquet indisponível: pyarrow não está instalado', 501)
+        
+    available = DataStore.columns(module_name)
+    columns = [column.strip() for column in request.args.get('columns', '').split(',') if column.strip()]
+    invalid_columns = [column for column in columns if column not in available]
+    if invalid_columns:
+        return error(f'Colunas inválidas para {module_name}: {invalid_columns}', 400)
+        
+    start_date = request.args.get('start_date')
+    end_date = request.args.get('end_date')
+    try:
+        for value in (start_date, end_date):
+            if value:
+                date.fromisoformat(value)
+    except ValueError:
+        return error('Datas devem estar no formato YYYY-MM-DD', 400)
+        
+    filters = {column: request.args[column] for column in FILTER_COLUMNS if column in request.args}
+    invalid_filters = [column for column in filters if column not in available]
+    if invalid_filters:
+        return error(f'Filtros inválidos para {module_name}: {invalid_filters}', 400)
+        
+    limit = request.args.get('limit')
+    if limit is not None:
+        try:
+            limit = int(limit)
+        except ValueError:
+            limit = -1
+        if limit < 0:
+            return error(f"limit inválido: {request.args['limit']} (use um inteiro >= 0)", 400)
+        
+    columns = columns or available
+    batches = data_store.query(
+        module_name, start_date, end_date, columns, filters,
+        limit=limit,
+        batch_size=DATA_BATCH_SIZE
+    )
+    
+    if fmt == 'csv':
+        body = iter_csv(columns, batches)
+    elif fmt == 'ndjson':
+        body = iter_ndjson(columns, batches)
+    else:
+        body = iter_parquet(module_name, columns, batches)
+        
+    content_type, extension = EXPORT_FORMATS[fmt]
+    return Response(body, content_type=content_type, headers={
+        'Content-Disposition': f'attachment; filename="{module_name}.{extension}"'
+    })
+
 @app.route('/logs', methods=['GET'])
 @require_api_key
 def get_logs():
-    """Endpoint para ver logs recentes"""
+    """Endpoint para ver logs recentes do processo (mais recentes primeiro)
+
+    Filtros na query string: run_id, level (nível mínimo, ex.: warning) e limit.
+    """
     try:
+        level = request.args.get('level')
+        if level and parse_level(level) is None:
+            return jsonify({
+                'status': 'error',
+                'error': f'Nível de log inválido: {level}',
+                'timestamp': datetime.now().isoformat()
+            }), 400
+        
+        records = log_buffer.records(
+            run_id=request.args.get('run_id'),
+            level=level,
+            limit=request.args.get('limit', 200, type=int)
+        )
         return jsonify({
             'status': 'success',
-            'message': 'Logs disponíveis no dashboard da plataforma cloud',
+            'count': len(records),
+            'logs': records,
             'timestamp': datetime.now().isoformat()
         })
         
@@ -518,6 +1490,47 @@ def get_logs():
             'timestamp': datetime.now().isoformat()
         }), 500
 
+@app.route('/runs', methods=['GET'])
+@require_api_key
+def get_runs():
+    """Endpoint com o resumo das últimas execuções (período, módulos, contagens, tempos e erros)
+
+    Filtros na query string: run_id, status (running, succeeded, failed) e limit.
+    """
+    runs = run_history.runs(
+        run_id=request.args.get('run_id'),
+        status=request.args.get('status'),
+        limit=request.args.get('limit', 50, type=int)
+    )
+    return jsonify({
+        'status': 'success',
+        'count': len(runs),
+        'runs': runs,
+        'timestamp': datetime.now().isoformat()
+    })
+
+@app.route('/session-stats', methods=['GET'])
+@require_api_key
+def session_stats():
+    """Endpoint com contadores do gerenciador de sessões ContaHub"""
+    return jsonify({
+        'status': 'success',
+        'contahub_session': contahub_sessions.stats(),
+        'contahub_limiter': contahub_limiter.stats(),
+        'google_sheets': sheets_clients.stats(),
+        'sheets_writer': sheets_writer.stats(),
+        'record_cache': record_cache.stats(),
+        'run_coalescer': run_coalescer.stats(),
+        'shared_state': shared_state.stats() if shared_state else None,
+        'timestamp': datetime.now().isoformat()
+    })
+
+@app.route('/metrics', methods=['GET'])
+@require_api_key
+def metrics():
+    """Métricas do processo no formato de exposição do Prometheus"""
+    return Response(REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/debug-login', methods=['GET'])
 def debug_login():
     """Endpoint para debug do login ContaHub"""
@@ -602,9 +1615,19 @@ if __name__ == '__main__':
     print(f"🚀 API Cloud REAL iniciando na porta {port}")
     print(f"📋 Endpoints disponíveis:")
     print(f"   GET  /health")
+    print(f"   GET  /ready")
     print(f"   GET  /test")
     print(f"   POST /execute-testefinal")
+    print(f"   GET  /jobs/<id>")
+    print(f"   POST /backfill")
+    print(f"   GET  /backfill/<id>")
+    print(f"   POST /backfill/<id>/resume")
+    print(f"   GET  /data")
+    print(f"   GET  /data/<modulo>")
     print(f"   GET  /logs")
+    print(f"   GET  /runs")
+    print(f"   GET  /session-stats")
+    print(f"   GET  /metrics")
     print(f"   GET  /debug-login")
     print(f"   GET  /debug-env")
     print(f"🔐 API Key: {API_KEY}")
@@ -612,4 +1635,5 @@ if __name__ == '__main__':
     print(f"📊 Google Sheets: {SHEET_NAME}")
     print(f"🌐 Ambiente: Cloud REAL")
     
+    resume_unfinished_backfills()
     app.run(host='0.0.0.0', port=port, debug=False) 
@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+"""
+Controle de concorrência e circuit breaker das chamadas ao ContaHub
+Ajusta o limite de requisições simultâneas por AIMD (latência e 429), respeita
+Retry-After e abre o circuito após 403 seguidos para não provocar bloqueio de IP
+"""
+import time
+import logging
+import threading
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+from metrics import CONTAHUB_CONCURRENCY_LIMIT, CONTAHUB_CIRCUIT_STATE, CONTAHUB_THROTTLED
+
+logger = logging.getLogger(__name__)
+
+CIRCUIT_CLOSED = 'closed'
+CIRCUIT_HALF_OPEN = 'half_open'
+CIRCUIT_OPEN = 'open'
+
+_CIRCUIT_VALUES = {CIRCUIT_CLOSED: 0, CIRCUIT_HALF_OPEN: 1, CIRCUIT_OPEN: 2}
+
+
+class ContaHubUnavailable(Exception):
+    """Chamada recusada localmente (circuito aberto ou espera por Retry-After longa demais)"""
+
+
+def parse_retry_after(value, now=None):
+    """Segundos de espera do cabeçalho Retry-After (segundos ou data HTTP); None se ausente/inválido"""
+    if not value:
+        return None
+    value = str(value).strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        moment = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    now = datetime.now(timezone.utc) if now is None else now
+    return max(0.0, (moment - now).total_seconds())
+
+
+class ContaHubLimiter:
+    """Limita as requisições simultâneas ao ContaHub e protege contra bloqueio
+
+    AIMD: cada resposta rápida soma 1/limite ao limite (cerca de +1 por rodada
+    completa); um 429, erro de conexão/timeout ou resposta acima de
+    latency_target multiplica o limite por decrease. Um 429 ou 503 com
+    Retry-After pausa todas as chamadas até o prazo. failure_threshold 403
+    seguidos abrem o circuito por open_seconds: as chamadas falham na hora com
+    ContaHubUnavailable; depois disso uma única chamada de teste (half-open)
+    fecha o circuito se passar ou o reabre se receber outro 403.
+
+    Só contam como bloqueio os 403 do login e os de /query recebidos até
+    fresh_login_window segundos depois de um login bem-sucedido (avisado com
+    login_succeeded()). Fora disso, um 403 de /query é sessão expirada: o
+    gerenciador de sessões refaz o login e o circuito não é afetado.
+
+    O slot é liberado quando a resposta chega (em streaming, ao receber os
+    cabeçalhos), não ao terminar a leitura do corpo.
+    """
+
+    def __init__(self, initial=4, min_limit=1, max_limit=16, latency_target=15.0, decrease=0.5,
+                 failure_threshold=3, open_seconds=300, max_wait=300, default_retry_after=30, max_retry_after=600,
+                 fresh_login_window=60):
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max(self.min_limit, max_limit)
+        self.latency_target = latency_target
+        self.decrease = decrease
+        self.failure_threshold = failure_threshold
+        self.open_seconds = open_seconds
+        self.max_wait = max_wait
+        self.default_retry_after = default_retry_after
+        self.max_retry_after = max_retry_after
+        self.fresh_login_window = fresh_login_window
+
+        self._condition = threading.Condition()
+        self._limit = float(min(max(initial, self.min_limit), self.max_limit))
+        self._in_flight = 0
+        self._paused_until = 0.0
+        self._circuit = CIRCUIT_CLOSED
+        self._opened_until = 0.0
+        self._probe_in_flight = False
+        self._consecutive_403 = 0
+        self._last_login_at = 0.0
+
+        # Contadores
+        self.calls = 0
+        self.rate_limited = 0
+        self.forbidden = 0
+        self.rejected = 0
+        self.circuit_opens = 0
+        self._publish()
+
+    @property
+    def limit(self):
+        return int(self._limit)
+
+    def call(self, endpoint, fn, *args, **kwargs):
+        """Executa fn(*args, **kwargs) (ex.: session.post) sob o limite e o circuito
+
+        Retorna a resposta de fn. Levanta ContaHubUnavailable sem chamar fn se
+        o circuito estiver aberto ou se a espera por um slot/Retry-After passar
+        de max_wait segundos; exceções de fn são repassadas.
+        """
+        probe = self._acquire(endpoint)
+        started = time.time()
+        try:
+            response = fn(*args, **kwargs)
+        except Exception:
+            self._release(endpoint, probe, status_code=None, latency=time.time() - started)
+            raise
+        self._release(endpoint, probe, getattr(response, 'status_code', None), time.time() - started,
+                      getattr(response, 'headers', None) or {})
+        return response
+
+    def login_succeeded(self):
+        """Avisa que um login foi aceito: zera a sequência de 403 e abre a janela de 403 suspeitos"""
+        with self._condition:
+            self._consecutive_403 = 0
+            self._last_login_at = time.time()
+
+    def is_open(self):
+        """Indica se o circuito está aberto (chamadas seriam recusadas agora)"""
+        with self._condition:
+            return self._circuit == CIRCUIT_OPEN and time.time() < self._opened_until
+
+    def _acquire(self, endpoint):
+        deadline = time.time() + self.max_wait
+        with self._condition:
+            while True:
+                now = time.time()
+                if self._circuit == CIRCUIT_OPEN:
+                    if now < self._opened_until:
+                        self._reject(endpoint, 'circuit_open',
+                                     f"circuito aberto por mais {self._opened_until - now:.0f}s após 403 seguidos")
+                    self._circuit = CIRCUIT_HALF_OPEN
+                    self._publish()
+                    logger.info("🔌 Circuito ContaHub em teste (half-open)")
+
+                if self._paused_until > now and self._paused_until > deadline:
+                    self._reject(endpoint, 'rate_limited',
+                                 f"Retry-After de {self._paused_until - now:.0f}s excede a espera máxima")
+
+                # Em half-open só uma chamada de teste passa por vez
+                probing = self._circuit == CIRCUIT_HALF_OPEN
+                if probing and not self._probe_in_flight and self._paused_until <= now and self._in_flight == 0:
+                    self._probe_in_flight = True
+                    self._in_flight += 1
+                    self.calls += 1
+                    return True
+                if not probing and self._paused_until <= now and self._in_flight < self.limit:
+                    self._in_flight += 1
+                    self.calls += 1
+                    return False
+
+                if now >= deadline:
+                    self._reject(endpoint, 'saturated', f"sem slot livre em {self.max_wait}s")
+                wake_at = min(deadline, self._paused_until) if self._paused_until > now else deadline
+                self._condition.wait(max(0.01, wake_at - now))
+
+    def _reject(self, endpoint, reason, detail):
+        self.rejected += 1
+        CONTAHUB_THROTTLED.inc(endpoint=endpoint, reason=reason)
+        raise ContaHubUnavailable(f"ContaHub indisponível ({endpoint}): {detail}")
+
+    def _is_block_signal(self, endpoint):
+        """403 no login, ou em /query logo após um login aceito (a sessão não pode estar expirada)"""
+        return endpoint == 'login' or time.time() - self._last_login_at < self.fresh_login_window
+
+    def _release(self, endpoint, probe, status_code, latency, headers=None):
+        with self._condition:
+            self._in_flight -= 1
+            if probe:
+                self._probe_in_flight = False
+
+            if status_code == 403:
+                self.forbidden += 1
+                if self._is_block_signal(endpoint):
+                    self._consecutive_403 += 1
+                    self._decrease()
+                    if probe or self._consecutive_403 >= self.failure_threshold:
+                        self._open_circuit()
+            elif status_code in (429, 503):
+                if status_code == 429:
+                    self.rate_limited += 1
+                self._decrease()
+                retry_after = parse_retry_after(headers.get('Retry-After')) if headers else None
+                wait = min(self.default_retry_after if retry_after is None else retry_after, self.max_retry_after)
+                self._paused_until = max(self._paused_until, time.time() + wait)
+                logger.warning(f"⏳ ContaHub respondeu {status_code}: pausando chamadas por {wait:.0f}s "
+                               f"(limite {self.limit})")
+            elif status_code is None or latency > self.latency_target:
+                # Timeout/erro de conexão ou resposta lenta: sinal de sobrecarga
+                self._decrease()
+            else:
+                self._limit = min(self.max_limit, self._limit + 1.0 / self._limit)
+
+            if status_code is not None and status_code != 403:
+                self._consecutive_403 = 0
+                if probe and self._circuit == CIRCUIT_HALF_OPEN:
+                    self._circuit = CIRCUIT_CLOSED
+                    logger.info("🔌 Circuito ContaHub fechado")
+            elif status_code is None and probe and self._circuit == CIRCUIT_HALF_OPEN:
+                self._circuit = CIRCUIT_OPEN
+                self._opened_until = time.time() + self.open_seconds
+
+            self._publish()
+            self._condition.notify_all()
+
+    def _decrease(self):
+        self._limit = max(float(self.min_limit), self._limit * self.decrease)
+
+    def _open_circuit(self):
+        self._circuit = CIRCUIT_OPEN
+        self._opened_until = time.time() + self.open_seconds
+        self.circuit_opens += 1
+        logger.error(f"🔌 Circuito ContaHub aberto por {self.open_seconds}s após "
+                     f"{self._consecutive_403} resposta(s) 403 seguidas (possível bloqueio de IP)")
+
+    def _publish(self):
+        CONTAHUB_CONCURRENCY_LIMIT.set(self.limit)
+        CONTAHUB_CIRCUIT_STATE.set(_CIRCUIT_VALUES[self._circuit])
+
+    def stats(self):
+        """Retorna limite atual, estado do circuito e contadores"""
+        with self._condition:
+            now = time.time()
+            return {
+                'concurrency_limit': self.limit,
+                'in_flight': self._in_flight,
+                'circuit': self._circuit,
+                'circuit_open_seconds_left': round(self._opened_until - now, 1)
+                if self._circuit == CIRCUIT_OPEN and self._opened_until > now else None,
+                'paused_seconds_left': round(self._paused_until - now, 1) if self._paused_until > now else None,
+                'calls': self.calls,
+                'rate_limited': self.rate_limited,
+                'forbidden': self.forbidden,
+                'rejected': self.rejected,
+                'circuit_opens': self.circuit_opens
+            }
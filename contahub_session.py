@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+"""
+Gerenciador de sessões autenticadas do ContaHub
+Mantém a sessão viva entre execuções e só refaz login quando necessário
+"""
+import time
+import uuid
+import logging
+import weakref
+import threading
+
+import requests
+
+from metrics import LOGIN_SECONDS, LOGIN_TOTAL, LOGIN_RETRIES
+
+logger = logging.getLogger(__name__)
+
+SHARED_SESSION_KEY = 'contahub_session'
+
+
+def export_session(session):
+    """Cookies e cabeçalhos da sessão em um dict serializável (para outros workers)"""
+    return {
+        'cookies': [
+            {'name': cookie.name, 'value': cookie.value, 'domain': cookie.domain, 'path': cookie.path}
+            for cookie in session.cookies
+        ],
+        'headers': dict(session.headers)
+    }
+
+
+def import_session(state):
+    """Recria uma requests.Session a partir de export_session()"""
+    session = requests.Session()
+    session.headers.clear()
+    session.headers.update(state.get('headers', {}))
+    for cookie in state.get('cookies', []):
+        session.cookies.set(cookie['name'], cookie['value'], domain=cookie['domain'], path=cookie['path'])
+    return session
+
+
+class ContaHubSessionManager:
+    """Mantém uma sessão autenticada por processo e reaproveita entre execuções
+
+    A validade é checada localmente (idade e tempo ocioso), sem chamadas de rede.
+    Um novo login só acontece quando a sessão expira ou quando uma query é
+    rejeitada e a sessão é invalidada com invalidate().
+
+    Com shared_state (SharedState), os cookies da sessão ficam visíveis aos
+    outros workers: o login acontece sob um lock entre processos e quem chega
+    depois reaproveita a sessão já gravada em vez de logar de novo.
+    """
+
+    def __init__(self, login_methods, max_age=3600, max_idle=900, shared_state=None):
+        self.login_methods = list(login_methods)
+        self.max_age = max_age
+        self.max_idle = max_idle
+        self.shared_state = shared_state
+
+        self._lock = threading.Lock()
+        self._session = None
+        self._created_at = 0.0
+        self._last_used = 0.0
+        self._had_session = False
+        self._shared_value = None
+        self._issued = weakref.WeakSet()
+
+        # Contadores
+        self.hits = 0
+        self.misses = 0
+        self.relogins = 0
+        self.login_failures = 0
+        self.invalidations = 0
+        self.shared_hits = 0
+
+    def _is_fresh(self, now):
+        """Checagem barata de validade, sem I/O"""
+        if self._session is None:
+            return False
+        if now - self._created_at > self.max_age:
+            return False
+        if now - self._last_used > self.max_idle:
+            return False
+        return True
+
+    def _login(self):
+        """Tenta cada método de login em ordem até um funcionar"""
+        for login_method in self.login_methods:
+            method_name = getattr(login_method, '__name__', 'login')
+            started = time.time()
+            session = login_method()
+            LOGIN_SECONDS.observe(time.time() - started, method=method_name)
+            LOGIN_TOTAL.inc(method=method_name, result='success' if session else 'failure')
+            if session:
+                return session
+            LOGIN_RETRIES.inc(reason='fallback')
+            logger.info(f"🔄 Login via {method_name} falhou, tentando próximo método...")
+        return None
+
+    def get_session(self):
+        """Retorna uma sessão autenticada, reaproveitando a atual se ainda válida"""
+        with self._lock:
+            now = time.time()
+            if self._is_fresh(now):
+                self.hits += 1
+                self._last_used = now
+                return self._session
+
+            if self.shared_state is None:
+                return self._renew()
+
+            # Um login por vez entre todos os workers; quem esperou reaproveita o resultado
+            with self.shared_state.lock('contahub_login'):
+                session = self._adopt_shared()
+                if session is not None:
+                    return session
+                return self._renew()
+
+    def _adopt_shared(self):
+        """Usa a sessão gravada por outro worker, se ainda dentro de max_age"""
+        try:
+            value = self.shared_state.get(SHARED_SESSION_KEY)
+        except Exception as e:
+            logger.warning(f"Erro ao ler sessão compartilhada: {str(e)}")
+            return None
+        if not value or time.time() - value['created_at'] > self.max_age:
+            return None
+        if self._shared_value and value['id'] == self._shared_value['id']:
+            # É a própria sessão que acabou de expirar ou ser invalidada aqui
+            return None
+
+        self._close_current()
+        session = import_session(value)
+        self.shared_hits += 1
+        self._session = session
+        self._issued.add(session)
+        self._created_at = value['created_at']
+        self._last_used = time.time()
+        self._had_session = True
+        self._shared_value = value
+        logger.info("🔐 Sessão ContaHub reaproveitada de outro worker")
+        return session
+
+    def _renew(self):
+        """Faz login (com o lock do gerenciador já adquirido) e publica a sessão, se compartilhada"""
+        if self._had_session:
+            self.relogins += 1
+            LOGIN_RETRIES.inc(reason='relogin')
+            logger.info("🔐 Sessão ContaHub expirada ou invalidada, refazendo login...")
+        else:
+            self.misses += 1
+            logger.info("🔐 Nenhuma sessão ContaHub em cache, fazendo login...")
+
+        self._close_current()
+        session = self._login()
+        if not session:
+            self.login_failures += 1
+            return None
+
+        now = time.time()
+        self._session = session
+        self._issued.add(session)
+        self._created_at = now
+        self._last_used = now
+        self._had_session = True
+        self._shared_value = None
+
+        if self.shared_state is not None and isinstance(session, requests.Session):
+            value = dict(export_session(session), created_at=now, id=uuid.uuid4().hex)
+            try:
+                self.shared_state.set(SHARED_SESSION_KEY, value, ttl=self.max_age)
+                self._shared_value = value
+            except Exception as e:
+                logger.warning(f"Erro ao publicar sessão compartilhada: {str(e)}")
+        return session
+
+    def invalidate(self, session=None):
+        """Descarta a sessão atual (ex.: query rejeitada) para forçar novo login"""
+        with self._lock:
+            if self._session is None:
+                return
+            if session is not None and session is not self._session:
+                return
+            self.invalidations += 1
+            logger.warning("⚠️ Sessão ContaHub invalidada")
+            self._close_current()
+            if self.shared_state is not None and self._shared_value is not None:
+                # Só remove se outro worker ainda não publicou uma sessão nova
+                try:
+                    self.shared_state.delete(SHARED_SESSION_KEY, only_if=self._shared_value)
+                except Exception as e:
+                    logger.warning(f"Erro ao remover sessão compartilhada: {str(e)}")
+
+    def was_invalidated(self, session):
+        """Indica se a sessão foi emitida por este gerenciador e já foi descartada
+
+        Sessões de outras origens (ex.: transportes com proxy) nunca contam como invalidadas.
+        """
+        with self._lock:
+            return session is not self._session and session in self._issued
+
+    def _close_current(self):
+        if self._session is not None:
+            try:
+                self._session.close()
+            except Exception:
+                pass
+        self._session = None
+
+    def stats(self):
+        """Retorna contadores de uso do gerenciador
+
+        Lê um retrato dos atributos sem o lock: um login em andamento (que pode
+        levar vários segundos com o lock adquirido) não atrasa o /ready.
+        """
+        session, created_at, last_used = self._session, self._created_at, self._last_used
+        now = time.time()
+        total = self.hits + self.misses + self.relogins
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'relogins': self.relogins,
+            'login_failures': self.login_failures,
+            'invalidations': self.invalidations,
+            'shared_hits': self.shared_hits,
+            'hit_rate': round(self.hits / total, 4) if total else 0.0,
+            'session_active': (session is not None and now - created_at <= self.max_age
+                               and now - last_used <= self.max_idle),
+            'session_age_seconds': round(now - created_at, 1) if session is not None else None
+        }
@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+"""
+Armazenamento local indexado dos registros de vendas (analitico e periodo)
+Os registros buscados no ContaHub são gravados em um SQLite local e servidos
+pelo endpoint /data sem tocar no ContaHub nem no Google Sheets
+"""
+import io
+import os
+import csv
+import json
+import sqlite3
+import logging
+import threading
+from contextlib import contextmanager
+
+from schemas import get_schema, FLOAT
+
+logger = logging.getLogger(__name__)
+
+# Módulos detalhados guardados localmente (os resumos agregados não entram)
+STORED_MODULES = ('analitico', 'periodo')
+
+# Colunas com índice próprio, quando existem no módulo; a data gerencial é a
+# primeira coluna da chave primária e usa o índice dela
+INDEXED_COLUMNS = ('vd', 'prd', 'grp_desc')
+
+# Filtros de igualdade aceitos em query()
+FILTER_COLUMNS = INDEXED_COLUMNS
+
+# Formatos de exportação: (mimetype, extensão)
+EXPORT_FORMATS = {
+    'csv': ('text/csv; charset=utf-8', 'csv'),
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+    'parquet': ('application/vnd.apache.parquet', 'parquet')
+}
+
+
+def parquet_available():
+    """pyarrow é opcional: só necessário para exportar em Parquet"""
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def iter_csv(columns, batches):
+    """Cabeçalho e linhas em CSV, um bloco de texto por lote"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for batch in batches:
+        writer.writerows(batch)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def iter_ndjson(columns, batches):
+    """Um objeto JSON por linha, um bloco de texto por lote"""
+    for batch in batches:
+        yield ''.join(json.dumps(dict(zip(columns, row)), ensure_ascii=False) + '\n' for row in batch)
+
+
+class _ChunkSink(io.RawIOBase):
+    """Arquivo só de escrita cujo conteúdo é drenado em blocos (saída do ParquetWriter)"""
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        data = bytes(data)
+        self._chunks.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def iter_parquet(module_name, columns, batches):
+    """Arquivo Parquet com um row group por lote, enviado conforme é escrito"""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    types = {column.name: column.type for column in get_schema(module_name).columns}
+    schema = pa.schema([(name, pa.float64() if types[name] == FLOAT else pa.string()) for name in columns])
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(sink, schema)
+    try:
+        for batch in batches:
+            arrays = [
+                pa.array([row[i] for row in batch], type=field.type, from_pandas=False)
+                for i, field in enumerate(schema)
+            ]
+            writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+            data = sink.drain()
+            if data:
+                yield data
+    finally:
+        writer.close()
+    yield sink.drain()
+
+
+class DataStore:
+    """Registros por módulo em tabelas SQLite com chave primária = ordenação do módulo
+
+    A gravação é idempotente (INSERT OR REPLACE pela chave), então páginas e
+    lotes repetidos após falhas não duplicam linhas. replace_period() apaga o
+    período antes de gravar, removendo também registros excluídos na origem.
+    """
+
+    def __init__(self, path, modules=STORED_MODULES):
+        self.path = path
+        self.modules = tuple(modules)
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        with self._connect() as conn:
+            # WAL: leituras do /data não bloqueiam a gravação de uma execução em andamento
+            conn.execute("PRAGMA journal_mode=WAL")
+            for module_name in self.modules:
+                schema = get_schema(module_name)
+                columns = ', '.join(
+                    f"{column.name} {'REAL' if column.type == FLOAT else 'TEXT'}" for column in schema.columns
+                )
+                conn.execute(f"""
+                    CREATE TABLE IF NOT EXISTS {module_name} (
+                        {columns},
+                        PRIMARY KEY ({', '.join(schema.order_by)})
+                    )
+                """)
+                for column in INDEXED_COLUMNS:
+                    if column in self.columns(module_name):
+                        conn.execute(
+                            f"CREATE INDEX IF NOT EXISTS idx_{module_name}_{column} "
+                            f"ON {module_name} ({column}, {schema.date_column})"
+                        )
+
+        # Contadores
+        self.rows_stored = 0
+        self.queries = 0
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def supports(self, module_name):
+        return module_name in self.modules
+
+    @staticmethod
+    def columns(module_name):
+        return [column.name for column in get_schema(module_name).columns]
+
+    def _rows(self, module_name, records):
+        schema = get_schema(module_name)
+        names = self.columns(module_name)
+        # Data gerencial normalizada para 'YYYY-MM-DD' (a origem pode mandar com hora)
+        index = names.index(schema.date_column)
+        for record in records:
+            row = [record.get(name) for name in names]
+            if row[index] is not None:
+                row[index] = str(row[index])[:10]
+            yield row
+
+    def _insert(self, conn, module_name, records):
+        names = self.columns(module_name)
+        cursor = conn.executemany(
+            f"INSERT OR REPLACE INTO {module_name} ({', '.join(names)}) VALUES ({', '.join('?' * len(names))})",
+            self._rows(module_name, records)
+        )
+        return cursor.rowcount
+
+    def upsert(self, module_name, records):
+        """Grava/atualiza os registros pela chave; retorna quantos foram gravados"""
+        with self._lock, self._connect() as conn:
+            count = self._insert(conn, module_name, records)
+        self.rows_stored += count
+        return count
+
+    def replace_period(self, module_name, start_date, end_date, records):
+        """Substitui todo o período pelos registros informados, numa única transação"""
+        date_column = get_schema(module_name).date_column
+        with self._lock, self._connect() as conn:
+            conn.execute(
+                f"DELETE FROM {module_name} WHERE {date_column} BETWEEN ? AND ?", (start_date, end_date)
+            )
+            count = self._insert(conn, module_name, records)
+        self.rows_stored += count
+        logger.info(f"💾 {module_name}: {count} registros gravados localmente ({start_date} até {end_date})")
+        return count
+
+    def query(self, module_name, start_date=None, end_date=None, columns=None, filters=None, limit=None,
+              batch_size=5000):
+        """Gera listas de até batch_size tuplas, na ordem da chave primária
+
+        columns: projeção (padrão: todas as colunas do módulo); filters: igualdade
+        em FILTER_COLUMNS. Mantém uma conexão própria até o gerador terminar.
+        """
+        schema = get_schema(module_name)
+        columns = columns or self.columns(module_name)
+        where, params = [], []
+        if start_date:
+            where.append(f"{schema.date_column} >= ?")
+            params.append(start_date)
+        if end_date:
+            where.append(f"{schema.date_column} <= ?")
+            params.append(end_date)
+        for column, value in (filters or {}).items():
+            where.append(f"{column} = ?")
+            params.append(value)
+
+        sql = f"SELECT {', '.join(columns)} FROM {module_name}"
+        if where:
+            sql += f" WHERE {' AND '.join(where)}"
+        sql += f" ORDER BY {', '.join(schema.order_by)}"
+        if limit is not None:
+            sql += f" LIMIT {int(limit)}"
+
+        self.queries += 1
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            cursor = conn.execute(sql, params)
+            while True:
+                batch = cursor.fetchmany(batch_size)
+                if not batch:
+                    return
+                yield batch
+        finally:
+            conn.close()
+
+    def stats(self):
+        """Linhas e intervalo de datas guardados por módulo"""
+        modules = {}
+        with self._connect() as conn:
+            for module_name in self.modules:
+                date_column = get_schema(module_name).date_column
+                count, first, last = conn.execute(
+                    f"SELECT COUNT(*), MIN({date_column}), MAX({date_column}) FROM {module_name}"
+                ).fetchone()
+                modules[module_name] = {'rows': count, 'first_date': first, 'last_date': last}
+        return {
+            'modules': modules,
+            'rows_stored': self.rows_stored,
+            'queries': self.queries
+        }
@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+"""
+Configuração do gunicorn (carregada automaticamente do diretório atual)
+Após o fork de cada worker, importa gspread/google-auth em background para que
+a primeira escrita no Sheets não pague esse custo, sem atrasar o /health, e
+reagenda os backfills interrompidos (BACKFILL_AUTO_RESUME) da aplicação
+configurada (ex.: cloud_api:app)
+"""
+import os
+import importlib
+import threading
+
+# Importar as bibliotecas do Google logo após o fork (desligue com PRELOAD_GOOGLE_LIBS=false)
+PRELOAD_GOOGLE_LIBS = os.getenv('PRELOAD_GOOGLE_LIBS', 'true').lower() in ('1', 'true', 'yes')
+# Também autorizar o cliente Sheets (faz I/O de rede para obter o token)
+PRELOAD_SHEETS_CLIENT = os.getenv('PRELOAD_SHEETS_CLIENT', 'false').lower() in ('1', 'true', 'yes')
+
+
+def _app_module(server):
+    """Módulo da aplicação que o gunicorn serve (a parte antes de ':' em módulo:app)"""
+    app_uri = getattr(server.app, 'app_uri', None) or server.cfg.wsgi_app
+    return importlib.import_module(app_uri.split(':')[0]) if app_uri else None
+
+
+def _preload(server, log):
+    try:
+        from sheets_client import load_google_libraries
+        load_google_libraries()
+        if PRELOAD_SHEETS_CLIENT:
+            sheets_clients = getattr(_app_module(server), 'sheets_clients', None)
+            if sheets_clients is not None:
+                sheets_clients.get_client()
+        log.info("Bibliotecas do Google pré-carregadas no worker")
+    except Exception as e:
+        log.warning(f"Falha no pré-carregamento das bibliotecas do Google: {str(e)}")
+
+
+def _resume_backfills(server, log):
+    try:
+        resume_unfinished_backfills = getattr(_app_module(server), 'resume_unfinished_backfills', None)
+        if resume_unfinished_backfills is not None:
+            resume_unfinished_backfills(workers=server.num_workers)
+    except Exception as e:
+        log.warning(f"Falha ao retomar backfills interrompidos: {str(e)}")
+
+
+def post_fork(server, worker):
+    if PRELOAD_GOOGLE_LIBS:
+        threading.Thread(target=_preload, args=(server, worker.log), name='preload', daemon=True).start()
+    threading.Thread(target=_resume_backfills, args=(server, worker.log), name='resume-backfills',
+                     daemon=True).start()
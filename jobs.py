@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+"""
+Execução assíncrona de jobs em background
+Mantém estado, etapa e progresso de cada job para consulta via /jobs/<id>
+"""
+import os
+import time
+import uuid
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_SUCCEEDED = 'succeeded'
+JOB_FAILED = 'failed'
+
+
+class JobQueueFull(Exception):
+    """Fila de jobs cheia - o chamador deve tentar mais tarde"""
+
+
+class Job:
+    """Estado de um job em background"""
+
+    def __init__(self, name, params=None, listener=None):
+        self.id = uuid.uuid4().hex
+        self.name = name
+        self.params = params or {}
+        self.status = JOB_QUEUED
+        self.stage = 'queued'
+        self.progress = {
+            'records_fetched': 0,
+            'records_processed': 0,
+            'records_written': 0
+        }
+        self.result = None
+        self.error = None
+        self.created_at = datetime.now()
+        self.started_at = None
+        self.finished_at = None
+        self._lock = threading.Lock()
+        self._listener = listener
+        self._published_at = 0.0
+
+    def report(self, stage=None, **counters):
+        """Callback de progresso usado pelo pipeline"""
+        with self._lock:
+            stage_changed = bool(stage) and stage != self.stage
+            if stage:
+                self.stage = stage
+            for key, value in counters.items():
+                self.progress[key] = value
+        if self._listener:
+            self._listener(self, stage_changed)
+
+    @property
+    def finished(self):
+        return self.status in (JOB_SUCCEEDED, JOB_FAILED)
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                'job_id': self.id,
+                'name': self.name,
+                'params': self.params,
+                'status': self.status,
+                'stage': self.stage,
+                'progress': dict(self.progress),
+                'result': self.result,
+                'error': self.error,
+                'created_at': self.created_at.isoformat(),
+                'started_at': self.started_at.isoformat() if self.started_at else None,
+                'finished_at': self.finished_at.isoformat() if self.finished_at else None
+            }
+
+
+class JobManager:
+    """Executor limitado de jobs com histórico em memória
+
+    Com shared_state (SharedState), o estado de cada job também é publicado
+    (a cada mudança de etapa e no máximo uma vez por publish_interval
+    segundos de progresso), para que /jobs/<id> responda em qualquer worker.
+    """
+
+    def __init__(self, max_workers=2, max_pending=10, max_history=200, shared_state=None,
+                 shared_ttl=24 * 3600, publish_interval=1.0):
+        self.max_pending = max_pending
+        self.max_history = max_history
+        self.shared_state = shared_state
+        self.shared_ttl = shared_ttl
+        self.publish_interval = publish_interval
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='job')
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def submit(self, name, fn, params=None, **kwargs):
+        """Agenda fn(progress=job.report, **kwargs) e retorna o Job criado
+
+        fn deve retornar um dict no formato {'success': bool, 'data'|'error': ...}.
+        """
+        with self._lock:
+            pending = sum(1 for job in self._jobs.values() if not job.finished)
+            if pending >= self.max_pending:
+                raise JobQueueFull(f"{pending} jobs pendentes (limite {self.max_pending})")
+
+            job = Job(name, params, listener=self._publish if self.shared_state is not None else None)
+            self._jobs[job.id] = job
+            self._evict()
+
+        if self.shared_state is not None:
+            self._publish(job, force=True)
+        self._executor.submit(self._run, job, fn, kwargs)
+        logger.info(f"📥 Job {job.id} ({name}) agendado")
+        return job
+
+    def _run(self, job, fn, kwargs):
+        job.status = JOB_RUNNING
+        job.started_at = datetime.now()
+        job.report('starting')
+        try:
+            result = fn(progress=job.report, **kwargs)
+            if result.get('success'):
+                job.result = result.get('data', {})
+                job.status = JOB_SUCCEEDED
+                job.report('done')
+            else:
+                job.error = result.get('error', 'Erro desconhecido na execução')
+                job.status = JOB_FAILED
+                job.report('failed')
+        except Exception as e:
+            logger.error(f"❌ Erro inesperado no job {job.id}: {str(e)}", exc_info=True)
+            job.error = f"Erro inesperado: {str(e)}"
+            job.status = JOB_FAILED
+            job.report('failed')
+        finally:
+            job.finished_at = datetime.now()
+            if self.shared_state is not None:
+                self._publish(job, force=True)
+            logger.info(f"📤 Job {job.id} finalizado com status {job.status}")
+
+    def _publish(self, job, force=False):
+        """Grava o estado do job no estado compartilhado (limitado a publish_interval, salvo force)"""
+        now = time.time()
+        if not force and now - job._published_at < self.publish_interval:
+            return
+        job._published_at = now
+        try:
+            self.shared_state.set(f"job:{job.id}", dict(job.to_dict(), worker_pid=os.getpid()), ttl=self.shared_ttl)
+        except Exception as e:
+            logger.warning(f"Erro ao publicar estado do job {job.id}: {str(e)}")
+
+    def _evict(self):
+        """Remove jobs finalizados mais antigos quando o histórico passa do limite"""
+        while len(self._jobs) > self.max_history:
+            for job_id, job in self._jobs.items():
+                if job.finished:
+                    del self._jobs[job_id]
+                    break
+            else:
+                return
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def get_status(self, job_id):
+        """Estado do job como dict: local se rodou neste worker, senão o publicado por outro (ou None)"""
+        job = self.get(job_id)
+        if job is not None:
+            return job.to_dict()
+        if self.shared_state is not None:
+            return self.shared_state.get(f"job:{job_id}")
+        return None
+
+    def stats(self):
+        with self._lock:
+            counts = {}
+            for job in self._jobs.values():
+                counts[job.status] = counts.get(job.status, 0) + 1
+            return counts
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+Decodificação incremental de respostas JSON do ContaHub
+Extrai os itens do array "data" conforme os bytes chegam, sem carregar o corpo inteiro
+"""
+import json
+import codecs
+
+WHITESPACE = ' \t\n\r'
+COMPACT_THRESHOLD = 1 << 16
+# Caracteres em que um número parado no fim do bloco ainda pode continuar (ex.: '1500.' + '25')
+NUMBER_CONTINUATION = '.eE+-'
+
+
+class JSONArrayStream:
+    """Itera sobre os itens de um array dentro de um objeto JSON de nível superior
+
+    chunks: iterável de bytes (ex.: response.iter_content())
+    array_key: chave do objeto cujo valor é o array a ser percorrido
+
+    Os demais campos do objeto (ex.: 'success', 'message') ficam em self.meta
+    conforme são lidos. self.count guarda a quantidade de itens já entregues.
+    """
+
+    def __init__(self, chunks, array_key='data', encoding='utf-8'):
+        self.array_key = array_key
+        self.meta = {}
+        self.count = 0
+        self.found_array = False
+        self._chunks = iter(chunks)
+        self._decoder = codecs.getincrementaldecoder(encoding)()
+        self._json = json.JSONDecoder()
+        self._buf = ''
+        self._pos = 0
+        self._eof = False
+
+    # Leitura do buffer
+
+    def _read_more(self):
+        if self._eof:
+            return False
+        for chunk in self._chunks:
+            if not chunk:
+                continue
+            text = self._decoder.decode(chunk)
+            if text:
+                if self._pos > COMPACT_THRESHOLD:
+                    self._buf = self._buf[self._pos:]
+                    self._pos = 0
+                self._buf += text
+                return True
+        self._buf += self._decoder.decode(b'', final=True)
+        self._eof = True
+        return False
+
+    def _peek(self):
+        """Retorna o próximo caractere não-branco (sem consumir) ou '' no fim"""
+        while True:
+            buf = self._buf
+            pos = self._pos
+            length = len(buf)
+            while pos < length and buf[pos] in WHITESPACE:
+                pos += 1
+            self._pos = pos
+            if pos < length:
+                return buf[pos]
+            if not self._read_more():
+                return ''
+
+    def _expect(self, char):
+        if self._peek() != char:
+            found = self._peek() or 'EOF'
+            raise ValueError(f"JSON inválido: esperado '{char}', encontrado '{found}' na posição {self._pos}")
+        self._pos += 1
+
+    def _decode_value(self):
+        """Decodifica o próximo valor JSON completo, lendo mais dados se necessário"""
+        self._peek()
+        while True:
+            try:
+                value, end = self._json.raw_decode(self._buf, self._pos)
+            except json.JSONDecodeError:
+                if not self._read_more():
+                    raise
+                continue
+            # Um número no fim do buffer, ou parado em '.'/'e', pode estar truncado: garantir um delimitador
+            if not self._eof and isinstance(value, (int, float)) and not isinstance(value, bool):
+                if end >= len(self._buf) or self._buf[end] in NUMBER_CONTINUATION:
+                    if self._read_more():
+                        continue
+            self._pos = end
+            return value
+
+    # Iteração
+
+    def __iter__(self):
+        self._expect('{')
+        while True:
+            char = self._peek()
+            if char == '}':
+                self._pos += 1
+                return
+            if char == ',':
+                self._pos += 1
+                continue
+            key = self._decode_value()
+            self._expect(':')
+            if key == self.array_key and self._peek() == '[':
+                self.found_array = True
+                self._pos += 1
+                yield from self._iter_array()
+            else:
+                self.meta[key] = self._decode_value()
+
+    def _iter_array(self):
+        while True:
+            char = self._peek()
+            if char == ']':
+                self._pos += 1
+                return
+            if char == ',':
+                self._pos += 1
+                continue
+            if char == '':
+                raise ValueError("JSON inválido: array não terminado")
+            item = self._decode_value()
+            self.count += 1
+            yield item
+
+
+def iter_batches(iterable, batch_size):
+    """Agrupa um iterável em listas de até batch_size itens"""
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
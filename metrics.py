@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+"""
+Métricas no formato de exposição do Prometheus
+Contadores, gauges e histogramas com labels, baratos o bastante para ficar
+sempre ligados, servidos em texto pelo endpoint /metrics
+"""
+import bisect
+import threading
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(label_names, label_values, extra=None):
+    pairs = list(zip(label_names, label_values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    type_name = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"Métrica {self.name} espera labels {self.labelnames}, recebeu {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        lines.extend(self._samples())
+        return lines
+
+
+class Counter(_Metric):
+    """Contador monotônico"""
+    type_name = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in items]
+
+
+class Gauge(_Metric):
+    """Valor que sobe e desce; pode ser calculado na coleta com set_function()"""
+    type_name = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values = {}
+        self._function = None
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set_function(self, function):
+        """function() -> número (sem labels) ou dict {tupla_de_labels: número}"""
+        self._function = function
+
+    def _samples(self):
+        with self._lock:
+            values = dict(self._values)
+        if self._function is not None:
+            try:
+                computed = self._function()
+            except Exception:
+                computed = None
+            if isinstance(computed, dict):
+                values.update({tuple(str(v) for v in key): value for key, value in computed.items()})
+            elif computed is not None:
+                values[()] = computed
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+                for key, value in sorted(values.items())]
+
+
+class Histogram(_Metric):
+    """Histograma com buckets cumulativos, soma e contagem"""
+    type_name = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def _samples(self):
+        with self._lock:
+            items = sorted((key, (list(counts), total, count)) for key, (counts, total, count) in self._series.items())
+        lines = []
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labelnames, key, ('le', _format_value(float(bound))))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class Registry:
+    """Conjunto de métricas expostas em /metrics"""
+
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+def status_class(status_code):
+    """Agrupa o status HTTP em classes ('2xx', '4xx', ...) para manter a cardinalidade baixa"""
+    if not status_code:
+        return 'error'
+    return f"{int(status_code) // 100}xx"
+
+
+REGISTRY = Registry()
+
+# Etapas do pipeline
+LOGIN_SECONDS = REGISTRY.register(Histogram(
+    'contahub_login_seconds', 'Duração dos logins no ContaHub', ['method']))
+LOGIN_TOTAL = REGISTRY.register(Counter(
+    'contahub_logins_total', 'Logins no ContaHub por método e resultado', ['method', 'result']))
+FETCH_PARTITION_SECONDS = REGISTRY.register(Histogram(
+    'contahub_fetch_partition_seconds', 'Duração de cada query (partição) no ContaHub', ['module']))
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    'pipeline_stage_seconds', 'Duração das etapas do pipeline por módulo', ['module', 'stage']))
+SHEETS_WRITE_SECONDS = REGISTRY.register(Histogram(
+    'sheets_write_chunk_seconds', 'Duração de cada bloco enviado ao Google Sheets (com novas tentativas)'))
+
+# Volume transferido
+RECORDS_FETCHED = REGISTRY.register(Counter(
+    'contahub_records_fetched_total', 'Registros recebidos do ContaHub', ['module']))
+BYTES_FETCHED = REGISTRY.register(Counter(
+    'contahub_response_bytes_total', 'Bytes de resposta recebidos do ContaHub', ['module']))
+ROWS_WRITTEN = REGISTRY.register(Counter(
+    'sheets_rows_written_total', 'Linhas gravadas no Google Sheets', ['worksheet']))
+BYTES_WRITTEN = REGISTRY.register(Counter(
+    'sheets_payload_bytes_total', 'Bytes estimados enviados ao Google Sheets'))
+
+# Respostas HTTP e novas tentativas
+CONTAHUB_RESPONSES = REGISTRY.register(Counter(
+    'contahub_http_responses_total', 'Respostas do ContaHub por endpoint e classe de status',
+    ['endpoint', 'status_class']))
+GOOGLE_RESPONSES = REGISTRY.register(Counter(
+    'google_http_responses_total', 'Respostas do Google Sheets por classe de status', ['status_class']))
+LOGIN_RETRIES = REGISTRY.register(Counter(
+    'contahub_login_retries_total',
+    'Novos logins: sessão expirada/invalidada (relogin) ou troca para o próximo método (fallback)', ['reason']))
+SHEETS_RETRIES = REGISTRY.register(Counter(
+    'sheets_write_retries_total', 'Novas tentativas de escrita no Google Sheets'))
+
+# Controle de concorrência do ContaHub
+CONTAHUB_CONCURRENCY_LIMIT = REGISTRY.register(Gauge(
+    'contahub_concurrency_limit', 'Limite atual (AIMD) de requisições simultâneas ao ContaHub'))
+CONTAHUB_CIRCUIT_STATE = REGISTRY.register(Gauge(
+    'contahub_circuit_state', 'Estado do circuito do ContaHub (0 fechado, 1 em teste, 2 aberto)'))
+CONTAHUB_THROTTLED = REGISTRY.register(Counter(
+    'contahub_calls_rejected_total',
+    'Chamadas ao ContaHub recusadas localmente por endpoint e motivo (circuit_open, rate_limited, saturated)',
+    ['endpoint', 'reason']))
+
+# Execuções em andamento
+RUNS_IN_FLIGHT = REGISTRY.register(Gauge(
+    'pipeline_runs_in_flight', 'Execuções do pipeline em andamento'))
+JOBS_IN_FLIGHT = REGISTRY.register(Gauge(
+    'jobs_in_flight', 'Jobs assíncronos por status', ['status']))
@@ -0,0 +1,504 @@
+#!/usr/bin/env python3
+"""
+Pipeline ContaHub -> Google Sheets compartilhado pelas APIs (direta e com proxy)
+Busca particionada no ContaHub, conversão pelos esquemas e gravação em blocos
+(append ou upsert). Importar este módulo não abre arquivos nem inicia threads:
+os objetos com estado (sessões, cliente Sheets, índice de chaves, marcas
+d'água) são criados por cada aplicação e informados em configure()
+"""
+import os
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, date, timedelta
+
+from contahub_limiter import ContaHubLimiter, ContaHubUnavailable
+from json_stream import iter_batches
+from schemas import get_schema, get_transformer, select_list
+from sheets_writer import BulkSheetWriter
+from sheet_index import SHEET_KEY_COLUMNS, make_key
+from record_cache import is_closed
+from run_log import submit_with_context
+from metrics import FETCH_PARTITION_SECONDS, RECORDS_FETCHED, BYTES_FETCHED, ROWS_WRITTEN, CONTAHUB_RESPONSES, status_class
+
+logger = logging.getLogger(__name__)
+
+# ContaHub
+API_URL = "https://apiv2.contahub.com"
+QUERY_ENDPOINT = "/query"
+
+# Concorrência adaptativa (AIMD) e circuit breaker das chamadas ao ContaHub (login e /query)
+CONTAHUB_CONCURRENCY_INITIAL = int(os.getenv('CONTAHUB_CONCURRENCY_INITIAL', 4))
+CONTAHUB_CONCURRENCY_MIN = int(os.getenv('CONTAHUB_CONCURRENCY_MIN', 1))
+CONTAHUB_CONCURRENCY_MAX = int(os.getenv('CONTAHUB_CONCURRENCY_MAX', 16))
+CONTAHUB_LATENCY_TARGET = float(os.getenv('CONTAHUB_LATENCY_TARGET', 15))
+CONTAHUB_CIRCUIT_FAILURES = int(os.getenv('CONTAHUB_CIRCUIT_FAILURES', 3))
+CONTAHUB_CIRCUIT_OPEN_SECONDS = int(os.getenv('CONTAHUB_CIRCUIT_OPEN_SECONDS', 300))
+CONTAHUB_MAX_WAIT = int(os.getenv('CONTAHUB_MAX_WAIT', 300))
+# 403 de /query até N segundos após um login aceito contam como bloqueio (depois disso, sessão expirada)
+CONTAHUB_FRESH_LOGIN_WINDOW = int(os.getenv('CONTAHUB_FRESH_LOGIN_WINDOW', 60))
+
+# Busca particionada (0 dias = uma única query para o período inteiro)
+FETCH_PARTITION_DAYS = int(os.getenv('FETCH_PARTITION_DAYS', 1))
+FETCH_MAX_WORKERS = int(os.getenv('FETCH_MAX_WORKERS', 4))
+FETCH_PARTITION_RETRIES = int(os.getenv('FETCH_PARTITION_RETRIES', 2))
+
+# Conversão em lotes pelo conversor compilado do esquema
+TRANSFORM_BATCH_SIZE = int(os.getenv('TRANSFORM_BATCH_SIZE', 10000))
+
+# Google Sheets
+SHEET_NAME = os.getenv('SHEET_NAME', 'Base_de_dados_CA_ordinario')
+SHEETS_WRITE_REQUESTS_PER_MINUTE = int(os.getenv('SHEETS_WRITE_REQUESTS_PER_MINUTE', 60))
+SHEETS_CHUNK_ROWS = int(os.getenv('SHEETS_CHUNK_ROWS', 5000))
+SHEETS_CHUNK_BYTES = int(os.getenv('SHEETS_CHUNK_BYTES', 2 * 1024 * 1024))
+SHEETS_MAX_RETRIES = int(os.getenv('SHEETS_MAX_RETRIES', 5))
+# Espera máxima pelo lock de upsert de uma aba (depois disso segue sem ele, com aviso)
+SHEETS_UPSERT_LOCK_TIMEOUT = int(os.getenv('SHEETS_UPSERT_LOCK_TIMEOUT', 900))
+
+# Datas fixas
+DEFAULT_FIXED_START_DATE = '2025-05-22'
+DEFAULT_FIXED_END_DATE = '2025-05-27'
+
+# Sincronização incremental
+INCREMENTAL_LOOKBACK_DAYS = int(os.getenv('INCREMENTAL_LOOKBACK_DAYS', 2))
+INCREMENTAL_INITIAL_START_DATE = os.getenv('INCREMENTAL_INITIAL_START_DATE', DEFAULT_FIXED_START_DATE)
+# Dias mais recentes que isso ainda mudam (não entram em cache nem nas abas de resumo)
+RECORD_CACHE_OPEN_DAYS = int(os.getenv('RECORD_CACHE_OPEN_DAYS', 2))
+
+# Todas as requisições ao ContaHub passam por aqui (limite AIMD, Retry-After e circuito)
+contahub_limiter = ContaHubLimiter(
+    initial=CONTAHUB_CONCURRENCY_INITIAL,
+    min_limit=CONTAHUB_CONCURRENCY_MIN,
+    max_limit=CONTAHUB_CONCURRENCY_MAX,
+    latency_target=CONTAHUB_LATENCY_TARGET,
+    failure_threshold=CONTAHUB_CIRCUIT_FAILURES,
+    open_seconds=CONTAHUB_CIRCUIT_OPEN_SECONDS,
+    max_wait=CONTAHUB_MAX_WAIT,
+    fresh_login_window=CONTAHUB_FRESH_LOGIN_WINDOW
+)
+
+# Objetos com estado, informados por cada aplicação em configure()
+COLLABORATORS = ('contahub_sessions', 'sheets_clients', 'sheet_index', 'shared_state', 'watermarks')
+contahub_sessions = None
+sheets_clients = None
+sheet_index = None
+shared_state = None
+watermarks = None
+
+
+def configure(**collaborators):
+    """Informa os objetos com estado usados pelo pipeline
+
+    contahub_sessions: ContaHubSessionManager cujas sessões rejeitadas são
+    descartadas (opcional: transportes próprios renovam a sessão sozinhos)
+    sheets_clients: SheetsClientCache (obrigatório para gravar)
+    sheet_index: SheetKeyIndex (obrigatório para upsert)
+    shared_state: SharedState do lock de upsert entre workers (opcional)
+    watermarks: WatermarkStore (obrigatório no modo incremental)
+    """
+    for name, value in collaborators.items():
+        if name not in COLLABORATORS:
+            raise TypeError(f"Objeto desconhecido para o pipeline: {name}")
+        globals()[name] = value
+
+
+def invalidate_session(session):
+    """Descarta a sessão rejeitada, se ela veio do gerenciador configurado"""
+    if contahub_sessions is not None:
+        contahub_sessions.invalidate(session)
+
+
+def was_invalidated(session):
+    return contahub_sessions is not None and contahub_sessions.was_invalidated(session)
+
+
+def is_session_rejected(response):
+    """Indica se o ContaHub rejeitou a query por sessão inválida/expirada (pelo status HTTP)"""
+    return response.status_code in (401, 403, 440)
+
+
+def is_session_rejected_payload(data):
+    """Indica se o corpo da resposta é uma rejeição por sessão inválida/expirada"""
+    if isinstance(data, dict) and data.get('success') is False:
+        message = str(data.get('message', '')).lower()
+        return any(word in message for word in ('login', 'sess', 'autentic', 'auth'))
+    return False
+
+
+def sql_literal(value):
+    """Valor de cursor como literal SQL (números sem aspas, textos com aspas escapadas)"""
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return str(value)
+    text = '' if value is None else str(value)
+    return "'" + text.replace("'", "''") + "'"
+
+
+def keyset_condition(columns, cursor):
+    """Condição (c1, c2, ...) > (v1, v2, ...) expandida em OR/AND, sem depender de comparação de tuplas"""
+    clauses = []
+    for i, column in enumerate(columns):
+        terms = [f"v.{previous} = {sql_literal(value)}" for previous, value in zip(columns[:i], cursor[:i])]
+        terms.append(f"v.{column} > {sql_literal(cursor[i])}")
+        clauses.append(f"({' AND '.join(terms)})")
+    return f"({' OR '.join(clauses)})"
+
+
+def build_contahub_query(module_name, start_date, end_date, after=None, limit=None):
+    """Monta a query SQL de um módulo para o período a partir do esquema (None se o módulo não existir)
+
+    after/limit: página keyset - registros depois do cursor after (valores das
+    colunas de ordenação) limitados a limit linhas
+    """
+    schema = get_schema(module_name)
+    if not schema:
+        return None
+
+    order_by = ', '.join(f"v.{column}" for column in schema.order_by)
+    where = f"WHERE v.{schema.date_column} BETWEEN '{start_date}' AND '{end_date}'"
+    if after is not None:
+        where += f"\n        AND {keyset_condition(schema.order_by, after)}"
+    if schema.group_by:
+        # Módulo de resumo: o ContaHub agrega e devolve uma linha por grupo
+        where += f"\n        GROUP BY {', '.join(f'v.{column}' for column in schema.group_by)}"
+    limit_clause = f"\n        LIMIT {int(limit)}" if limit else ''
+    return f"""
+        SELECT {select_list(module_name)}
+        FROM {schema.table} v 
+        {where}
+        ORDER BY {order_by}{limit_clause}
+    """
+
+
+def fetch_data_contahub(session, module_name, start_date, end_date, after=None, limit=None):
+    """Busca dados de um módulo específico no ContaHub (uma página keyset se limit for informado)"""
+    try:
+        query_base_url = f"{API_URL}{QUERY_ENDPOINT}"
+
+        query = build_contahub_query(module_name, start_date, end_date, after, limit)
+        if not query:
+            logger.error(f"Módulo {module_name} não suportado")
+            return None
+
+        started = time.time()
+        response = contahub_limiter.call('query', session.post, query_base_url, json={"query": query}, timeout=60)
+        CONTAHUB_RESPONSES.inc(endpoint='query', status_class=status_class(response.status_code))
+
+        if is_session_rejected(response):
+            logger.warning(f"Módulo {module_name}: query rejeitada (status {response.status_code}), sessão será renovada")
+            invalidate_session(session)
+            return None
+
+        if response.status_code == 200:
+            BYTES_FETCHED.inc(len(response.content), module=module_name)
+            data = response.json()
+            FETCH_PARTITION_SECONDS.observe(time.time() - started, module=module_name)
+            if is_session_rejected_payload(data):
+                logger.warning(f"Módulo {module_name}: query rejeitada ({data.get('message')}), sessão será renovada")
+                invalidate_session(session)
+                return None
+            if data.get('success') and data.get('data'):
+                records = data['data']
+                RECORDS_FETCHED.inc(len(records), module=module_name)
+                logger.info(f"Módulo {module_name}: {len(records)} registros obtidos")
+                return records
+            else:
+                logger.warning(f"Módulo {module_name}: Nenhum dado encontrado")
+                return []
+        else:
+            logger.error(f"Erro HTTP ao buscar {module_name}: {response.status_code}")
+            return None
+
+    except ContaHubUnavailable as e:
+        logger.warning(f"Módulo {module_name}: {str(e)}")
+        return None
+    except Exception as e:
+        logger.error(f"Erro ao buscar dados do módulo {module_name}: {str(e)}")
+        return None
+
+
+def split_period(start_date, end_date, partition_days):
+    """Divide o período em partições consecutivas de partition_days dias (datas 'YYYY-MM-DD')"""
+    start = datetime.strptime(start_date, '%Y-%m-%d').date()
+    end = datetime.strptime(end_date, '%Y-%m-%d').date()
+
+    if partition_days <= 0 or start > end:
+        return [(start_date, end_date)]
+
+    partitions = []
+    current = start
+    while current <= end:
+        partition_end = min(current + timedelta(days=partition_days - 1), end)
+        partitions.append((current.isoformat(), partition_end.isoformat()))
+        current = partition_end + timedelta(days=1)
+    return partitions
+
+
+def fetch_partition_with_retry(session, module_name, start_date, end_date, retries, after=None, limit=None):
+    """Busca uma partição (ou página) repetindo em caso de falha, sem derrubar as demais"""
+    for attempt in range(retries + 1):
+        records = fetch_data_contahub(session, module_name, start_date, end_date, after, limit)
+        if records is not None:
+            return records
+        if was_invalidated(session):
+            # Sessão rejeitada: não adianta repetir com a mesma sessão
+            return None
+        if contahub_limiter.is_open():
+            # Circuito aberto: novas tentativas só falhariam na hora
+            return None
+        if attempt < retries:
+            wait = 2 ** attempt
+            logger.warning(f"Partição {module_name} {start_date}..{end_date} falhou, nova tentativa em {wait}s")
+            time.sleep(wait)
+    return None
+
+
+def fetch_data_contahub_partitioned(session, module_name, start_date, end_date,
+                                    partition_days=None, max_workers=None, retries=None):
+    """Busca o período em partições de dias/semanas executadas em paralelo
+
+    As partições compartilham a sessão autenticada e são concatenadas na ordem
+    do período, preservando a ordenação (vd_dtgerencial, vd, itm) de cada query.
+    Retorna None se alguma partição falhar após as novas tentativas.
+    """
+    partition_days = FETCH_PARTITION_DAYS if partition_days is None else partition_days
+    max_workers = FETCH_MAX_WORKERS if max_workers is None else max_workers
+    retries = FETCH_PARTITION_RETRIES if retries is None else retries
+
+    partitions = split_period(start_date, end_date, partition_days)
+    if len(partitions) == 1:
+        return fetch_partition_with_retry(session, module_name, start_date, end_date, retries)
+
+    logger.info(f"Módulo {module_name}: {len(partitions)} partições de {partition_days} dia(s), {max_workers} em paralelo")
+
+    with ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix='fetch') as executor:
+        futures = [
+            submit_with_context(executor, fetch_partition_with_retry, session, module_name, part_start, part_end, retries)
+            for part_start, part_end in partitions
+        ]
+        results = [future.result() for future in futures]
+
+    failed = [partitions[i] for i, records in enumerate(results) if records is None]
+    if failed:
+        logger.error(f"Módulo {module_name}: {len(failed)} partição(ões) falharam: {failed}")
+        return None
+
+    records = []
+    for partition_records in results:
+        records.extend(partition_records)
+
+    logger.info(f"Módulo {module_name}: {len(records)} registros obtidos em {len(partitions)} partições")
+    return records
+
+
+def iter_process_records(module_name, records, stats=None):
+    """Converte registros de qualquer módulo em linhas da planilha, em lotes"""
+    transformer = get_transformer(module_name)
+    for batch in iter_batches(records, TRANSFORM_BATCH_SIZE):
+        yield from transformer.convert_batch(batch, stats)
+
+
+# Escritor em blocos compartilhado (o token bucket vale para todas as escritas do processo)
+sheets_writer = BulkSheetWriter(
+    requests_per_minute=SHEETS_WRITE_REQUESTS_PER_MINUTE,
+    max_rows_per_chunk=SHEETS_CHUNK_ROWS,
+    max_chunk_bytes=SHEETS_CHUNK_BYTES,
+    max_retries=SHEETS_MAX_RETRIES
+)
+
+
+# Última linha escrita por aba (fallback quando a resposta do append não traz o intervalo)
+sheet_last_rows = {}
+
+
+def get_module_worksheet(worksheet_name):
+    """Aba do módulo; abas de resumo (criadas por este serviço) são criadas com cabeçalho se faltarem"""
+    schema = get_schema(worksheet_name)
+    headers = [column.name for column in schema.columns] if schema and schema.group_by else None
+    return sheets_clients.get_worksheet(worksheet_name, headers=headers)
+
+
+def append_to_google_sheets(worksheet_name, data, stats=None):
+    """Adiciona dados ao Google Sheets
+
+    stats: dict opcional onde são acumulados linhas, blocos, novas tentativas e tempo de escrita
+    """
+    try:
+        worksheet = get_module_worksheet(worksheet_name)
+
+        # Adicionar dados
+        if data:
+            # Envio em blocos com controle de cota e novas tentativas
+            write_result = sheets_writer.write(worksheet, data)
+
+            if stats is not None:
+                for key in ('rows', 'chunks', 'retries', 'seconds'):
+                    stats[key] = stats.get(key, 0) + write_result[key]
+                stats['rows_per_second'] = round(stats['rows'] / stats['seconds'], 1) if stats['seconds'] else None
+
+            # Intervalo escrito vem da própria resposta do append (sem reler a planilha)
+            if write_result['start_row'] is not None:
+                start_row, end_row = write_result['start_row'], write_result['end_row']
+            else:
+                last_row = sheet_last_rows.get(worksheet_name)
+                if last_row is None:
+                    last_row = len(worksheet.col_values(1)) - len(data)
+                start_row = last_row + 1
+                end_row = last_row + len(data)
+            sheet_last_rows[worksheet_name] = end_row
+
+            logger.info(f"Dados adicionados ao Google Sheets: linhas {start_row} a {end_row}")
+            return (start_row, end_row)
+
+        return None
+
+    except Exception as e:
+        logger.error(f"Erro ao adicionar dados ao Google Sheets: {str(e)}")
+        sheets_clients.invalidate(worksheet_name)
+        return None
+
+
+# Locks de upsert por aba quando não há estado compartilhado (só entre threads deste processo)
+upsert_locks = {}
+upsert_locks_guard = threading.Lock()
+
+
+@contextmanager
+
+
+def sheet_upsert_lock(sheet):
+    """Serializa os upserts de uma aba: entre workers via shared_state, senão entre threads"""
+    if shared_state is not None:
+        with shared_state.lock(f"upsert_{sheet}", timeout=SHEETS_UPSERT_LOCK_TIMEOUT):
+            yield
+        return
+    with upsert_locks_guard:
+        lock = upsert_locks.setdefault(sheet, threading.Lock())
+    with lock:
+        yield
+
+
+def upsert_to_google_sheets(worksheet_name, data, stats=None):
+    """Grava só as linhas cuja chave ((vd, itm) no analítico, vd no período) ainda não está na aba
+
+    Usa o índice local chave -> linha; a planilha só é relida quando o índice
+    está ausente ou desatualizado. Linhas já existentes são mantidas como estão.
+    Retorna {'written', 'skipped', 'start_row', 'end_row'} ou None em caso de erro.
+    """
+    if sheet_index is None:
+        logger.error(f"Upsert de {worksheet_name} indisponível: índice de chaves não configurado")
+        return None
+
+    try:
+        schema_columns = [column.name for column in get_schema(worksheet_name).columns]
+        key_indexes = [schema_columns.index(name) for name in SHEET_KEY_COLUMNS[worksheet_name]]
+
+        sheet = f"{sheets_clients.sheet_key or SHEET_NAME}:{worksheet_name}"
+
+        # Checar chaves -> append -> índice sem outro upsert da mesma aba no meio (threads e workers)
+        with sheet_upsert_lock(sheet):
+            worksheet = get_module_worksheet(worksheet_name)
+            sheet_index.ensure_fresh(sheet, worksheet, key_indexes)
+
+            keys = [make_key([row[i] for i in key_indexes]) for row in data]
+            existing = sheet_index.existing_keys(sheet, set(keys))
+
+            new_rows = []
+            new_keys = []
+            seen = set(existing)
+            for key, row in zip(keys, data):
+                if key in seen:
+                    continue
+                seen.add(key)
+                new_rows.append(row)
+                new_keys.append(key)
+
+            skipped = len(data) - len(new_rows)
+            if stats is not None:
+                stats['skipped'] = stats.get('skipped', 0) + skipped
+
+            if not new_rows:
+                logger.info(f"Upsert {worksheet_name}: nenhuma linha nova ({skipped} já existentes)")
+                return {'written': 0, 'skipped': skipped, 'start_row': None, 'end_row': None}
+
+            written_range = append_to_google_sheets(worksheet_name, new_rows, stats)
+            if not written_range:
+                return None
+
+            start_row, end_row = written_range
+            sheet_index.add(sheet, zip(new_keys, range(start_row, start_row + len(new_rows))), end_row)
+
+            logger.info(f"Upsert {worksheet_name}: {len(new_rows)} linhas novas, {skipped} já existentes")
+            return {'written': len(new_rows), 'skipped': skipped, 'start_row': start_row, 'end_row': end_row}
+
+    except Exception as e:
+        logger.error(f"Erro no upsert do Google Sheets: {str(e)}")
+        sheets_clients.invalidate(worksheet_name)
+        return None
+
+
+def closed_day_rows(schema, rows):
+    """Linhas de dias fechados; as de dias ainda abertos ficam para uma próxima execução"""
+    index = [column.name for column in schema.columns].index(schema.date_column)
+    closed = [row for row in rows if row[index] and is_closed(str(row[index])[:10], RECORD_CACHE_OPEN_DAYS)]
+    if len(closed) < len(rows):
+        logger.info(f"Resumo {schema.name}: {len(rows) - len(closed)} linha(s) de dias ainda abertos não gravadas")
+    return closed
+
+
+def write_to_google_sheets(worksheet_name, data, write_mode, stats=None):
+    """Grava as linhas no modo escolhido; retorna quantas foram gravadas ou None em caso de erro
+
+    Abas de resumo (uma linha por dia e grupo) só recebem dias fechados e sempre
+    por upsert: o total de um dia aberto ainda muda e nunca seria corrigido
+    pelo upsert (ou seria somado de novo por um append).
+    """
+    schema = get_schema(worksheet_name)
+    if schema is not None and schema.group_by:
+        write_mode = 'upsert'
+        data = closed_day_rows(schema, data)
+        if not data:
+            return 0
+
+    if write_mode == 'upsert':
+        result = upsert_to_google_sheets(worksheet_name, data, stats)
+        written = result['written'] if result else None
+    elif write_mode == 'append':
+        written = len(data) if append_to_google_sheets(worksheet_name, data, stats) else None
+    else:
+        raise ValueError(f"Modo de escrita inválido: {write_mode}")
+
+    if written:
+        ROWS_WRITTEN.inc(written, worksheet=worksheet_name)
+    return written
+
+
+def resolve_period(module_name, mode, lookback_days=None):
+    """Define o período da execução
+
+    fixed: janela fixa DEFAULT_FIXED_START_DATE..DEFAULT_FIXED_END_DATE
+    incremental: da última data sincronizada (menos lookback_days, para pegar
+    edições tardias) até hoje
+    """
+    if mode == 'fixed':
+        return DEFAULT_FIXED_START_DATE, DEFAULT_FIXED_END_DATE
+
+    if mode != 'incremental':
+        raise ValueError(f"Modo de sincronização inválido: {mode}")
+    if watermarks is None:
+        raise ValueError("Modo incremental indisponível: marcas d'água não configuradas")
+
+    lookback_days = INCREMENTAL_LOOKBACK_DAYS if lookback_days is None else lookback_days
+    if get_schema(module_name).group_by:
+        # Resumos só gravam dias fechados: a janela volta até o primeiro dia ainda aberto na última execução
+        lookback_days = max(lookback_days, RECORD_CACHE_OPEN_DAYS)
+    end_date = date.today()
+    synced_until = watermarks.get(module_name)
+    if synced_until:
+        start_date = datetime.strptime(synced_until, '%Y-%m-%d').date() - timedelta(days=lookback_days)
+    else:
+        start_date = datetime.strptime(INCREMENTAL_INITIAL_START_DATE, '%Y-%m-%d').date()
+    start_date = min(start_date, end_date)
+
+    return start_date.isoformat(), end_date.isoformat()
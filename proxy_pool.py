@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+"""
+Pool de proxies com verificação de saúde em background
+Testa todos os proxies em paralelo, mantém a latência média (EWMA) de cada um
+e entrega na hora o proxy saudável mais rápido, com sessão reaproveitada
+"""
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+
+class ProxyState:
+    """Saúde e latência de um proxy"""
+
+    def __init__(self, address):
+        self.address = address
+        self.healthy = False
+        self.latency_ewma = None
+        self.last_checked = 0.0
+        self.consecutive_failures = 0
+        self.successes = 0
+        self.failures = 0
+
+    def proxies(self):
+        return {
+            'http': f'http://{self.address}',
+            'https': f'http://{self.address}'
+        }
+
+    def to_dict(self, now):
+        return {
+            'proxy': self.address,
+            'healthy': self.healthy,
+            'latency_ms': round(self.latency_ewma * 1000) if self.latency_ewma is not None else None,
+            'checked_seconds_ago': round(now - self.last_checked, 1) if self.last_checked else None,
+            'consecutive_failures': self.consecutive_failures,
+            'successes': self.successes,
+            'failures': self.failures
+        }
+
+
+class ProxyPool:
+    """Pool de proxies com estado em cache e atualização em background
+
+    best() nunca faz I/O: usa apenas o estado em cache (válido por ttl segundos).
+    A thread de background refaz os testes a cada refresh_interval segundos.
+    """
+
+    def __init__(self, addresses, test_url='http://httpbin.org/ip', timeout=5, ttl=300,
+                 refresh_interval=60, alpha=0.3, max_workers=8):
+        self.test_url = test_url
+        self.timeout = timeout
+        self.ttl = ttl
+        self.refresh_interval = refresh_interval
+        self.alpha = alpha
+        self.max_workers = max_workers
+
+        self._states = {address: ProxyState(address) for address in addresses}
+        self._sessions = {}
+        self._lock = threading.Lock()
+        self._probe_lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+
+    # Testes de saúde
+
+    def _probe(self, state):
+        started = time.time()
+        try:
+            response = requests.get(self.test_url, proxies=state.proxies(), timeout=self.timeout)
+            ok = response.status_code == 200
+        except Exception as e:
+            logger.debug(f"Proxy {state.address} falhou no teste: {str(e)}")
+            ok = False
+        self._record(state, ok, time.time() - started)
+        return ok
+
+    def _record(self, state, ok, latency=None):
+        with self._lock:
+            state.last_checked = time.time()
+            if ok:
+                state.healthy = True
+                state.consecutive_failures = 0
+                state.successes += 1
+                if latency is not None:
+                    if state.latency_ewma is None:
+                        state.latency_ewma = latency
+                    else:
+                        state.latency_ewma = self.alpha * latency + (1 - self.alpha) * state.latency_ewma
+            else:
+                state.healthy = False
+                state.consecutive_failures += 1
+                state.failures += 1
+                self._drop_session(state.address)
+
+    def probe_all(self):
+        """Testa todos os proxies em paralelo; retorna quantos estão saudáveis"""
+        if not self._states:
+            return 0
+        # Evita rodadas de teste sobrepostas
+        if not self._probe_lock.acquire(blocking=False):
+            return self.healthy_count()
+        try:
+            workers = min(self.max_workers, len(self._states))
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='proxy-probe') as executor:
+                results = list(executor.map(self._probe, list(self._states.values())))
+            healthy = sum(results)
+            logger.info(f"Proxies testados: {healthy}/{len(results)} saudáveis")
+            return healthy
+        finally:
+            self._probe_lock.release()
+
+    def start(self):
+        """Inicia a thread de atualização em background (idempotente)"""
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._refresh_loop, name='proxy-refresh', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _refresh_loop(self):
+        while not self._stop.is_set():
+            try:
+                self.probe_all()
+            except Exception as e:
+                logger.warning(f"Erro ao testar proxies: {str(e)}")
+            self._stop.wait(self.refresh_interval)
+
+    # Seleção
+
+    def best(self):
+        """Proxy saudável mais rápido segundo o cache, sem I/O (None se não houver)"""
+        now = time.time()
+        with self._lock:
+            candidates = [
+                state for state in self._states.values()
+                if state.healthy and now - state.last_checked <= self.ttl
+            ]
+            if not candidates:
+                return None
+            return min(candidates, key=lambda state: state.latency_ewma or float('inf')).address
+
+    def session_for(self, address):
+        """Sessão fixa (sticky) do proxy, reaproveitando conexões e cookies"""
+        with self._lock:
+            session = self._sessions.get(address)
+            if session is None:
+                session = requests.Session()
+                session.proxies.update(self._states[address].proxies())
+                self._sessions[address] = session
+            return session
+
+    def _drop_session(self, address):
+        session = self._sessions.pop(address, None)
+        if session is not None:
+            session.close()
+
+    def report(self, address, ok, latency=None):
+        """Registra o resultado de um uso real do proxy (ex.: login) no estado em cache"""
+        state = self._states.get(address)
+        if state is not None:
+            self._record(state, ok, latency)
+
+    def healthy_count(self):
+        with self._lock:
+            return sum(1 for state in self._states.values() if state.healthy)
+
+    def stats(self):
+        now = time.time()
+        with self._lock:
+            states = sorted(
+                self._states.values(),
+                key=lambda state: (not state.healthy, state.latency_ewma or float('inf'))
+            )
+            return {
+                'healthy': sum(1 for state in states if state.healthy),
+                'total': len(states),
+                'refresh_running': bool(self._thread and self._thread.is_alive()),
+                'proxies': [state.to_dict(now) for state in states]
+            }
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+Cache local de registros do ContaHub particionado por módulo e data gerencial
+Dias já fechados são servidos do disco; só os dias em aberto voltam a ser buscados
+"""
+import os
+import json
+import gzip
+import time
+import logging
+import threading
+from datetime import date, timedelta
+
+logger = logging.getLogger(__name__)
+
+
+def is_closed(day, open_days):
+    """Dias com mais de open_days dias de idade não mudam mais"""
+    if isinstance(day, str):
+        day = date.fromisoformat(day)
+    return day <= date.today() - timedelta(days=open_days)
+
+
+class RecordCache:
+    """Cache em disco: <diretório>/<módulo>/<YYYY-MM-DD>.json.gz
+
+    Cada partição é gravada linha a linha, com os nomes das colunas uma única
+    vez ({"columns": [...], "rows": [[...], ...]}), e comprimida com gzip.
+    Partições expiram por TTL e as menos usadas recentemente são removidas
+    quando o total passa de max_bytes.
+    """
+
+    def __init__(self, directory, ttl_seconds=30 * 24 * 3600, max_bytes=512 * 1024 * 1024, open_days=2):
+        self.directory = directory
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.open_days = open_days
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+        # Contadores
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+
+    def _path(self, module_name, day):
+        return os.path.join(self.directory, module_name, f"{day}.json.gz")
+
+    def is_closed(self, day):
+        """Dias com mais de open_days dias de idade não mudam mais e podem ser cacheados"""
+        return is_closed(day, self.open_days)
+
+    def get(self, module_name, day):
+        """Retorna os registros do dia ou None se não estiverem em cache (ou expirados)"""
+        path = self._path(module_name, day)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+            return None
+
+        if time.time() - stat.st_mtime > self.ttl_seconds:
+            self._remove(path)
+            with self._lock:
+                self.misses += 1
+            return None
+
+        try:
+            with gzip.open(path, 'rt', encoding='utf-8') as f:
+                payload = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Partição de cache corrompida {path}: {str(e)}")
+            self._remove(path)
+            with self._lock:
+                self.misses += 1
+            return None
+
+        # Marca o acesso para a remoção LRU sem alterar a idade (mtime) usada pelo TTL
+        os.utime(path, (time.time(), stat.st_mtime))
+        with self._lock:
+            self.hits += 1
+
+        columns = payload['columns']
+        return [dict(zip(columns, row)) for row in payload['rows']]
+
+    def put(self, module_name, day, records):
+        """Grava os registros de um dia (inclusive dias sem movimento)
+
+        A remoção por tamanho não roda a cada gravação: chame evict() ao fim do lote.
+        """
+        columns = list(records[0].keys()) if records else []
+        payload = {
+            'columns': columns,
+            'rows': [[record.get(column) for column in columns] for record in records]
+        }
+
+        path = self._path(module_name, day)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with gzip.open(tmp_path, 'wt', encoding='utf-8', compresslevel=6) as f:
+            json.dump(payload, f, separators=(',', ':'), ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            self.writes += 1
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+            with self._lock:
+                self.evictions += 1
+        except FileNotFoundError:
+            pass
+
+    def _entries(self):
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if name.endswith('.json.gz'):
+                    path = os.path.join(root, name)
+                    try:
+                        yield path, os.stat(path)
+                    except FileNotFoundError:
+                        continue
+
+    def evict(self):
+        """Remove partições expiradas e, acima de max_bytes, as menos acessadas"""
+        now = time.time()
+        entries = []
+        total = 0
+        for path, stat in self._entries():
+            if now - stat.st_mtime > self.ttl_seconds:
+                self._remove(path)
+                continue
+            entries.append((stat.st_atime, stat.st_size, path))
+            total += stat.st_size
+
+        if total <= self.max_bytes:
+            return
+        for _, size, path in sorted(entries):
+            self._remove(path)
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+    def stats(self):
+        total_bytes = sum(stat.st_size for _, stat in self._entries())
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'writes': self.writes,
+                'evictions': self.evictions,
+                'bytes': total_bytes
+            }
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""
+Histórico em memória das execuções e buffer circular de logs estruturados
+Servidos pelos endpoints /logs e /runs, com filtros por execução e nível
+"""
+import time
+import uuid
+import logging
+import threading
+import contextvars
+from collections import deque, OrderedDict
+from contextlib import contextmanager
+from datetime import datetime
+
+# Execução corrente da thread/contexto (propagada para os executores com submit_with_context)
+current_run_id = contextvars.ContextVar('current_run_id', default=None)
+
+
+def new_run_id():
+    return uuid.uuid4().hex[:12]
+
+
+@contextmanager
+def run_context(run_id):
+    """Associa os logs emitidos dentro do bloco à execução run_id"""
+    token = current_run_id.set(run_id)
+    try:
+        yield run_id
+    finally:
+        current_run_id.reset(token)
+
+
+def submit_with_context(executor, fn, *args, **kwargs):
+    """executor.submit() preservando o contexto atual (inclusive a execução corrente)"""
+    context = contextvars.copy_context()
+    return executor.submit(context.run, fn, *args, **kwargs)
+
+
+def parse_level(level):
+    """Converte 'warning', 'WARNING' ou 30 no número do nível (None se inválido)"""
+    if level is None or level == '':
+        return None
+    if isinstance(level, int) or str(level).isdigit():
+        return int(level)
+    value = logging.getLevelName(str(level).upper())
+    return value if isinstance(value, int) else None
+
+
+class LogRingBuffer(logging.Handler):
+    """Handler de logging que guarda os últimos registros como dicts"""
+
+    def __init__(self, capacity=2000, level=logging.INFO):
+        super().__init__(level)
+        self._records = deque(maxlen=capacity)
+        self._buffer_lock = threading.Lock()
+
+    def emit(self, record):
+        try:
+            entry = {
+                'timestamp': datetime.fromtimestamp(record.created).isoformat(),
+                'level': record.levelname,
+                'levelno': record.levelno,
+                'logger': record.name,
+                'message': record.getMessage(),
+                'run_id': current_run_id.get()
+            }
+            if record.exc_info and record.exc_info[1] is not None:
+                entry['exception'] = f"{record.exc_info[0].__name__}: {record.exc_info[1]}"
+            with self._buffer_lock:
+                self._records.append(entry)
+        except Exception:
+            self.handleError(record)
+
+    def records(self, run_id=None, level=None, limit=None):
+        """Registros mais recentes primeiro; level é o nível mínimo"""
+        min_level = parse_level(level)
+        with self._buffer_lock:
+            entries = list(self._records)
+        result = []
+        for entry in reversed(entries):
+            if run_id and entry['run_id'] != run_id:
+                continue
+            if min_level is not None and entry['levelno'] < min_level:
+                continue
+            result.append(entry)
+            if limit and len(result) >= limit:
+                break
+        return result
+
+
+class RunHistory:
+    """Resumos das últimas execuções (período, módulos, contagens, tempos e erros)"""
+
+    def __init__(self, capacity=100):
+        self.capacity = capacity
+        self._runs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def start(self, run_id, params=None):
+        with self._lock:
+            self._runs[run_id] = {
+                'run_id': run_id,
+                'status': 'running',
+                'params': params or {},
+                'started_at': datetime.now().isoformat(),
+                'finished_at': None,
+                'duration_seconds': None,
+                'modules': {},
+                'error': None,
+                '_started': time.time()
+            }
+            while len(self._runs) > self.capacity:
+                self._runs.popitem(last=False)
+
+    def record_module(self, run_id, module_name, result):
+        """Guarda o resumo de um módulo (período, contagens, tempos e erro)"""
+        summary = {
+            'period': result.get('period'),
+            'fetched': result.get('fetched', 0),
+            'written': result.get('written', 0),
+            'failed_records': result.get('failed_records', 0),
+            'timings': result.get('timings', {}),
+            'error': result.get('error')
+        }
+        with self._lock:
+            run = self._runs.get(run_id)
+            if run is not None:
+                run['modules'][module_name] = summary
+
+    def finish(self, run_id, success, error=None):
+        with self._lock:
+            run = self._runs.get(run_id)
+            if run is None:
+                return
+            run['status'] = 'succeeded' if success else 'failed'
+            run['error'] = error
+            run['finished_at'] = datetime.now().isoformat()
+            run['duration_seconds'] = round(time.time() - run['_started'], 3)
+
+    def runs(self, run_id=None, status=None, limit=None):
+        """Execuções mais recentes primeiro"""
+        with self._lock:
+            runs = [dict(run, modules=dict(run['modules'])) for run in reversed(self._runs.values())]
+        result = []
+        for run in runs:
+            if run_id and run['run_id'] != run_id:
+                continue
+            if status and run['status'] != status:
+                continue
+            run.pop('_started', None)
+            result.append(run)
+            if limit and len(result) >= limit:
+                break
+        return result
@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+"""
+Esquemas de colunas dos módulos do ContaHub
+Cada esquema define nome, tipo e valor padrão das colunas e é compilado
+uma única vez em um conversor rápido de registro -> linha da planilha
+"""
+import logging
+from collections import namedtuple
+from operator import itemgetter
+
+logger = logging.getLogger(__name__)
+
+Column = namedtuple('Column', ['name', 'type', 'default'])
+# group_by/aggregates: módulos de resumo agregados no próprio ContaHub (GROUP BY na query)
+ModuleSchema = namedtuple(
+    'ModuleSchema', ['name', 'table', 'date_column', 'order_by', 'columns', 'group_by', 'aggregates'],
+    defaults=(None, None)
+)
+
+STR = 'str'
+FLOAT = 'float'
+
+MAX_ERROR_SAMPLES = 10
+
+
+def _str(name):
+    return Column(name, STR, '')
+
+
+def _float(name):
+    return Column(name, FLOAT, 0)
+
+
+MODULE_SCHEMAS = {
+    'analitico': ModuleSchema(
+        name='analitico',
+        table='contahub_analitico',
+        date_column='vd_dtgerencial',
+        order_by=('vd_dtgerencial', 'vd', 'itm'),
+        columns=(
+            _str('dia_semana'), _str('semana'), _str('vd'), _str('vd_mesadesc'), _str('vd_localizacao'),
+            _str('itm'), _str('trn'), _str('trn_desc'), _str('prefixo'), _str('tipo'), _str('tipovenda'),
+            _str('ano'), _str('mes'), _str('vd_dtgerencial'), _str('usr_lancou'), _str('prd'),
+            _str('prd_desc'), _str('grp_desc'), _str('loc_desc'),
+            _float('qtd'), _float('desconto'), _float('valorfinal'), _float('custo'),
+            _str('itm_obs'), _str('comandaorigem'), _str('itemorigem')
+        )
+    ),
+    'periodo': ModuleSchema(
+        name='periodo',
+        table='contahub_periodo',
+        date_column='dt_gerencial',
+        order_by=('dt_gerencial', 'vd'),
+        columns=(
+            _str('vd'), _str('dia_semana'), _str('semana'), _str('trn'), _str('dt_gerencial'),
+            _str('tipovenda'), _str('vd_mesadesc'), _str('vd_localizacao'), _str('usr_abriu'),
+            _float('pessoas'), _float('qtd_itens'),
+            _float('vr_pagamentos'), _float('vr_produtos'), _float('vr_repique'), _float('vr_couvert'),
+            _float('vr_desconto'),
+            _str('motivo'), _str('dt_contabil'), _str('ultimo_pedido'), _str('vd_cpf'), _str('nf_autorizada'),
+            _str('nf_chaveacesso'), _str('nf_dtcontabil'), _str('vd_dtcontabil')
+        )
+    ),
+    'analitico_diario': ModuleSchema(
+        name='analitico_diario',
+        table='contahub_analitico',
+        date_column='vd_dtgerencial',
+        order_by=('vd_dtgerencial', 'grp_desc', 'loc_desc', 'tipovenda'),
+        columns=(
+            _str('vd_dtgerencial'), _str('grp_desc'), _str('loc_desc'), _str('tipovenda'),
+            _float('itens'), _float('qtd'), _float('valorfinal'), _float('custo'), _float('desconto')
+        ),
+        group_by=('vd_dtgerencial', 'grp_desc', 'loc_desc', 'tipovenda'),
+        aggregates={
+            'itens': 'COUNT(*)',
+            'qtd': 'SUM({alias}.qtd)',
+            'valorfinal': 'SUM({alias}.valorfinal)',
+            'custo': 'SUM({alias}.custo)',
+            'desconto': 'SUM({alias}.desconto)'
+        }
+    )
+}
+
+# Módulo de resumo usado no modo agregado para cada módulo detalhado
+AGGREGATE_MODULES = {
+    'analitico': 'analitico_diario'
+}
+
+
+def get_schema(module_name):
+    """Retorna o esquema do módulo ou None se não existir"""
+    return MODULE_SCHEMAS.get(module_name)
+
+
+def column_names(module_name):
+    return [column.name for column in MODULE_SCHEMAS[module_name].columns]
+
+
+def get_aggregate_module(module_name):
+    """Módulo de resumo (agregado no servidor) correspondente, ou None se não houver"""
+    if module_name in AGGREGATE_MODULES.values():
+        return module_name
+    return AGGREGATE_MODULES.get(module_name)
+
+
+def select_list(module_name, alias='v'):
+    """Lista de colunas do SELECT na ordem do esquema (mesma ordem das linhas da planilha)
+
+    Colunas agregadas viram a expressão do esquema com o nome da coluna (ex.: SUM(v.qtd) AS qtd).
+    """
+    aggregates = MODULE_SCHEMAS[module_name].aggregates or {}
+    return ', '.join(
+        f"{aggregates[name].format(alias=alias)} AS {name}" if name in aggregates else f"{alias}.{name}"
+        for name in column_names(module_name)
+    )
+
+
+def compile_row_converter(columns):
+    """Compila as colunas em uma função registro (dict) -> linha (list)
+
+    O caminho rápido usa um único itemgetter para todas as colunas e só converte
+    as colunas numéricas; registros sem alguma chave caem no caminho com defaults.
+    """
+    names = tuple(column.name for column in columns)
+    defaults = tuple(column.default for column in columns)
+    named_defaults = tuple(zip(names, defaults))
+    float_indexes = tuple(i for i, column in enumerate(columns) if column.type == FLOAT)
+    getter = itemgetter(*names)
+
+    def convert(record):
+        try:
+            row = list(getter(record))
+        except KeyError:
+            row = [record.get(name, default) for name, default in named_defaults]
+        for i in float_indexes:
+            row[i] = float(row[i] or 0)
+        return row
+
+    return convert
+
+
+class RowTransformer:
+    """Conversor compilado de registros de um módulo em linhas da planilha"""
+
+    def __init__(self, schema):
+        self.schema = schema
+        self.convert = compile_row_converter(schema.columns)
+
+    def convert_batch(self, records, stats=None):
+        """Converte um lote de registros, contando (em vez de só logar) os que falharem
+
+        stats: dict opcional acumulando 'processed', 'failed' e 'errors' (amostras)
+        """
+        convert = self.convert
+        try:
+            rows = [convert(record) for record in records]
+            failed = 0
+        except Exception:
+            # Algum registro inválido no lote: refazer registro a registro
+            rows = []
+            failed = 0
+            for record in records:
+                try:
+                    rows.append(convert(record))
+                except Exception as e:
+                    failed += 1
+                    self._record_error(stats, record, e)
+
+        if stats is not None:
+            stats['processed'] = stats.get('processed', 0) + len(rows)
+            stats['failed'] = stats.get('failed', 0) + failed
+        if failed:
+            logger.error(f"Módulo {self.schema.name}: {failed} registro(s) inválido(s) descartado(s) no lote")
+        return rows
+
+    def _record_error(self, stats, record, error):
+        if stats is None:
+            return
+        errors = stats.setdefault('errors', [])
+        if len(errors) < MAX_ERROR_SAMPLES:
+            errors.append({
+                'key': {name: record.get(name) for name in self.schema.order_by} if isinstance(record, dict) else None,
+                'error': str(error)
+            })
+
+
+TRANSFORMERS = {name: RowTransformer(schema) for name, schema in MODULE_SCHEMAS.items()}
+
+
+def get_transformer(module_name):
+    """Retorna o conversor compilado do módulo ou None se não existir"""
+    return TRANSFORMERS.get(module_name)
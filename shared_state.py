@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""
+Estado compartilhado entre os workers do gunicorn
+Chave/valor com TTL em um SQLite local (mesmo STATE_DIR para todos os workers)
+e locks entre processos por arquivo, para que N workers façam o mesmo número
+de logins e renovações de token que um só
+"""
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: lock só entre threads do mesmo processo
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+
+class SharedState:
+    """Chave/valor JSON com expiração, gravado em SQLite e visível a todos os processos"""
+
+    def __init__(self, path, lock_dir=None):
+        self.path = path
+        self.lock_dir = lock_dir or os.path.join(os.path.dirname(path) or '.', 'locks')
+        os.makedirs(self.lock_dir, exist_ok=True)
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._thread_locks = {}
+        self._thread_locks_guard = threading.Lock()
+
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS shared_state (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    expires_at REAL,
+                    updated_at REAL NOT NULL
+                )
+            """)
+        try:
+            # Guarda cookies de sessão e token do Google: só o dono do processo lê
+            os.chmod(path, 0o600)
+        except OSError:
+            pass
+
+        # Contadores
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.lock_waits = 0
+        self.lock_timeouts = 0
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def get(self, key):
+        """Valor da chave ou None se ausente/expirada"""
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT value FROM shared_state WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)",
+                (key, time.time())
+            ).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return json.loads(row[0])
+
+    def set(self, key, value, ttl=None):
+        """Grava o valor; ttl em segundos (None = sem expiração)"""
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO shared_state (key, value, expires_at, updated_at) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value, default=str), now + ttl if ttl else None, now)
+            )
+            conn.execute("DELETE FROM shared_state WHERE expires_at IS NOT NULL AND expires_at <= ?", (now,))
+        self.writes += 1
+
+    def delete(self, key, only_if=None):
+        """Remove a chave; com only_if, só se o valor atual ainda for igual (evita apagar o de outro worker)"""
+        with self._connect() as conn:
+            if only_if is None:
+                conn.execute("DELETE FROM shared_state WHERE key = ?", (key,))
+                return
+            row = conn.execute("SELECT value FROM shared_state WHERE key = ?", (key,)).fetchone()
+            if row and json.loads(row[0]) == json.loads(json.dumps(only_if, default=str)):
+                conn.execute("DELETE FROM shared_state WHERE key = ?", (key,))
+
+    @contextmanager
+    def lock(self, name, timeout=90):
+        """Lock exclusivo entre processos (flock) e threads
+
+        Se não conseguir em timeout segundos, segue sem o lock (retorna False):
+        no pior caso o trabalho é repetido, como sem o estado compartilhado.
+        """
+        with self._thread_locks_guard:
+            thread_lock = self._thread_locks.setdefault(name, threading.Lock())
+
+        deadline = time.time() + timeout
+        if not thread_lock.acquire(timeout=timeout):
+            self.lock_timeouts += 1
+            logger.warning(f"Lock '{name}' não obtido em {timeout}s, seguindo sem ele")
+            yield False
+            return
+
+        handle = None
+        acquired = True
+        try:
+            if fcntl is not None:
+                handle = open(os.path.join(self.lock_dir, f"{name}.lock"), 'a')
+                waited = False
+                while True:
+                    try:
+                        fcntl.flock(handle.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                        break
+                    except BlockingIOError:
+                        if not waited:
+                            waited = True
+                            self.lock_waits += 1
+                        if time.time() >= deadline:
+                            acquired = False
+                            self.lock_timeouts += 1
+                            logger.warning(f"Lock '{name}' não obtido em {timeout}s, seguindo sem ele")
+                            break
+                        time.sleep(0.05)
+            yield acquired
+        finally:
+            if handle is not None:
+                if acquired:
+                    fcntl.flock(handle.fileno(), fcntl.LOCK_UN)
+                handle.close()
+            thread_lock.release()
+
+    def stats(self):
+        with self._connect() as conn:
+            keys = conn.execute(
+                "SELECT COUNT(*) FROM shared_state WHERE expires_at IS NULL OR expires_at > ?", (time.time(),)
+            ).fetchone()[0]
+        return {
+            'keys': keys,
+            'hits': self.hits,
+            'misses': self.misses,
+            'writes': self.writes,
+            'lock_waits': self.lock_waits,
+            'lock_timeouts': self.lock_timeouts,
+            'process_locks': fcntl is not None
+        }
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""
+Índice local de chaves já gravadas em cada aba do Google Sheets
+Mapeia a chave natural da linha (ex.: (vd, itm)) para o número da linha,
+permitindo upsert idempotente sem reler a planilha inteira
+"""
+import os
+import sqlite3
+import logging
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+# Colunas do esquema que formam a chave de cada aba
+SHEET_KEY_COLUMNS = {
+    'analitico': ('vd', 'itm'),
+    'periodo': ('vd',),
+    'analitico_diario': ('vd_dtgerencial', 'grp_desc', 'loc_desc', 'tipovenda')
+}
+
+KEY_SEPARATOR = '|'
+
+
+def make_key(values):
+    """Normaliza os valores da chave em texto (a planilha devolve tudo como texto)"""
+    return KEY_SEPARATOR.join('' if value is None else str(value) for value in values)
+
+
+class SheetKeyIndex:
+    """Índice persistente (SQLite) chave -> linha, por planilha e aba"""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS sheet_keys (
+                    sheet TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    row INTEGER NOT NULL,
+                    PRIMARY KEY (sheet, key)
+                ) WITHOUT ROWID;
+                CREATE TABLE IF NOT EXISTS sheet_index_state (
+                    sheet TEXT PRIMARY KEY,
+                    last_row INTEGER NOT NULL,
+                    rebuilt_at TEXT NOT NULL
+                );
+            """)
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def last_row(self, sheet):
+        """Última linha conhecida da aba, ou None se o índice nunca foi construído"""
+        with self._lock, self._connect() as conn:
+            row = conn.execute("SELECT last_row FROM sheet_index_state WHERE sheet = ?", (sheet,)).fetchone()
+        return row[0] if row else None
+
+    def existing_keys(self, sheet, keys):
+        """Retorna o subconjunto de keys já presentes no índice"""
+        keys = list(keys)
+        found = set()
+        with self._lock, self._connect() as conn:
+            for i in range(0, len(keys), 500):
+                batch = keys[i:i + 500]
+                placeholders = ','.join('?' * len(batch))
+                found.update(key for (key,) in conn.execute(
+                    f"SELECT key FROM sheet_keys WHERE sheet = ? AND key IN ({placeholders})",
+                    [sheet] + batch
+                ))
+        return found
+
+    def add(self, sheet, keyed_rows, last_row):
+        """Registra chaves recém-gravadas (pares (chave, linha)) e a nova última linha"""
+        with self._lock, self._connect() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO sheet_keys (sheet, key, row) VALUES (?, ?, ?)",
+                ((sheet, key, row) for key, row in keyed_rows)
+            )
+            conn.execute("""
+                INSERT INTO sheet_index_state (sheet, last_row, rebuilt_at) VALUES (?, ?, ?)
+                ON CONFLICT(sheet) DO UPDATE SET last_row = MAX(sheet_index_state.last_row, excluded.last_row)
+            """, (sheet, last_row, datetime.now().isoformat()))
+
+    def rebuild(self, sheet, keyed_rows, last_row):
+        """Substitui o índice da aba pelo conteúdo lido da planilha"""
+        with self._lock, self._connect() as conn:
+            conn.execute("DELETE FROM sheet_keys WHERE sheet = ?", (sheet,))
+            conn.executemany(
+                "INSERT OR REPLACE INTO sheet_keys (sheet, key, row) VALUES (?, ?, ?)",
+                ((sheet, key, row) for key, row in keyed_rows)
+            )
+            conn.execute(
+                "INSERT OR REPLACE INTO sheet_index_state (sheet, last_row, rebuilt_at) VALUES (?, ?, ?)",
+                (sheet, last_row, datetime.now().isoformat())
+            )
+
+    def ensure_fresh(self, sheet, worksheet, key_indexes):
+        """Garante que o índice reflete a aba, reconstruindo só se ausente ou desatualizado
+
+        A checagem lê apenas a última linha conhecida e a seguinte: se a seguinte
+        tiver dados (alguém gravou fora do upsert) ou a última estiver vazia
+        (linhas removidas), o índice é reconstruído a partir das colunas-chave.
+        Retorna True se houve reconstrução.
+        """
+        last_row = self.last_row(sheet)
+        if last_row is not None and last_row > 0:
+            rows = worksheet.get(f"{last_row}:{last_row + 1}")
+            if len(rows) == 1 and any(rows[0]):
+                return False
+            logger.info(f"Índice da aba {sheet} desatualizado (última linha conhecida {last_row}), reconstruindo...")
+        else:
+            logger.info(f"Índice da aba {sheet} ausente, reconstruindo...")
+
+        from gspread.utils import rowcol_to_a1
+
+        columns = []
+        for index in key_indexes:
+            letter = rowcol_to_a1(1, index + 1).rstrip('0123456789')
+            columns.append(f"{letter}:{letter}")
+        column_values = worksheet.batch_get(columns)
+
+        total_rows = max((len(values) for values in column_values), default=0)
+        keyed_rows = []
+        for row_number in range(1, total_rows + 1):
+            values = []
+            for values_by_row in column_values:
+                cell = values_by_row[row_number - 1] if row_number <= len(values_by_row) else []
+                values.append(cell[0] if cell else '')
+            if any(values):
+                keyed_rows.append((make_key(values), row_number))
+
+        self.rebuild(sheet, keyed_rows, total_rows)
+        logger.info(f"Índice da aba {sheet} reconstruído: {len(keyed_rows)} chaves, {total_rows} linhas")
+        return True
+
+    def stats(self):
+        with self._lock, self._connect() as conn:
+            rows = conn.execute("""
+                SELECT s.sheet, s.last_row, s.rebuilt_at, COUNT(k.key)
+                FROM sheet_index_state s LEFT JOIN sheet_keys k ON k.sheet = s.sheet
+                GROUP BY s.sheet
+            """).fetchall()
+        return {sheet: {'last_row': last_row, 'rebuilt_at': rebuilt_at, 'keys': keys}
+                for sheet, last_row, rebuilt_at, keys in rows}
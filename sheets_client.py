@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+"""
+Cache do cliente Google Sheets
+Reaproveita credenciais, token OAuth, planilha e abas entre execuções.
+gspread e google-auth só são importados no primeiro uso (ou no preload do worker).
+"""
+import sys
+import json
+import logging
+import threading
+from datetime import datetime, timedelta
+
+logger = logging.getLogger(__name__)
+
+SCOPES = [
+    "https://www.googleapis.com/auth/spreadsheets",
+    "https://www.googleapis.com/auth/drive"
+]
+
+GOOGLE_MODULES = ('gspread', 'google.oauth2.service_account', 'google.auth.transport.requests')
+
+
+def load_google_libraries():
+    """Importa gspread e google-auth (operação cara, feita uma vez por processo)"""
+    import gspread
+    from google.oauth2.service_account import Credentials
+    from google.auth.transport.requests import Request
+    return gspread, Credentials, Request
+
+
+def google_libraries_loaded():
+    """Indica se as bibliotecas do Google já foram importadas neste processo"""
+    return all(name in sys.modules for name in GOOGLE_MODULES)
+
+
+class SheetsClientCache:
+    """Cliente gspread de longa duração, seguro para uso entre threads
+
+    - O token OAuth é reaproveitado e renovado só quando está perto de expirar
+    - A planilha é resolvida pelo id (sheet_key); sem id, o nome é buscado
+      no Drive uma única vez e o id fica guardado
+    - Os handles das abas ficam em cache
+    - Com shared_state (SharedState), o token e o id da planilha são
+      compartilhados entre workers: só um renova o token por vez e os demais
+      reaproveitam o token gravado
+    """
+
+    def __init__(self, credentials_json, sheet_name, sheet_key=None, refresh_margin=300, shared_state=None):
+        self.credentials_json = credentials_json
+        self.sheet_name = sheet_name
+        self.sheet_key = sheet_key or None
+        self.refresh_margin = timedelta(seconds=refresh_margin)
+        self.shared_state = shared_state
+
+        self._lock = threading.RLock()
+        self._credentials = None
+        self._client = None
+        self._spreadsheet = None
+        self._worksheets = {}
+
+        # Contadores
+        self.authorizations = 0
+        self.token_refreshes = 0
+        self.spreadsheet_lookups = 0
+        self.worksheet_lookups = 0
+        self.shared_token_hits = 0
+
+    def _token_needs_refresh(self):
+        creds = self._credentials
+        if not creds.token or not creds.expiry:
+            return True
+        return creds.expiry - datetime.utcnow() < self.refresh_margin
+
+    def get_client(self):
+        """Retorna o cliente autorizado, renovando o token só perto da expiração"""
+        with self._lock:
+            gspread, Credentials, Request = load_google_libraries()
+            if self._client is None:
+                credentials_dict = json.loads(self.credentials_json)
+                self._credentials = Credentials.from_service_account_info(credentials_dict, scopes=SCOPES)
+                self._client = gspread.authorize(self._credentials)
+                self.authorizations += 1
+                logger.info("Cliente Google Sheets autorizado")
+
+            if self._token_needs_refresh():
+                if self.shared_state is None:
+                    self._refresh_token(Request)
+                elif not self._adopt_shared_token():
+                    # Uma renovação por vez entre os workers; quem esperou usa o token novo
+                    with self.shared_state.lock('google_token'):
+                        if not self._adopt_shared_token():
+                            self._refresh_token(Request)
+
+            return self._client
+
+    def _shared_token_key(self):
+        return f"google_token:{self._credentials.service_account_email}"
+
+    def _refresh_token(self, Request):
+        self._credentials.refresh(Request())
+        self.token_refreshes += 1
+        logger.info(f"Token Google renovado (expira em {self._credentials.expiry})")
+        if self.shared_state is not None and self._credentials.expiry:
+            ttl = (self._credentials.expiry - datetime.utcnow()).total_seconds()
+            try:
+                self.shared_state.set(self._shared_token_key(), {
+                    'token': self._credentials.token,
+                    'expiry': self._credentials.expiry.isoformat()
+                }, ttl=max(1, ttl))
+            except Exception as e:
+                logger.warning(f"Erro ao publicar token Google compartilhado: {str(e)}")
+
+    def _adopt_shared_token(self):
+        """Usa o token renovado por outro worker, se ainda longe da expiração"""
+        try:
+            value = self.shared_state.get(self._shared_token_key())
+        except Exception as e:
+            logger.warning(f"Erro ao ler token Google compartilhado: {str(e)}")
+            return False
+        if not value:
+            return False
+        expiry = datetime.fromisoformat(value['expiry'])
+        if expiry - datetime.utcnow() < self.refresh_margin:
+            return False
+        self._credentials.token = value['token']
+        self._credentials.expiry = expiry
+        self.shared_token_hits += 1
+        return True
+
+    def get_spreadsheet(self):
+        """Retorna a planilha, resolvida pelo id uma única vez"""
+        with self._lock:
+            client = self.get_client()
+            if self._spreadsheet is None:
+                self.spreadsheet_lookups += 1
+                if not self.sheet_key and self.shared_state is not None:
+                    self.sheet_key = self.shared_state.get(f"google_spreadsheet_id:{self.sheet_name}")
+                if self.sheet_key:
+                    self._spreadsheet = client.open_by_key(self.sheet_key)
+                else:
+                    self._spreadsheet = client.open(self.sheet_name)
+                    self.sheet_key = self._spreadsheet.id
+                    logger.info(f"Planilha '{self.sheet_name}' resolvida para o id {self.sheet_key}")
+                    if self.shared_state is not None:
+                        self.shared_state.set(f"google_spreadsheet_id:{self.sheet_name}", self.sheet_key,
+                                              ttl=24 * 3600)
+            return self._spreadsheet
+
+    def get_worksheet(self, worksheet_name, headers=None):
+        """Retorna o handle da aba, mantido em cache
+
+        Com headers, uma aba inexistente é criada com essa linha de cabeçalho;
+        sem headers, WorksheetNotFound é repassado.
+        """
+        with self._lock:
+            spreadsheet = self.get_spreadsheet()
+            worksheet = self._worksheets.get(worksheet_name)
+            if worksheet is None:
+                self.worksheet_lookups += 1
+                gspread = load_google_libraries()[0]
+                try:
+                    worksheet = spreadsheet.worksheet(worksheet_name)
+                except gspread.exceptions.WorksheetNotFound:
+                    if not headers:
+                        raise
+                    worksheet = self._create_worksheet(spreadsheet, worksheet_name, headers)
+                self._worksheets[worksheet_name] = worksheet
+            return worksheet
+
+    def _create_worksheet(self, spreadsheet, worksheet_name, headers):
+        try:
+            worksheet = spreadsheet.add_worksheet(worksheet_name, rows=1000, cols=len(headers))
+        except Exception as e:
+            # Outro worker pode ter criado a aba no meio tempo
+            logger.warning(f"Erro ao criar a aba {worksheet_name} ({str(e)}), buscando de novo...")
+            return spreadsheet.worksheet(worksheet_name)
+        worksheet.append_row(list(headers))
+        logger.info(f"Aba {worksheet_name} criada com {len(headers)} colunas")
+        return worksheet
+
+    def invalidate(self, worksheet_name=None):
+        """Descarta handles em cache (uma aba ou planilha inteira), mantendo as credenciais"""
+        with self._lock:
+            if worksheet_name:
+                self._worksheets.pop(worksheet_name, None)
+            else:
+                self._spreadsheet = None
+                self._worksheets = {}
+
+    def stats(self):
+        """Retrato do cache sem o lock, para não esperar uma renovação de token em andamento"""
+        credentials = self._credentials
+        expiry = credentials.expiry if credentials is not None else None
+        return {
+            'authorized': self._client is not None,
+            'token_expiry': expiry.isoformat() if expiry else None,
+            'spreadsheet_id': self.sheet_key,
+            'cached_worksheets': sorted(list(self._worksheets)),
+            'authorizations': self.authorizations,
+            'token_refreshes': self.token_refreshes,
+            'shared_token_hits': self.shared_token_hits,
+            'spreadsheet_lookups': self.spreadsheet_lookups,
+            'worksheet_lookups': self.worksheet_lookups
+        }
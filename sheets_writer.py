@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+"""
+Escrita em massa no Google Sheets respeitando cotas
+Divide as linhas em blocos limitados, controla o ritmo com token bucket
+e repete erros 429/5xx com backoff exponencial com jitter. O append não é
+idempotente: depois de um timeout de leitura ou 5xx, a aba é conferida antes
+de reenviar o bloco, pelo número de linhas esperado antes dele
+"""
+import re
+import time
+import random
+import logging
+import threading
+
+import requests
+from urllib3.exceptions import NewConnectionError
+
+from metrics import GOOGLE_RESPONSES, SHEETS_WRITE_SECONDS, SHEETS_RETRIES, BYTES_WRITTEN, status_class
+
+logger = logging.getLogger(__name__)
+
+UPDATED_RANGE_PATTERN = re.compile(r'![A-Z]+(\d+)(?::[A-Z]+(\d+))?$')
+
+
+def parse_updated_rows(append_response):
+    """Extrai (linha_inicial, linha_final) do updatedRange retornado pelo append"""
+    try:
+        updated_range = append_response['updates']['updatedRange']
+    except (KeyError, TypeError):
+        return None
+
+    match = UPDATED_RANGE_PATTERN.search(updated_range)
+    if not match:
+        return None
+    start_row = int(match.group(1))
+    end_row = int(match.group(2) or start_row)
+    return (start_row, end_row)
+
+
+def request_not_sent(error):
+    """Indica se o erro de conexão aconteceu antes do envio (conexão recusada, DNS, timeout de conexão)"""
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    reason = getattr(error.args[0], 'reason', None) if error.args else None
+    return isinstance(reason, NewConnectionError)
+
+
+def _normalize_row(row):
+    """Valores da linha como texto, sem células vazias no fim (como a planilha devolve)"""
+    values = []
+    for value in row:
+        if isinstance(value, float) and value.is_integer():
+            value = int(value)
+        values.append('' if value is None else str(value))
+    while values and values[-1] == '':
+        values.pop()
+    return values
+
+
+class TokenBucket:
+    """Token bucket bloqueante: rate tokens por segundo, com rajada de até capacity"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens=1):
+        """Bloqueia até haver tokens disponíveis; retorna o tempo esperado em segundos"""
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return waited
+                wait = (tokens - self._tokens) / self.rate
+            time.sleep(wait)
+            waited += wait
+
+
+class BulkSheetWriter:
+    """Escritor em blocos para o Google Sheets, compartilhado por todas as escritas do processo"""
+
+    def __init__(self, requests_per_minute=60, burst=5, max_rows_per_chunk=5000,
+                 max_chunk_bytes=2 * 1024 * 1024, max_retries=5, base_delay=1.0, max_delay=64.0):
+        self.bucket = TokenBucket(requests_per_minute / 60.0, burst)
+        self.max_rows_per_chunk = max_rows_per_chunk
+        self.max_chunk_bytes = max_chunk_bytes
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+        self._lock = threading.Lock()
+        self.rows_written = 0
+        self.chunks_written = 0
+        self.retries = 0
+        self.throttled_seconds = 0.0
+
+    def iter_chunks(self, rows):
+        """Divide as linhas em blocos limitados por quantidade e tamanho estimado do payload
+
+        Produz pares (bloco, bytes_estimados).
+        """
+        chunk = []
+        chunk_bytes = 0
+        for row in rows:
+            row_bytes = sum(len(str(value)) + 3 for value in row) + 2
+            if chunk and (len(chunk) >= self.max_rows_per_chunk or chunk_bytes + row_bytes > self.max_chunk_bytes):
+                yield chunk, chunk_bytes
+                chunk = []
+                chunk_bytes = 0
+            chunk.append(row)
+            chunk_bytes += row_bytes
+        if chunk:
+            yield chunk, chunk_bytes
+
+    def _backoff(self, attempt, retry_after=None):
+        if retry_after:
+            try:
+                return min(float(retry_after), self.max_delay)
+            except ValueError:
+                pass
+        # Full jitter
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+    def _applied_response(self, worksheet, chunk, base_row):
+        """Confere se um bloco com falha ambígua já está na aba
+
+        base_row é a última linha preenchida antes do envio. O bloco só conta
+        como gravado se a aba cresceu exatamente len(chunk) linhas e a nova
+        última linha é a última do bloco. Retorna uma resposta equivalente à
+        do append se o bloco já foi gravado, ou None se não foi.
+        """
+        last_row = len(worksheet.col_values(1))
+        if last_row != base_row + len(chunk):
+            return None
+        rows = worksheet.get(f"{last_row}:{last_row}", value_render_option='UNFORMATTED_VALUE')
+        if not rows or _normalize_row(rows[0]) != _normalize_row(chunk[-1]):
+            return None
+        title = getattr(worksheet, 'title', '')
+        return {'updates': {'updatedRange': f"'{title}'!A{base_row + 1}:A{last_row}"}}
+
+    def _check_applied(self, worksheet, chunk, base_row, error):
+        """Resposta do bloco se ele já foi gravado; levanta error se não der para conferir"""
+        if base_row is None:
+            logger.error("Número de linhas da aba desconhecido, bloco com falha ambígua não reenviado")
+            raise error
+        try:
+            response = self._applied_response(worksheet, chunk, base_row)
+        except Exception as e:
+            logger.error(f"Não foi possível conferir a aba após falha ambígua ({str(e)}), bloco não reenviado")
+            raise error
+        if response is not None:
+            logger.warning(f"Bloco de {len(chunk)} linhas já estava gravado apesar do erro, não será reenviado")
+        return response
+
+    def _append_with_retry(self, worksheet, chunk, base_row=None):
+        """Envia um bloco; retorna (resposta, novas tentativas usadas)
+
+        429 e falhas de conexão (nada enviado) são repetidos direto. Timeout de
+        leitura, conexão perdida e 5xx podem ter gravado o bloco: antes de
+        reenviar, a aba é conferida contra base_row (última linha preenchida
+        antes do bloco). Sem base_row, a falha ambígua é levantada.
+        """
+        from gspread.exceptions import APIError
+
+        for attempt in range(self.max_retries + 1):
+            waited = self.bucket.acquire()
+            with self._lock:
+                self.throttled_seconds += waited
+            try:
+                response = worksheet.append_rows(chunk)
+                GOOGLE_RESPONSES.inc(status_class='2xx')
+                return response, attempt
+            except APIError as e:
+                status = e.response.status_code if e.response is not None else None
+                GOOGLE_RESPONSES.inc(status_class=status_class(status))
+                if attempt >= self.max_retries or not (status == 429 or (status and status >= 500)):
+                    raise
+                if status != 429:
+                    response = self._check_applied(worksheet, chunk, base_row, e)
+                    if response is not None:
+                        return response, attempt
+                retry_after = e.response.headers.get('Retry-After')
+                wait = self._backoff(attempt, retry_after)
+                logger.warning(f"Google Sheets respondeu {status}, nova tentativa em {wait:.1f}s ({attempt + 1}/{self.max_retries})")
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                GOOGLE_RESPONSES.inc(status_class=status_class(None))
+                if attempt >= self.max_retries:
+                    raise
+                if not request_not_sent(e):
+                    response = self._check_applied(worksheet, chunk, base_row, e)
+                    if response is not None:
+                        return response, attempt
+                wait = self._backoff(attempt)
+                logger.warning(f"Erro de conexão com Google Sheets ({str(e)}), nova tentativa em {wait:.1f}s")
+            with self._lock:
+                self.retries += 1
+            SHEETS_RETRIES.inc()
+            time.sleep(wait)
+
+    def _row_count(self, worksheet):
+        """Última linha preenchida da aba, ou None se a leitura falhar"""
+        try:
+            return len(worksheet.col_values(1))
+        except Exception as e:
+            logger.warning(f"Não foi possível ler o número de linhas da aba ({str(e)})")
+            return None
+
+    def write(self, worksheet, rows):
+        """Escreve as linhas em blocos e retorna um resumo com intervalo escrito e vazão
+
+        Levanta a exceção original se um bloco falhar após todas as tentativas.
+        """
+        started = time.time()
+        start_row = end_row = None
+        written = 0
+        chunks = 0
+        retries = 0
+        base_row = None
+
+        for chunk, chunk_bytes in self.iter_chunks(rows):
+            if chunks == 0:
+                base_row = self._row_count(worksheet)
+            chunk_started = time.time()
+            response, chunk_retries = self._append_with_retry(worksheet, chunk, base_row)
+            SHEETS_WRITE_SECONDS.observe(time.time() - chunk_started)
+            BYTES_WRITTEN.inc(chunk_bytes)
+            retries += chunk_retries
+            written_rows = parse_updated_rows(response)
+            if written_rows:
+                if start_row is None:
+                    start_row = written_rows[0]
+                end_row = written_rows[1]
+                base_row = end_row
+            elif base_row is not None:
+                base_row += len(chunk)
+            written += len(chunk)
+            chunks += 1
+            with self._lock:
+                self.rows_written += len(chunk)
+                self.chunks_written += 1
+
+        elapsed = time.time() - started
+        result = {
+            'start_row': start_row,
+            'end_row': end_row,
+            'rows': written,
+            'chunks': chunks,
+            'retries': retries,
+            'seconds': round(elapsed, 3),
+            'rows_per_second': round(written / elapsed, 1) if elapsed > 0 else None
+        }
+        logger.info(f"Google Sheets: {written} linhas em {chunks} bloco(s), {result['rows_per_second']} linhas/s")
+        return result
+
+    def stats(self):
+        with self._lock:
+            return {
+                'rows_written': self.rows_written,
+                'chunks_written': self.chunks_written,
+                'retries': self.retries,
+                'throttled_seconds': round(self.throttled_seconds, 2)
+            }
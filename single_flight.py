@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+Coalescência de execuções idênticas (single-flight) com cache curto do resultado
+Um disparo igual a uma execução em andamento espera por ela e recebe o mesmo
+resultado; logo após o fim, novos disparos iguais recebem o resultado em cache
+"""
+import json
+import time
+import hashlib
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+SOURCE_EXECUTED = 'executed'
+SOURCE_JOINED = 'joined'
+SOURCE_CACHED = 'cached'
+
+
+class _Call:
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Executa fn uma vez por chave entre disparos simultâneos
+
+    No mesmo processo, quem chega durante a execução espera o resultado do
+    líder. Com shared_state (SharedState), a execução também é serializada
+    entre workers por um lock de arquivo e o resultado fica no estado
+    compartilhado, então o worker que esperava o lock recebe o resultado em
+    vez de repetir o trabalho. Só resultados aprovados por cache_if ficam em
+    cache (por ttl segundos); falhas são repassadas a quem esperava, mas um
+    novo disparo executa de novo.
+    """
+
+    def __init__(self, ttl=120, shared_state=None, cache_if=None, lock_timeout=3600):
+        self.ttl = ttl
+        self.shared_state = shared_state
+        self.cache_if = cache_if or (lambda result: True)
+        self.lock_timeout = lock_timeout
+
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._cache = {}
+
+        # Contadores
+        self.executed = 0
+        self.joined = 0
+        self.cached = 0
+
+    @staticmethod
+    def make_key(*parts):
+        """Chave estável (hash) a partir de partes serializáveis em JSON"""
+        return hashlib.sha1(json.dumps(parts, sort_keys=True, default=str).encode()).hexdigest()[:20]
+
+    def do(self, key, fn):
+        """Retorna (resultado, origem), com origem 'executed', 'joined' ou 'cached'"""
+        with self._lock:
+            cached = self._get_cached(key)
+            if cached is not None:
+                self.cached += 1
+                return cached, SOURCE_CACHED
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            call.event.wait()
+            with self._lock:
+                self.joined += 1
+            if call.error is not None:
+                raise call.error
+            return call.result, SOURCE_JOINED
+
+        try:
+            call.result, source = self._lead(key, fn)
+            return call.result, source
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.event.set()
+
+    def _lead(self, key, fn):
+        if self.shared_state is None:
+            result = fn()
+            self._store(key, result)
+            return result, SOURCE_EXECUTED
+
+        # Entre workers: quem esperava o lock encontra o resultado do outro no estado compartilhado
+        with self.shared_state.lock(f"single_flight_{key}", timeout=self.lock_timeout):
+            cached = self._get_cached(key)
+            if cached is not None:
+                with self._lock:
+                    self.joined += 1
+                return cached, SOURCE_JOINED
+            result = fn()
+            self._store(key, result)
+            return result, SOURCE_EXECUTED
+
+    def _get_cached(self, key):
+        if self.shared_state is not None:
+            try:
+                return self.shared_state.get(f"single_flight:{key}")
+            except Exception as e:
+                logger.warning(f"Erro ao ler resultado em cache: {str(e)}")
+                return None
+        entry = self._cache.get(key)
+        if entry and entry[0] > time.time():
+            return entry[1]
+        self._cache.pop(key, None)
+        return None
+
+    def _store(self, key, result):
+        with self._lock:
+            self.executed += 1
+        if not self.ttl or not self.cache_if(result):
+            return
+        if self.shared_state is not None:
+            try:
+                self.shared_state.set(f"single_flight:{key}", result, ttl=self.ttl)
+            except Exception as e:
+                logger.warning(f"Erro ao gravar resultado em cache: {str(e)}")
+            return
+        with self._lock:
+            now = time.time()
+            self._cache = {k: entry for k, entry in self._cache.items() if entry[0] > now}
+            self._cache[key] = (now + self.ttl, result)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'in_flight': len(self._calls),
+                'executed': self.executed,
+                'joined': self.joined,
+                'cached': self.cached
+            }
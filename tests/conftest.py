@@ -0,0 +1,9 @@
+import os
+import sys
+import tempfile
+
+# Módulos do projeto ficam na raiz do repositório (sem pacote)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Estado (SQLite, cache, locks) em um diretório temporário, nunca no STATE_DIR real
+os.environ['STATE_DIR'] = tempfile.mkdtemp(prefix='testefinal-tests-')
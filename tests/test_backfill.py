@@ -0,0 +1,139 @@
+import os
+import sys
+import threading
+
+import pytest
+
+from backfill import BackfillStore, BackfillRunner, plan_days, BACKFILL_COMPLETED, BACKFILL_FAILED
+
+
+@pytest.fixture
+def store(tmp_path):
+    return BackfillStore(str(tmp_path / 'backfill.db'))
+
+
+def make_runner(store, fetch, write, **kwargs):
+    kwargs.setdefault('retries', 0)
+    return BackfillRunner(store, fetch, lambda module_name, records: [[r] for r in records], write, **kwargs)
+
+
+def test_plan_days():
+    assert plan_days('2025-05-30', '2025-06-01') == ['2025-05-30', '2025-05-31', '2025-06-01']
+    with pytest.raises(ValueError):
+        plan_days('2025-06-01', '2025-05-30')
+
+
+def test_create_reuses_unfinished_backfill(store):
+    backfill_id, created = store.create(['periodo', 'analitico'], '2025-05-01', '2025-05-03', 'upsert')
+    assert created
+    assert store.create(['analitico', 'periodo'], '2025-05-01', '2025-05-03', 'upsert') == (backfill_id, False)
+    assert store.unfinished() == [backfill_id]
+    assert store.progress(backfill_id)['tasks']['total'] == 6
+
+
+def test_runs_every_task_once(store):
+    backfill_id, _ = store.create(['analitico', 'periodo'], '2025-05-01', '2025-05-05', 'upsert')
+    written = []
+    lock = threading.Lock()
+
+    def write(module_name, rows):
+        with lock:
+            written.append((module_name, rows[0][0]))
+        return len(rows)
+
+    progress_calls = []
+    runner = make_runner(store, lambda module_name, day: [day, day], write, fetch_workers=3, write_workers=2,
+                         queue_size=2)
+    summary = runner.run(backfill_id, lambda stage, **counters: progress_calls.append(counters))
+
+    assert summary['status'] == BACKFILL_COMPLETED
+    assert summary['tasks']['done'] == 10
+    assert summary['records_written'] == 20
+    assert sorted(written) == sorted((m, d) for m in ('analitico', 'periodo') for d in plan_days('2025-05-01', '2025-05-05'))
+    assert progress_calls[-1]['tasks_done'] == 10
+    assert store.unfinished() == []
+
+
+def test_resume_reruns_only_failed_tasks(store):
+    backfill_id, _ = store.create(['analitico'], '2025-05-01', '2025-05-04', 'upsert')
+    fetched = []
+
+    def flaky_fetch(module_name, day):
+        fetched.append(day)
+        return None if day == '2025-05-03' else [day]
+
+    def failing_write(module_name, rows):
+        return None if rows[0][0] == '2025-05-02' else len(rows)
+
+    summary = make_runner(store, flaky_fetch, failing_write).run(backfill_id)
+    assert summary['status'] == BACKFILL_FAILED
+    assert summary['tasks']['done'] == 2
+    assert sorted(failure['day'] for failure in summary['failures']) == ['2025-05-02', '2025-05-03']
+    assert store.unfinished() == []
+
+    fetched.clear()
+    summary = make_runner(store, lambda module_name, day: fetched.append(day) or [day],
+                          lambda module_name, rows: len(rows)).run(backfill_id)
+    assert summary['status'] == BACKFILL_COMPLETED
+    assert sorted(fetched) == ['2025-05-02', '2025-05-03']
+
+
+def test_empty_day_counts_as_done_without_write(store):
+    backfill_id, _ = store.create(['analitico'], '2025-05-01', '2025-05-01', 'upsert')
+
+    def write(module_name, rows):
+        raise AssertionError('dia vazio não deve ser gravado')
+
+    summary = make_runner(store, lambda module_name, day: [], write).run(backfill_id)
+    assert summary['status'] == BACKFILL_COMPLETED
+
+
+class FakeJobManager:
+    def __init__(self):
+        self.submitted = []
+
+    def submit(self, kind, fn, params=None, **kwargs):
+        self.submitted.append(params['backfill_id'])
+
+
+@pytest.fixture
+def api(store, monkeypatch):
+    import cloud_api_real
+    store.create(['analitico'], '2025-05-01', '2025-05-02', 'upsert')
+    monkeypatch.setattr(cloud_api_real, 'backfills', store)
+    monkeypatch.setattr(cloud_api_real, 'job_manager', FakeJobManager())
+    monkeypatch.setattr(cloud_api_real, 'BACKFILL_AUTO_RESUME', True)
+    return cloud_api_real
+
+
+def test_resume_with_shared_lock_in_every_worker(api, store):
+    assert api.shared_state is not None
+    assert api.resume_unfinished_backfills(workers=4) == store.unfinished()
+    assert api.job_manager.submitted == store.unfinished()
+
+
+def test_resume_without_shared_lock_only_in_single_process(api, store, monkeypatch):
+    monkeypatch.setattr(api, 'shared_state', None)
+    assert api.resume_unfinished_backfills(workers=4) == []
+    assert api.job_manager.submitted == []
+    assert api.resume_unfinished_backfills() == store.unfinished()
+
+
+def test_gunicorn_resumes_in_configured_app_module(monkeypatch):
+    import types
+    import importlib.util
+
+    resumed = []
+    app_module = types.ModuleType('fake_app')
+    app_module.resume_unfinished_backfills = lambda workers: resumed.append(workers)
+    monkeypatch.setitem(sys.modules, 'fake_app', app_module)
+
+    spec = importlib.util.spec_from_file_location(
+        'gunicorn_conf', os.path.join(os.path.dirname(os.path.dirname(__file__)), 'gunicorn.conf.py')
+    )
+    conf = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(conf)
+    server = types.SimpleNamespace(app=types.SimpleNamespace(app_uri='fake_app:app'),
+                                   cfg=types.SimpleNamespace(wsgi_app=None), num_workers=3)
+    conf._resume_backfills(server, log=None)
+    assert resumed == [3]
@@ -0,0 +1,133 @@
+import time
+
+import pytest
+import requests
+
+from contahub_limiter import ContaHubLimiter, ContaHubUnavailable, CIRCUIT_CLOSED, CIRCUIT_OPEN
+
+
+class FakeResponse:
+    def __init__(self, status_code, data=None):
+        self.status_code = status_code
+        self.headers = {}
+        self._data = data if data is not None else {}
+        self.content = repr(self._data).encode()
+
+    def json(self):
+        return self._data
+
+
+def respond(status_code):
+    return lambda: FakeResponse(status_code)
+
+
+def make_limiter(**kwargs):
+    kwargs.setdefault('failure_threshold', 3)
+    kwargs.setdefault('open_seconds', 300)
+    kwargs.setdefault('fresh_login_window', 60)
+    return ContaHubLimiter(**kwargs)
+
+
+def test_login_403s_open_circuit():
+    limiter = make_limiter()
+    for _ in range(3):
+        limiter.call('login', respond(403))
+    assert limiter.stats()['circuit'] == CIRCUIT_OPEN
+    with pytest.raises(ContaHubUnavailable):
+        limiter.call('login', respond(200))
+
+
+def test_query_403s_from_old_session_do_not_open_circuit():
+    limiter = make_limiter()
+    for _ in range(5):
+        limiter.call('query', respond(403))
+    stats = limiter.stats()
+    assert stats['circuit'] == CIRCUIT_CLOSED
+    assert stats['forbidden'] == 5
+    assert not limiter.is_open()
+
+
+def test_query_403s_right_after_login_open_circuit():
+    limiter = make_limiter()
+    limiter.login_succeeded()
+    for _ in range(3):
+        limiter.call('query', respond(403))
+    assert limiter.is_open()
+
+
+def test_query_403s_after_fresh_login_window_do_not_count():
+    limiter = make_limiter(fresh_login_window=0.05)
+    limiter.login_succeeded()
+    time.sleep(0.1)
+    for _ in range(3):
+        limiter.call('query', respond(403))
+    assert not limiter.is_open()
+
+
+def test_successful_login_resets_403_sequence():
+    limiter = make_limiter()
+    limiter.call('login', respond(403))
+    limiter.call('login', respond(403))
+    limiter.login_succeeded()
+    limiter.call('login', respond(403))
+    assert not limiter.is_open()
+
+
+def test_half_open_probe_ignores_expired_session_403():
+    limiter = make_limiter(open_seconds=0)
+    for _ in range(3):
+        limiter.call('login', respond(403))
+    # Circuito vencido: a próxima chamada é o teste (half-open); 403 de sessão antiga não reabre
+    limiter.call('query', respond(403))
+    assert limiter.stats()['circuit'] != CIRCUIT_OPEN
+    limiter.call('login', respond(200))
+    assert limiter.stats()['circuit'] == CIRCUIT_CLOSED
+
+
+class FakeContaHubSession(requests.Session):
+    """Sessão sem rede: login sempre aceito; as queries da primeira sessão recebem 403 (expirada)"""
+
+    instances = []
+
+    def __init__(self):
+        super().__init__()
+        self.number = len(FakeContaHubSession.instances)
+        FakeContaHubSession.instances.append(self)
+
+    def get(self, url, **kwargs):
+        return FakeResponse(200)
+
+    def post(self, url, json=None, **kwargs):
+        if 'login' in url:
+            return FakeResponse(200, {'success': True})
+        if self.number == 0:
+            return FakeResponse(403)
+        day = json['query'].split("BETWEEN '")[1][:10]
+        return FakeResponse(200, {'success': True, 'data': [{'vd_dtgerencial': day, 'vd': 1, 'itm': 1}]})
+
+
+def test_expired_session_403_invalidates_and_relogins(monkeypatch):
+    import pipeline
+    import cloud_api_real
+
+    FakeContaHubSession.instances = []
+    monkeypatch.setattr(cloud_api_real.requests, 'Session', FakeContaHubSession)
+    monkeypatch.setattr(cloud_api_real.time, 'sleep', lambda seconds: None)
+    limiter = ContaHubLimiter(failure_threshold=3, open_seconds=300)
+    monkeypatch.setattr(cloud_api_real, 'contahub_limiter', limiter)
+    monkeypatch.setattr(pipeline, 'contahub_limiter', limiter)
+    sessions = cloud_api_real.ContaHubSessionManager([cloud_api_real.login_contahub], max_age=3600, max_idle=900)
+    monkeypatch.setattr(cloud_api_real, 'contahub_sessions', sessions)
+    monkeypatch.setattr(pipeline, 'contahub_sessions', sessions)
+
+    # Sessão obtida há mais tempo que a janela de login recente: um 403 agora é sessão expirada
+    assert sessions.get_session() is FakeContaHubSession.instances[0]
+    limiter._last_login_at -= limiter.fresh_login_window + 1
+
+    records = cloud_api_real.fetch_with_session('analitico', '2025-05-22', '2025-05-24')
+
+    assert [record['vd_dtgerencial'] for record in records] == ['2025-05-22', '2025-05-23', '2025-05-24']
+    assert sessions.invalidations == 1
+    assert sessions.relogins == 1
+    assert limiter.stats()['circuit'] == CIRCUIT_CLOSED
+    assert limiter.stats()['forbidden'] == 3
@@ -0,0 +1,46 @@
+from pipeline import sql_literal, keyset_condition, build_contahub_query
+
+
+def test_sql_literal():
+    assert sql_literal(10) == '10'
+    assert sql_literal(1.5) == '1.5'
+    assert sql_literal("d'água") == "'d''água'"
+    assert sql_literal(None) == "''"
+    assert sql_literal(True) == "'True'"
+
+
+def test_keyset_condition_expands_tuple_comparison():
+    condition = keyset_condition(('vd_dtgerencial', 'vd', 'itm'), ('2025-05-22', '10', 3))
+    assert condition == (
+        "((v.vd_dtgerencial > '2025-05-22') OR "
+        "(v.vd_dtgerencial = '2025-05-22' AND v.vd > '10') OR "
+        "(v.vd_dtgerencial = '2025-05-22' AND v.vd = '10' AND v.itm > 3))"
+    )
+
+
+def normalize(sql):
+    return ' '.join(sql.split())
+
+
+def test_build_contahub_query_period():
+    sql = normalize(build_contahub_query('analitico', '2025-05-22', '2025-05-27'))
+    assert "WHERE v.vd_dtgerencial BETWEEN '2025-05-22' AND '2025-05-27'" in sql
+    assert sql.endswith('ORDER BY v.vd_dtgerencial, v.vd, v.itm')
+    assert 'LIMIT' not in sql and 'GROUP BY' not in sql
+
+
+def test_build_contahub_query_keyset_page():
+    sql = normalize(build_contahub_query('analitico', '2025-05-22', '2025-05-27',
+                                         after=('2025-05-23', '99', 1), limit=500))
+    assert "AND ((v.vd_dtgerencial > '2025-05-23') OR" in sql
+    assert sql.endswith('ORDER BY v.vd_dtgerencial, v.vd, v.itm LIMIT 500')
+
+
+def test_build_contahub_query_aggregate_module():
+    sql = normalize(build_contahub_query('analitico_diario', '2025-05-22', '2025-05-22'))
+    assert 'SUM(v.valorfinal) AS valorfinal' in sql
+    assert 'GROUP BY v.vd_dtgerencial, v.grp_desc, v.loc_desc, v.tipovenda' in sql
+
+
+def test_build_contahub_query_unknown_module():
+    assert build_contahub_query('inexistente', '2025-05-22', '2025-05-22') is None
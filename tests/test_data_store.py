@@ -0,0 +1,123 @@
+import csv
+import io
+import json
+
+import pytest
+
+import cloud_api_real
+from data_store import DataStore, iter_csv, iter_ndjson
+
+HEADERS = {'Authorization': f'Bearer {cloud_api_real.API_KEY}'}
+
+
+def analitico(day, vd, itm, prd, valor):
+    return {'vd_dtgerencial': f'{day}T00:00:00', 'vd': vd, 'itm': itm, 'prd': prd,
+            'grp_desc': 'Bebidas' if prd.startswith('B') else 'Pratos', 'valorfinal': valor}
+
+
+RECORDS = [
+    analitico('2025-05-22', '10', '1', 'B1', 10.0),
+    analitico('2025-05-22', '10', '2', 'P1', 35.5),
+    analitico('2025-05-23', '11', '1', 'B1', 10.0),
+    analitico('2025-05-24', '12', '1', 'P2', 42.0),
+]
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = DataStore(str(tmp_path / 'data.db'))
+    store.upsert('analitico', RECORDS)
+    store.upsert('periodo', [{'dt_gerencial': '2025-05-22', 'vd': '10', 'vr_produtos': 45.5}])
+    return store
+
+
+def rows(store, *args, **kwargs):
+    return [row for batch in store.query(*args, **kwargs) for row in batch]
+
+
+def test_query_orders_by_key_and_filters_period(store):
+    assert rows(store, 'analitico', '2025-05-22', '2025-05-23', ['vd_dtgerencial', 'vd', 'itm']) == [
+        ('2025-05-22', '10', '1'), ('2025-05-22', '10', '2'), ('2025-05-23', '11', '1')
+    ]
+
+
+def test_query_filters_and_limit(store):
+    assert rows(store, 'analitico', columns=['vd', 'prd'], filters={'prd': 'B1'}) == [('10', 'B1'), ('11', 'B1')]
+    assert rows(store, 'analitico', columns=['vd'], filters={'grp_desc': 'Pratos'}, limit=1) == [('10',)]
+    assert rows(store, 'analitico', columns=['vd'], limit=0) == []
+
+
+def test_query_batches(store):
+    batches = list(store.query('analitico', columns=['vd'], batch_size=3))
+    assert [len(batch) for batch in batches] == [3, 1]
+
+
+def test_replace_period_removes_deleted_records(store):
+    store.replace_period('analitico', '2025-05-22', '2025-05-22', [analitico('2025-05-22', '10', '1', 'B1', 12.0)])
+    assert rows(store, 'analitico', columns=['vd', 'itm', 'valorfinal']) == [
+        ('10', '1', 12.0), ('11', '1', 10.0), ('12', '1', 42.0)
+    ]
+
+
+def test_iter_csv_and_ndjson():
+    batches = [[('10', 1.5)], [('11', None)]]
+    assert ''.join(iter_csv(['vd', 'valor'], batches)) == 'vd,valor\r\n10,1.5\r\n11,\r\n'
+    assert ''.join(iter_ndjson(['vd', 'valor'], batches)) == '{"vd": "10", "valor": 1.5}\n{"vd": "11", "valor": null}\n'
+
+
+@pytest.fixture
+def client(store, monkeypatch):
+    monkeypatch.setattr(cloud_api_real, 'data_store', store)
+    return cloud_api_real.app.test_client()
+
+
+def get(client, path):
+    return client.get(path, headers=HEADERS)
+
+
+def test_export_csv_with_projection_filter_and_limit(client):
+    response = get(client, '/data/analitico?columns=vd,prd,valorfinal&prd=B1&limit=1')
+    assert response.status_code == 200
+    assert response.content_type.startswith('text/csv')
+    assert list(csv.reader(io.StringIO(response.get_data(as_text=True)))) == [
+        ['vd', 'prd', 'valorfinal'], ['10', 'B1', '10.0']
+    ]
+
+
+def test_export_ndjson_with_period(client):
+    response = get(client, '/data/analitico?format=ndjson&columns=vd,itm&start_date=2025-05-23')
+    assert response.status_code == 200
+    assert response.content_type == 'application/x-ndjson'
+    lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert lines == [{'vd': '11', 'itm': '1'}, {'vd': '12', 'itm': '1'}]
+
+
+def test_export_parquet(client):
+    pq = pytest.importorskip('pyarrow.parquet')
+    response = get(client, '/data/analitico?format=parquet&columns=vd,valorfinal&grp_desc=Pratos')
+    assert response.status_code == 200
+    table = pq.read_table(io.BytesIO(response.get_data()))
+    assert table.to_pydict() == {'vd': ['10', '12'], 'valorfinal': [35.5, 42.0]}
+
+
+def test_export_parquet_without_pyarrow(client, monkeypatch):
+    monkeypatch.setattr(cloud_api_real, 'parquet_available', lambda: False)
+    assert get(client, '/data/analitico?format=parquet').status_code == 501
+
+
+@pytest.mark.parametrize('query', [
+    'periodo?prd=XYZ',
+    'analitico?columns=vd,inexistente',
+    'analitico?limit=abc',
+    'analitico?limit=-1',
+    'analitico?format=xlsx',
+    'analitico?start_date=22/05/2025',
+])
+def test_invalid_requests_answer_400(client, query):
+    response = get(client, f'/data/{query}')
+    assert response.status_code == 400
+    assert response.get_json()['status'] == 'error'
+
+
+def test_unknown_module_answers_404(client):
+    assert get(client, '/data/analitico_diario').status_code == 404
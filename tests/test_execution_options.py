@@ -0,0 +1,66 @@
+import pytest
+
+import cloud_api_real
+from cloud_api_real import resolve_write_mode, get_execution_options
+
+HEADERS = {'Authorization': f'Bearer {cloud_api_real.API_KEY}'}
+
+
+def test_incremental_defaults_to_upsert(monkeypatch):
+    monkeypatch.setattr(cloud_api_real, 'WRITE_MODE', 'append')
+    assert resolve_write_mode('incremental') == 'upsert'
+    assert resolve_write_mode('incremental', 'upsert') == 'upsert'
+    assert resolve_write_mode('fixed') == 'append'
+    assert resolve_write_mode('fixed', 'upsert') == 'upsert'
+
+
+def test_incremental_with_explicit_append_is_rejected():
+    with pytest.raises(ValueError, match='upsert'):
+        resolve_write_mode('incremental', 'append')
+    with pytest.raises(ValueError):
+        get_execution_options({'mode': 'incremental', 'write_mode': 'append'})
+    result = cloud_api_real.execute_testefinal_real(mode='incremental', write_mode='append')
+    assert result['success'] is False and 'upsert' in result['error']
+
+
+def test_endpoint_answers_400_before_running(monkeypatch):
+    monkeypatch.setattr(cloud_api_real, 'execute_testefinal_real', lambda **options: pytest.fail('não deve executar'))
+    client = cloud_api_real.app.test_client()
+    response = client.post('/execute-testefinal', json={'mode': 'incremental', 'write_mode': 'append'},
+                           headers=HEADERS)
+    assert response.status_code == 400
+    assert 'upsert' in response.get_json()['error']
+
+
+@pytest.mark.parametrize('payload', [
+    {'mode': 'bogus'},
+    {'write_mode': 'bogus'},
+    {'lookback_days': None},
+    {'lookback_days': -1},
+    {'lookback_days': 1.5},
+    {'lookback_days': 'abc'},
+    {'lookback_days': True},
+])
+def test_invalid_options_are_rejected(payload):
+    with pytest.raises(ValueError):
+        get_execution_options(payload)
+
+
+def test_valid_options_are_parsed():
+    options = get_execution_options({'mode': 'fixed', 'write_mode': 'upsert', 'lookback_days': '3'})
+    assert options == {'mode': 'fixed', 'write_mode': 'upsert', 'lookback_days': 3}
+    assert get_execution_options({'lookback_days': 0}) == {'lookback_days': 0}
+
+
+@pytest.mark.parametrize('payload', [
+    {'write_mode': 'bogus'},
+    {'write_mode': 'bogus', 'async': True},
+    {'mode': 'bogus'},
+    {'lookback_days': None},
+])
+def test_endpoint_rejects_invalid_options_before_running(monkeypatch, payload):
+    monkeypatch.setattr(cloud_api_real, 'execute_testefinal_real', lambda **options: pytest.fail('não deve executar'))
+    monkeypatch.setattr(cloud_api_real, 'submit_testefinal_job', lambda options: pytest.fail('não deve agendar'))
+    client = cloud_api_real.app.test_client()
+    response = client.post('/execute-testefinal', json=payload, headers=HEADERS)
+    assert response.status_code == 400
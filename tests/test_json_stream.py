@@ -0,0 +1,65 @@
+import json
+
+import pytest
+
+from json_stream import JSONArrayStream, iter_batches
+
+BODY = json.dumps({
+    'success': True,
+    'data': [
+        {'vd': '123', 'valor': 1500.25, 'qtd': -2, 'fator': 1.5e-3, 'obs': 'pão de queijo', 'ok': False},
+        1500.25,
+        -17,
+        2.5E+10,
+        None,
+        'texto "com aspas" e \\u00e7'
+    ],
+    'message': 'fim'
+}, ensure_ascii=False).encode('utf-8')
+
+
+def split(body, *positions):
+    bounds = (0,) + positions + (len(body),)
+    return [body[start:end] for start, end in zip(bounds, bounds[1:])]
+
+
+@pytest.mark.parametrize('position', range(1, len(BODY)))
+def test_any_single_split_decodes_like_json_loads(position):
+    stream = JSONArrayStream(split(BODY, position))
+    assert list(stream) == json.loads(BODY)['data']
+    assert stream.meta == {'success': True, 'message': 'fim'}
+    assert stream.count == 6
+
+
+def test_byte_by_byte_chunks():
+    chunks = [BODY[i:i + 1] for i in range(len(BODY))]
+    assert list(JSONArrayStream(chunks)) == json.loads(BODY)['data']
+
+
+@pytest.mark.parametrize('chunks, expected', [
+    ([b'{"data":[1500.', b'25]}'], [1500.25]),
+    ([b'{"data":[1500', b'.25]}'], [1500.25]),
+    ([b'{"data":[1.5e', b'3]}'], [1500.0]),
+    ([b'{"data":[1.5e', b'+', b'3,2]}'], [1500.0, 2]),
+    ([b'{"data":[-', b'7]}'], [-7]),
+    ([b'{"data":[12', b'', b'34]}'], [1234]),
+])
+def test_number_split_at_chunk_boundary(chunks, expected):
+    assert list(JSONArrayStream(chunks)) == expected
+
+
+def test_missing_array_and_meta_only():
+    stream = JSONArrayStream([b'{"success": false, "message": "sess\xc3\xa3o expirada"}'])
+    assert list(stream) == []
+    assert stream.found_array is False
+    assert stream.meta == {'success': False, 'message': 'sessão expirada'}
+
+
+def test_truncated_body_raises():
+    with pytest.raises(ValueError):
+        list(JSONArrayStream([b'{"data":[{"vd":1},']))
+
+
+def test_iter_batches():
+    assert list(iter_batches(range(5), 2)) == [[0, 1], [2, 3], [4]]
+    assert list(iter_batches([], 3)) == []
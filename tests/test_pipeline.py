@@ -0,0 +1,53 @@
+import os
+import sys
+import subprocess
+
+import pytest
+
+import pipeline
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_import_has_no_side_effects(tmp_path):
+    code = (
+        "import sys, threading, logging, pipeline; "
+        "assert 'cloud_api_real' not in sys.modules, 'importou a API'; "
+        "assert threading.active_count() == 1, 'iniciou threads'; "
+        "assert not logging.getLogger().handlers, 'instalou handlers de log'"
+    )
+    env = dict(os.environ, STATE_DIR=str(tmp_path / 'state'))
+    subprocess.run([sys.executable, '-c', code], cwd=ROOT, env=env, check=True)
+    assert not os.path.exists(tmp_path / 'state')
+
+
+def test_configure_rejects_unknown_objects():
+    with pytest.raises(TypeError):
+        pipeline.configure(data_store=object())
+
+
+def test_incremental_period_requires_watermarks(monkeypatch):
+    monkeypatch.setattr(pipeline, 'watermarks', None)
+    assert pipeline.resolve_period('analitico', 'fixed') == (
+        pipeline.DEFAULT_FIXED_START_DATE, pipeline.DEFAULT_FIXED_END_DATE
+    )
+    with pytest.raises(ValueError, match="marcas d'água"):
+        pipeline.resolve_period('analitico', 'incremental')
+
+
+def test_upsert_requires_sheet_index(monkeypatch):
+    monkeypatch.setattr(pipeline, 'sheet_index', None)
+    assert pipeline.write_to_google_sheets('analitico', [['x']], 'upsert') is None
+
+
+def test_rejected_session_without_session_manager(monkeypatch):
+    class RejectingSession:
+        def post(self, url, **kwargs):
+            class Response:
+                status_code = 403
+            return Response()
+
+    monkeypatch.setattr(pipeline, 'contahub_sessions', None)
+    monkeypatch.setattr(pipeline.time, 'sleep', lambda seconds: None)
+    assert pipeline.fetch_data_contahub_partitioned(RejectingSession(), 'analitico', '2025-05-22', '2025-05-22',
+                                                    retries=0) is None
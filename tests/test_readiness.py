@@ -0,0 +1,55 @@
+import time
+import threading
+
+from contahub_session import ContaHubSessionManager
+from sheets_client import SheetsClientCache
+
+
+class FakeSession:
+    def close(self):
+        pass
+
+
+def test_session_stats_do_not_wait_for_login():
+    release = threading.Event()
+
+    def slow_login():
+        release.wait(5)
+        return FakeSession()
+
+    sessions = ContaHubSessionManager([slow_login])
+    worker = threading.Thread(target=sessions.get_session)
+    worker.start()
+    try:
+        time.sleep(0.05)
+        started = time.time()
+        stats = sessions.stats()
+        assert time.time() - started < 0.5
+        assert stats['session_active'] is False
+    finally:
+        release.set()
+        worker.join()
+    assert sessions.stats()['session_active'] is True
+
+
+def test_sheets_stats_do_not_wait_for_token_refresh():
+    cache = SheetsClientCache('{}', 'planilha')
+    acquired = threading.Event()
+    release = threading.Event()
+
+    def refreshing():
+        with cache._lock:
+            acquired.set()
+            release.wait(5)
+
+    worker = threading.Thread(target=refreshing)
+    worker.start()
+    try:
+        acquired.wait(1)
+        started = time.time()
+        stats = cache.stats()
+        assert time.time() - started < 0.5
+        assert stats['authorized'] is False
+    finally:
+        release.set()
+        worker.join()
@@ -0,0 +1,73 @@
+import pytest
+
+from sheet_index import SheetKeyIndex, make_key
+
+
+class FakeWorksheet:
+    def __init__(self, rows):
+        self.rows = rows
+        self.get_calls = []
+        self.batch_get_calls = 0
+
+    def get(self, range_name):
+        self.get_calls.append(range_name)
+        first, last = (int(part) for part in range_name.split(':'))
+        return [row for row in self.rows[first - 1:last] if row]
+
+    def batch_get(self, ranges):
+        self.batch_get_calls += 1
+        columns = []
+        for range_name in ranges:
+            index = ord(range_name[0]) - ord('A')
+            columns.append([[row[index]] if len(row) > index and row[index] != '' else [] for row in self.rows])
+        return columns
+
+
+@pytest.fixture
+def index(tmp_path):
+    return SheetKeyIndex(str(tmp_path / 'sheet_index.db'))
+
+
+ROWS = [['vd', 'itm', 'valor'], ['1', '1', '10'], ['1', '2', '20'], ['2', '1', '30']]
+
+
+def test_absent_index_is_rebuilt_from_key_columns(index):
+    worksheet = FakeWorksheet([list(row) for row in ROWS])
+    assert index.ensure_fresh('s:analitico', worksheet, [0, 1]) is True
+    assert worksheet.batch_get_calls == 1
+    assert index.last_row('s:analitico') == 4
+    keys = [make_key(['1', '1']), make_key(['2', '1']), make_key(['9', '9'])]
+    assert index.existing_keys('s:analitico', keys) == set(keys[:2])
+
+
+def test_fresh_index_reads_only_boundary_rows(index):
+    worksheet = FakeWorksheet([list(row) for row in ROWS])
+    index.ensure_fresh('s:analitico', worksheet, [0, 1])
+    assert index.ensure_fresh('s:analitico', worksheet, [0, 1]) is False
+    assert worksheet.get_calls == ['4:5']
+    assert worksheet.batch_get_calls == 1
+
+
+def test_rows_written_outside_upsert_trigger_rebuild(index):
+    worksheet = FakeWorksheet([list(row) for row in ROWS])
+    index.ensure_fresh('s:analitico', worksheet, [0, 1])
+    worksheet.rows.append(['3', '1', '40'])
+    assert index.ensure_fresh('s:analitico', worksheet, [0, 1]) is True
+    assert index.last_row('s:analitico') == 5
+    assert index.existing_keys('s:analitico', [make_key(['3', '1'])]) == {make_key(['3', '1'])}
+
+
+def test_deleted_rows_trigger_rebuild(index):
+    worksheet = FakeWorksheet([list(row) for row in ROWS])
+    index.ensure_fresh('s:analitico', worksheet, [0, 1])
+    worksheet.rows.pop()
+    assert index.ensure_fresh('s:analitico', worksheet, [0, 1]) is True
+    assert index.last_row('s:analitico') == 3
+    assert index.existing_keys('s:analitico', [make_key(['2', '1'])]) == set()
+
+
+def test_add_keeps_highest_last_row(index):
+    index.add('s:periodo', [(make_key(['1']), 2)], 2)
+    index.add('s:periodo', [(make_key(['2']), 3)], 3)
+    index.add('s:periodo', [], 1)
+    assert index.last_row('s:periodo') == 3
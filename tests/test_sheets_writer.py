@@ -0,0 +1,132 @@
+import json
+
+import pytest
+import requests
+from gspread.exceptions import APIError
+from urllib3.exceptions import MaxRetryError, NewConnectionError
+
+from sheets_writer import BulkSheetWriter, parse_updated_rows
+
+
+def api_error(status):
+    response = requests.Response()
+    response.status_code = status
+    response._content = json.dumps({'error': {'code': status, 'message': 'erro', 'status': 'UNAVAILABLE'}}).encode()
+    return APIError(response)
+
+
+class FlakyWorksheet:
+    """Aba em memória; failures: lista de (exceção, aplicar_antes_de_falhar) para os próximos appends"""
+
+    title = 'analitico'
+
+    def __init__(self, failures):
+        self.rows = [['vd', 'itm', 'valor']]
+        self.failures = list(failures)
+        self.appends = 0
+
+    def append_rows(self, values):
+        self.appends += 1
+        if self.failures:
+            error, applied = self.failures.pop(0)
+            if applied:
+                self.rows.extend(values)
+            raise error
+        start = len(self.rows) + 1
+        self.rows.extend(values)
+        return {'updates': {'updatedRange': f"{self.title}!A{start}:C{len(self.rows)}"}}
+
+    def col_values(self, col):
+        return [row[col - 1] for row in self.rows]
+
+    def get(self, range_name, value_render_option=None):
+        row = int(range_name.split(':')[0])
+        return [self.rows[row - 1]] if row <= len(self.rows) else []
+
+
+CHUNK = [[1, 1, 10.0], [1, 2, 20.5]]
+
+
+def make_writer():
+    return BulkSheetWriter(requests_per_minute=6000, burst=100, max_retries=3, base_delay=0, max_delay=0)
+
+
+@pytest.mark.parametrize('error', [requests.exceptions.ReadTimeout('timeout'), api_error(503)])
+def test_ambiguous_failure_after_write_is_not_resent(error):
+    worksheet = FlakyWorksheet([(error, True)])
+    response, retries = make_writer()._append_with_retry(worksheet, CHUNK, 1)
+    assert worksheet.appends == 1
+    assert len(worksheet.rows) == 3
+    assert parse_updated_rows(response) == (2, 3)
+    assert retries == 0
+
+
+@pytest.mark.parametrize('error', [requests.exceptions.ReadTimeout('timeout'), api_error(500)])
+def test_ambiguous_failure_before_write_is_resent(error):
+    worksheet = FlakyWorksheet([(error, False)])
+    response, retries = make_writer()._append_with_retry(worksheet, CHUNK, 1)
+    assert worksheet.appends == 2
+    assert len(worksheet.rows) == 3
+    assert parse_updated_rows(response) == (2, 3)
+    assert retries == 1
+
+
+def test_rate_limit_and_connect_errors_are_resent_without_check():
+    unsent = requests.exceptions.ConnectionError(
+        MaxRetryError(None, '/', reason=NewConnectionError(None, 'recusada'))
+    )
+    worksheet = FlakyWorksheet([(api_error(429), False), (unsent, False)])
+    worksheet.col_values = None  # qualquer conferência quebraria o teste
+    response, retries = make_writer()._append_with_retry(worksheet, CHUNK, 1)
+    assert worksheet.appends == 3
+    assert retries == 2
+    assert len(worksheet.rows) == 3
+
+
+def test_identical_last_row_from_earlier_write_is_resent():
+    worksheet = FlakyWorksheet([(requests.exceptions.ReadTimeout('timeout'), False)])
+    worksheet.rows.extend(CHUNK)
+    response, retries = make_writer()._append_with_retry(worksheet, CHUNK, 3)
+    assert worksheet.appends == 2
+    assert len(worksheet.rows) == 5
+    assert parse_updated_rows(response) == (4, 5)
+
+
+def test_write_tracks_expected_rows_across_chunks():
+    worksheet = FlakyWorksheet([])
+    worksheet.rows.extend(CHUNK)
+    append_rows = worksheet.append_rows
+    calls = []
+
+    def fail_second_after_write(values):
+        calls.append(values)
+        if len(calls) == 2:
+            worksheet.rows.extend(values)
+            raise api_error(503)
+        return append_rows(values)
+
+    worksheet.append_rows = fail_second_after_write
+    writer = make_writer()
+    writer.max_rows_per_chunk = 1
+    result = writer.write(worksheet, CHUNK)
+    assert len(worksheet.rows) == 5
+    assert (result['start_row'], result['end_row'], result['retries']) == (4, 5, 0)
+
+
+def test_unknown_row_count_does_not_resend():
+    worksheet = FlakyWorksheet([(api_error(503), False)])
+    with pytest.raises(APIError):
+        make_writer()._append_with_retry(worksheet, CHUNK)
+    assert worksheet.appends == 1
+
+
+def test_failed_check_does_not_resend():
+    worksheet = FlakyWorksheet([(requests.exceptions.ReadTimeout('timeout'), False)])
+
+    def broken(col):
+        raise requests.exceptions.ConnectionError('sem rede')
+
+    worksheet.col_values = broken
+    with pytest.raises(requests.exceptions.ReadTimeout):
+        make_writer()._append_with_retry(worksheet, CHUNK, 1)
+    assert worksheet.appends == 1
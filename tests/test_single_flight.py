@@ -0,0 +1,93 @@
+import time
+import threading
+
+import pytest
+
+from shared_state import SharedState
+from single_flight import SingleFlight, SOURCE_EXECUTED, SOURCE_JOINED, SOURCE_CACHED
+
+
+def run_concurrently(count, target):
+    results = [None] * count
+    threads = [threading.Thread(target=lambda i=i: results.__setitem__(i, target())) for i in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def slow_call(calls, result, delay=0.2):
+    def fn():
+        calls.append(1)
+        time.sleep(delay)
+        return result
+    return fn
+
+
+def test_concurrent_calls_execute_once():
+    flight = SingleFlight(ttl=0)
+    calls = []
+    results = run_concurrently(5, lambda: flight.do('k', slow_call(calls, {'success': True})))
+    assert len(calls) == 1
+    assert sorted(source for _, source in results) == [SOURCE_EXECUTED] + [SOURCE_JOINED] * 4
+    assert all(result == {'success': True} for result, _ in results)
+
+
+def test_result_cached_only_if_approved():
+    flight = SingleFlight(ttl=60, cache_if=lambda result: result['success'])
+    assert flight.do('ok', lambda: {'success': True}) == ({'success': True}, SOURCE_EXECUTED)
+    assert flight.do('ok', lambda: {'success': False}) == ({'success': True}, SOURCE_CACHED)
+
+    flight.do('falha', lambda: {'success': False})
+    assert flight.do('falha', lambda: {'success': True}) == ({'success': True}, SOURCE_EXECUTED)
+
+
+def test_error_reaches_joiners_and_is_not_cached():
+    flight = SingleFlight(ttl=60)
+    started = threading.Event()
+
+    def failing():
+        started.set()
+        time.sleep(0.2)
+        raise RuntimeError('falhou')
+
+    errors = []
+
+    def call(fn):
+        try:
+            flight.do('k', fn)
+        except RuntimeError as e:
+            errors.append(str(e))
+
+    leader = threading.Thread(target=call, args=(failing,))
+    leader.start()
+    started.wait(1)
+    call(lambda: 'não executa')
+    leader.join()
+    assert errors == ['falhou', 'falhou']
+    assert flight.do('k', lambda: 'ok') == ('ok', SOURCE_EXECUTED)
+
+
+def test_workers_share_result_through_shared_state(tmp_path):
+    state = SharedState(str(tmp_path / 'shared_state.db'))
+    # Duas instâncias com o mesmo estado compartilhado fazem o papel de dois workers
+    first, second = SingleFlight(ttl=60, shared_state=state), SingleFlight(ttl=60, shared_state=state)
+    calls = []
+    results = []
+    threads = [
+        threading.Thread(target=lambda flight=flight: results.append(flight.do('k', slow_call(calls, 'r'))))
+        for flight in (first, second)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(calls) == 1
+    assert sorted(source for _, source in results) == [SOURCE_EXECUTED, SOURCE_JOINED]
+
+
+@pytest.mark.parametrize('parts', [(['analitico'], 'fixed'), ({'b': 1, 'a': 2},)])
+def test_make_key_is_stable(parts):
+    assert SingleFlight.make_key(*parts) == SingleFlight.make_key(*parts)
+    assert len(SingleFlight.make_key(*parts)) == 20
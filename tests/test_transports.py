@@ -0,0 +1,151 @@
+import time
+import threading
+
+import pytest
+
+from transports import Transport, HedgedSession, TransportError
+
+
+class FakeResponse:
+    def __init__(self, status_code, body):
+        self.status_code = status_code
+        self.body = body
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class FakeSession:
+    """Sessão cujo post() espera delay segundos e responde status (ou levanta error)"""
+
+    def __init__(self, name, delay=0.0, status=200, error=None):
+        self.name = name
+        self.delay = delay
+        self.status = status
+        self.error = error
+        self.posts = 0
+
+    def post(self, url, **kwargs):
+        self.posts += 1
+        time.sleep(self.delay)
+        if self.error:
+            raise self.error
+        return FakeResponse(self.status, self.name)
+
+    def close(self):
+        pass
+
+
+def make_transport(name, session, login_delay=0.0):
+    logins = []
+
+    def login():
+        logins.append(1)
+        time.sleep(login_delay)
+        return session
+
+    transport = Transport(name, login)
+    transport.logins = logins
+    return transport
+
+
+def make_hedged(*transports):
+    return HedgedSession(transports, percentile=0.9, min_delay=0.05, max_delay=1.0)
+
+
+def warm_up(transport, seconds, samples=5):
+    for _ in range(samples):
+        transport.query_latency.record(seconds)
+
+
+def test_query_not_hedged_without_samples():
+    proxy = make_transport('proxy', FakeSession('proxy', delay=0.3))
+    direct = make_transport('direct', FakeSession('direct'))
+    hedged = make_hedged(proxy, direct)
+    assert hedged.post('https://api/query').body == 'proxy'
+    assert hedged.hedges == 0
+    assert direct.logins == []
+
+
+def test_slow_primary_is_hedged_once_latency_is_known():
+    proxy = make_transport('proxy', FakeSession('proxy', delay=0.5))
+    direct = make_transport('direct', FakeSession('direct'))
+    warm_up(proxy, 0.01)
+    hedged = make_hedged(proxy, direct)
+    started = time.time()
+    response = hedged.post('https://api/query')
+    assert response.body == 'direct'
+    assert time.time() - started < 0.4
+    assert hedged.hedges == 1
+    assert hedged.wins == {'proxy': 0, 'direct': 1}
+
+
+def test_loser_response_is_closed():
+    proxy_session = FakeSession('proxy', delay=0.2)
+    proxy = make_transport('proxy', proxy_session)
+    warm_up(proxy, 0.01)
+    hedged = make_hedged(proxy, make_transport('direct', FakeSession('direct')))
+    closed = threading.Event()
+    original = proxy_session.post
+
+    def post(url, **kwargs):
+        response = original(url, **kwargs)
+        response.close = closed.set
+        return response
+
+    proxy_session.post = post
+    assert hedged.post('https://api/query').body == 'direct'
+    assert closed.wait(1)
+
+
+def test_failure_falls_over_without_waiting():
+    proxy = make_transport('proxy', FakeSession('proxy', error=ConnectionError('recusada')))
+    direct = make_transport('direct', FakeSession('direct'))
+    hedged = make_hedged(proxy, direct)
+    assert hedged.post('https://api/query').body == 'direct'
+    assert hedged.hedges == 0
+    assert proxy.failures == 1
+
+
+def test_both_failing():
+    hedged = make_hedged(
+        make_transport('proxy', FakeSession('proxy', error=ConnectionError('recusada'))),
+        make_transport('direct', FakeSession('direct', error=ConnectionError('recusada')))
+    )
+    with pytest.raises(TransportError):
+        hedged.post('https://api/query')
+
+
+def test_both_answering_errors_returns_last_response():
+    hedged = make_hedged(
+        make_transport('proxy', FakeSession('proxy', status=500)),
+        make_transport('direct', FakeSession('direct', status=502))
+    )
+    response = hedged.post('https://api/query')
+    assert response.status_code == 502
+
+
+def test_login_falls_back_when_primary_login_fails():
+    proxy = make_transport('proxy', None)
+    direct = make_transport('direct', FakeSession('direct'))
+    hedged = make_hedged(proxy, direct)
+    assert hedged.login() == 'direct'
+    assert len(proxy.logins) == 1
+
+
+def test_slow_login_is_hedged_and_recorded_apart_from_queries():
+    proxy = make_transport('proxy', FakeSession('proxy'), login_delay=0.5)
+    direct = make_transport('direct', FakeSession('direct'))
+    for _ in range(5):
+        proxy.login_latency.record(0.01)
+    hedged = make_hedged(proxy, direct)
+    assert hedged.login() == 'direct'
+    assert direct.login_latency.percentile(0.5) == 2.0
+    assert direct.query_latency.percentile(0.5) is None
+    assert direct.stats()['query_latency_p90'] is None
+
+
+def test_login_fails_on_every_transport():
+    hedged = make_hedged(make_transport('proxy', None), make_transport('direct', None))
+    assert hedged.login() is None
@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+"""
+Camada de transporte para o ContaHub (direto ou via proxy) com requisições hedged
+Se o primeiro transporte não responder dentro de um percentil da sua latência,
+o próximo é disparado em paralelo e vale a primeira resposta bem-sucedida.
+Login e /query têm latências próprias; a /query só é hedged depois de haver
+amostras suficientes (antes disso só troca de transporte em caso de falha)
+"""
+import time
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from contahub_session import ContaHubSessionManager
+
+logger = logging.getLogger(__name__)
+
+REJECTED_STATUS = (401, 403, 440)
+
+
+class TransportError(Exception):
+    """Falha de um transporte (login ou requisição)"""
+
+
+class LatencyTracker:
+    """Janela deslizante de latências para calcular percentis
+
+    default: valor enquanto houver menos de min_samples amostras (None = desconhecido)
+    """
+
+    def __init__(self, window=200, default=2.0, min_samples=5):
+        self.default = default
+        self.min_samples = min_samples
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, p):
+        """Percentil p (0-1) das latências; usa o padrão enquanto houver poucas amostras"""
+        with self._lock:
+            if len(self._samples) < self.min_samples:
+                return self.default
+            samples = sorted(self._samples)
+        index = min(len(samples) - 1, int(p * len(samples)))
+        return samples[index]
+
+
+def _round(seconds):
+    return round(seconds, 3) if seconds is not None else None
+
+
+class Transport:
+    """Rota até o ContaHub com sessão autenticada própria
+
+    login_latency mede só os logins efetivos; query_latency, os POSTs. Sem
+    amostras, o login usa default_login_latency e a /query não tem latência
+    conhecida (não é hedged).
+    """
+
+    def __init__(self, name, login_method, max_age=3600, max_idle=900, default_login_latency=2.0):
+        self.name = name
+        self.login_latency = LatencyTracker(default=default_login_latency)
+        self.query_latency = LatencyTracker(default=None)
+        self.sessions = ContaHubSessionManager([self._timed(login_method)], max_age=max_age, max_idle=max_idle)
+        self.requests = 0
+        self.failures = 0
+
+    def _timed(self, login_method):
+        """Envolve o método de login registrando a duração dos logins bem-sucedidos"""
+        def login():
+            started = time.time()
+            session = login_method()
+            if session is not None:
+                self.login_latency.record(time.time() - started)
+            return session
+        login.__name__ = getattr(login_method, '__name__', 'login')
+        return login
+
+    def login(self):
+        """Garante uma sessão autenticada neste transporte"""
+        session = self.sessions.get_session()
+        if not session:
+            raise TransportError(f"Login via {self.name} falhou")
+        return session
+
+    def post(self, url, **kwargs):
+        """POST pela sessão do transporte, refazendo login uma vez se a sessão for rejeitada"""
+        self.requests += 1
+        for attempt in range(2):
+            session = self.login()
+            started = time.time()
+            response = session.post(url, **kwargs)
+            self.query_latency.record(time.time() - started)
+            if response.status_code in REJECTED_STATUS and attempt == 0:
+                logger.warning(f"Transporte {self.name}: sessão rejeitada ({response.status_code}), refazendo login")
+                response.close()
+                self.sessions.invalidate(session)
+                continue
+            return response
+        return response
+
+    def stats(self):
+        return {
+            'requests': self.requests,
+            'failures': self.failures,
+            'login_latency_p50': _round(self.login_latency.percentile(0.5)),
+            'login_latency_p90': _round(self.login_latency.percentile(0.9)),
+            'query_latency_p50': _round(self.query_latency.percentile(0.5)),
+            'query_latency_p90': _round(self.query_latency.percentile(0.9)),
+            'session': self.sessions.stats()
+        }
+
+
+def _close_result(result):
+    """Fecha uma resposta descartada (libera a conexão de respostas em streaming)"""
+    close = getattr(result, 'close', None)
+    if close:
+        try:
+            close()
+        except Exception:
+            pass
+
+
+def _close_future(future):
+    """Fecha a resposta de uma requisição perdedora quando ela terminar"""
+    try:
+        result = future.result()
+    except Exception:
+        return
+    _close_result(result)
+
+
+class HedgedSession:
+    """Sessão hedged sobre vários transportes, compatível com o uso de session.post() no pipeline
+
+    Os transportes são tentados na ordem dada. O próximo transporte é disparado
+    se o atual falhar ou não responder dentro do percentil `percentile` da
+    latência observada do transporte anterior para a operação (login ou
+    /query), limitado a [min_delay, max_delay]. Sem latência conhecida, só
+    uma falha dispara o próximo.
+    max_workers deve cobrir as chamadas simultâneas vezes o número de transportes.
+    """
+
+    def __init__(self, transports, percentile=0.9, min_delay=0.5, max_delay=30.0, max_workers=32):
+        self.transports = list(transports)
+        self.percentile = percentile
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='hedge')
+        self._lock = threading.Lock()
+        self.hedges = 0
+        self.wins = {transport.name: 0 for transport in self.transports}
+
+    def _hedge_delay(self, tracker):
+        delay = tracker.percentile(self.percentile)
+        if delay is None:
+            return None
+        return min(self.max_delay, max(self.min_delay, delay))
+
+    def _hedged(self, call, is_success, operation, latency, close_losers=True):
+        """Executa call(transport) com hedging; retorna (nome_do_transporte, resultado)
+
+        latency(transport): LatencyTracker da operação que define o atraso do hedge
+        close_losers: fecha os resultados descartados (respostas HTTP, não sessões)
+        """
+        pending = {}
+        queue = list(self.transports)
+        last_result = None
+        last_error = None
+
+        def launch():
+            transport = queue.pop(0)
+            pending[self._executor.submit(call, transport)] = transport
+            return transport
+
+        current = launch()
+        while pending:
+            timeout = self._hedge_delay(latency(current)) if queue else None
+            done, _ = wait(list(pending), timeout=timeout, return_when=FIRST_COMPLETED)
+
+            if not done:
+                # Sem resposta dentro do percentil: disparar o próximo transporte em paralelo
+                with self._lock:
+                    self.hedges += 1
+                logger.info(f"⏱️ {operation} via {current.name} lento, disparando {queue[0].name} em paralelo")
+                current = launch()
+                continue
+
+            for future in done:
+                transport = pending.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    transport.failures += 1
+                    last_error = e
+                    logger.warning(f"{operation} via {transport.name} falhou: {str(e)}")
+                    continue
+
+                if is_success(result):
+                    with self._lock:
+                        self.wins[transport.name] += 1
+                    if close_losers:
+                        for loser in pending:
+                            loser.add_done_callback(_close_future)
+                    return transport.name, result
+
+                transport.failures += 1
+                if close_losers and last_result is not None:
+                    _close_result(last_result)
+                last_result = result
+
+            # Falha rápida: não esperar o percentil para tentar o próximo
+            if queue and not pending:
+                current = launch()
+
+        if last_result is not None:
+            return None, last_result
+        raise TransportError(f"{operation} falhou em todos os transportes: {str(last_error)}")
+
+    def login(self):
+        """Login hedged: retorna o nome do primeiro transporte autenticado ou None"""
+        try:
+            name, _ = self._hedged(
+                lambda transport: transport.login(),
+                lambda session: session is not None,
+                'Login',
+                lambda transport: transport.login_latency,
+                close_losers=False
+            )
+            return name
+        except TransportError as e:
+            logger.error(f"❌ {str(e)}")
+            return None
+
+    def post(self, url, **kwargs):
+        """POST hedged; retorna a primeira resposta 200 (ou a última resposta se nenhuma for 200)"""
+        _, response = self._hedged(
+            lambda transport: transport.post(url, **kwargs),
+            lambda response: response.status_code == 200,
+            'Requisição',
+            lambda transport: transport.query_latency
+        )
+        return response
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hedges': self.hedges,
+                'wins': dict(self.wins),
+                'transports': {transport.name: transport.stats() for transport in self.transports}
+            }
+
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Marcas d'água de sincronização incremental
+Guarda, por módulo, a última data sincronizada em um SQLite local, além do
+cursor da última página gravada na busca paginada (para retomar após falhas)
+"""
+import os
+import json
+import sqlite3
+import logging
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+
+class WatermarkStore:
+    """Persistência da última data sincronizada por módulo"""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.executescript("""
+                CREATE TABLE IF NOT EXISTS watermarks (
+                    module TEXT PRIMARY KEY,
+                    synced_until TEXT NOT NULL,
+                    updated_at TEXT NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS page_cursors (
+                    module TEXT NOT NULL,
+                    period_start TEXT NOT NULL,
+                    period_end TEXT NOT NULL,
+                    cursor TEXT NOT NULL,
+                    rows INTEGER NOT NULL,
+                    updated_at TEXT NOT NULL,
+                    PRIMARY KEY (module, period_start, period_end)
+                );
+            """)
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def get(self, module_name):
+        """Retorna a última data sincronizada ('YYYY-MM-DD') ou None"""
+        with self._lock, self._connect() as conn:
+            row = conn.execute(
+                "SELECT synced_until FROM watermarks WHERE module = ?", (module_name,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def set(self, module_name, synced_until):
+        """Avança a marca d'água do módulo (nunca retrocede)"""
+        with self._lock, self._connect() as conn:
+            conn.execute("""
+                INSERT INTO watermarks (module, synced_until, updated_at) VALUES (?, ?, ?)
+                ON CONFLICT(module) DO UPDATE SET
+                    synced_until = MAX(watermarks.synced_until, excluded.synced_until),
+                    updated_at = excluded.updated_at
+            """, (module_name, synced_until, datetime.now().isoformat()))
+        logger.info(f"Marca d'água de {module_name} atualizada para {synced_until}")
+
+    def get_cursor(self, module_name, start_date, end_date):
+        """Cursor da última página gravada do módulo/período: (valores_da_chave, registros) ou None"""
+        with self._lock, self._connect() as conn:
+            row = conn.execute(
+                "SELECT cursor, rows FROM page_cursors WHERE module = ? AND period_start = ? AND period_end = ?",
+                (module_name, start_date, end_date)
+            ).fetchone()
+        return (json.loads(row[0]), row[1]) if row else None
+
+    def set_cursor(self, module_name, start_date, end_date, cursor, rows):
+        """Salva o cursor após uma página gravada com sucesso"""
+        with self._lock, self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO page_cursors (module, period_start, period_end, cursor, rows, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (module_name, start_date, end_date, json.dumps(cursor), rows, datetime.now().isoformat())
+            )
+
+    def clear_cursor(self, module_name, start_date, end_date):
+        """Remove o cursor quando a busca paginada do período termina"""
+        with self._lock, self._connect() as conn:
+            conn.execute(
+                "DELETE FROM page_cursors WHERE module = ? AND period_start = ? AND period_end = ?",
+                (module_name, start_date, end_date)
+            )
+
+    def all(self):
+        with self._lock, self._connect() as conn:
+            rows = conn.execute("SELECT module, synced_until, updated_at FROM watermarks").fetchall()
+        return {module: {'synced_until': synced, 'updated_at': updated} for module, synced, updated in rows}